@@ -0,0 +1,196 @@
+"""
+Open-loop load test for the real-time scoring path.
+
+Synthetic transactions are replayed through ``ScoringClient`` (the client
+the Streamlit app uses) at a target rate with Poisson arrivals. The arrival
+schedule is fixed up front and never waits for responses, and latency is
+measured from each request's *scheduled* send time, so a slow endpoint
+shows up as growing latency instead of silently lowering the offered load
+(coordinated omission).
+
+    # against a local stand-in with injected latency and failures
+    python -m benchmarks.load_test --stand-in --rate 200 --duration 30 --latency-ms 20 --error-rate 0.01
+
+    # against a deployed endpoint
+    python -m benchmarks.load_test --rate 50 --duration 60 --endpoint-name fraud-detection-endpoint
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from ml_pipeline.scoring.endpoint_client import DEFAULT_ENDPOINT_NAME, ScoringClient, create_runtime
+
+PERCENTILES = (50, 95, 99)
+
+
+def poisson_schedule(rate, duration, seed=None):
+    """
+    Send offsets in seconds of a Poisson arrival process at ``rate``
+    requests/second over ``duration`` seconds
+    """
+    rng = np.random.default_rng(seed)
+    # Draw a few extra gaps so the schedule almost surely covers the duration
+    n = int(rate * duration + 10 * np.sqrt(rate * duration) + 10)
+    offsets = np.cumsum(rng.exponential(1.0 / rate, n))
+    return offsets[offsets < duration]
+
+
+def replay_records(n_records, seed=0, scenarios=False):
+    """
+    Feature-complete synthetic transactions to replay, as JSON-ready dicts
+
+    With ``scenarios`` the records are the first ``n_records`` of a
+    simulated card population in time order, with repeat cards and fraud
+    bursts, instead of independent rows.
+    """
+    from data.generate_synthetic_data import generate_transaction_data
+    from data.simulate_scenarios import expected_rows, simulate_transactions
+    from ml_pipeline.scoring.batch_score import PAYLOAD_COLUMNS, prepare_transactions
+
+    if scenarios:
+        # A day of spending from enough cards to cover the records
+        raw = simulate_transactions(max(2 * n_records * 1000 // expected_rows(1000, days=1), 100),
+                                    days=1, seed=seed).head(n_records)
+    else:
+        raw = generate_transaction_data(n_samples=n_records, fraud_ratio=0.01, fast=True, seed=seed)
+    transactions = prepare_transactions(raw)
+    transactions["timestamp"] = transactions["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return transactions[PAYLOAD_COLUMNS].to_dict("records")
+
+
+def _error_name(error):
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code or type(error).__name__
+
+
+async def _replay(client, records, schedule):
+    start = time.perf_counter() + 0.05
+    results = [None] * len(schedule)
+
+    async def send(i, scheduled):
+        try:
+            await client.apredict(records[i % len(records)])
+            error = None
+        except Exception as e:
+            error = _error_name(e)
+        results[i] = (scheduled, time.perf_counter(), error)
+
+    tasks = []
+    for i, offset in enumerate(schedule):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Latency is measured from the intended send time, even if the
+        # event loop fell behind the schedule
+        tasks.append(asyncio.create_task(send(i, start + offset)))
+    await asyncio.gather(*tasks)
+    return start, results
+
+
+def run_load(client, records, rate, duration, interval=1.0, seed=None):
+    """
+    Replay ``records`` through ``client`` and return an overall summary plus
+    one summary per ``interval`` seconds of the schedule
+    """
+    schedule = poisson_schedule(rate, duration, seed)
+    start, results = asyncio.run(_replay(client, records, schedule))
+    latencies = np.array([finished - scheduled for scheduled, finished, _ in results]) * 1000.0
+    errors = np.array([result[2] or "" for result in results], dtype=object)
+
+    timeline = []
+    buckets = (schedule // interval).astype(np.int64)
+    for bucket in range(int(np.ceil(duration / interval))):
+        mask = buckets == bucket
+        timeline.append({"start_s": bucket * interval, **summarize(latencies[mask], errors[mask], interval)})
+    summary = summarize(latencies, errors, duration)
+    finished = max((result[1] for result in results), default=start)
+    summary.update({"target_rate": rate, "duration_s": duration, "wall_s": finished - start})
+    return {"summary": summary, "timeline": timeline}
+
+
+def summarize(latencies_ms, errors, seconds):
+    """
+    Throughput, error rate and latency percentiles of a set of requests
+    """
+    n = len(latencies_ms)
+    failed = errors != ""
+    summary = {
+        "requests": int(n),
+        "offered_rate": n / seconds if seconds else 0.0,
+        "errors": int(failed.sum()),
+        "error_rate": float(failed.mean()) if n else 0.0,
+        "error_types": {name: int((errors == name).sum()) for name in sorted(set(errors[failed]))},
+    }
+    ok = latencies_ms[~failed]
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = float(np.percentile(ok, p)) if len(ok) else None
+    summary["max_ms"] = float(ok.max()) if len(ok) else None
+    return summary
+
+
+def format_row(row):
+    def ms(value):
+        return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+    return (f"{row['requests']:>8,} {row['offered_rate']:>9.1f}/s {row['error_rate']:>7.2%} "
+            + " ".join(ms(row[f"p{p}_ms"]) for p in PERCENTILES) + f" {ms(row['max_ms'])}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Open-loop load test of the scoring endpoint")
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds per timeline row")
+    parser.add_argument("--records", type=int, default=10000, help="distinct transactions to replay")
+    parser.add_argument("--scenarios", action="store_true",
+                        help="replay a time-ordered simulated card population instead of independent rows")
+    parser.add_argument("--endpoint-name", default=DEFAULT_ENDPOINT_NAME)
+    parser.add_argument("--endpoint-url", help="send requests to this URL instead of SageMaker")
+    parser.add_argument("--max-connections", type=int, default=64)
+    parser.add_argument("--max-attempts", type=int, default=1, help="botocore attempts per request")
+    parser.add_argument("--stand-in", action="store_true", help="start a local stand-in endpoint")
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    endpoint_url = args.endpoint_url
+    if args.stand_in:
+        from ml_pipeline.scoring.stand_in_endpoint import StandInEndpoint, default_endpoint, start_stand_in
+
+        stand_in = StandInEndpoint(
+            default_endpoint(), args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.seed)
+        server = start_stand_in(stand_in)
+        endpoint_url = f"http://127.0.0.1:{server.server_address[1]}"
+        # The stand-in does not check signatures, but botocore needs credentials to sign
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "stand-in")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stand-in")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    runtime = create_runtime(args.max_connections, max_attempts=args.max_attempts, endpoint_url=endpoint_url)
+    # No prediction cache or coalescing: every replayed request must reach the endpoint
+    client = ScoringClient(runtime, args.endpoint_name, cache_size=0, max_pool_connections=args.max_connections,
+                           coalesce=False)
+    report = run_load(client, replay_records(args.records, args.seed, args.scenarios), args.rate, args.duration,
+                      args.interval, args.seed)
+    client.close()
+
+    print(f"{'t (s)':>6} {'requests':>8} {'offered':>11} {'errors':>7} "
+          + " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES) + f" {'max ms':>9}")
+    for row in report["timeline"]:
+        print(f"{row['start_s']:>6.0f} {format_row(row)}")
+    print(f"{'total':>6} {format_row(report['summary'])}")
+    for name, count in report["summary"]["error_types"].items():
+        print(f"{count:>14,} x {name}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,333 @@
+"""
+Offline benchmarks for the data and scoring hot paths.
+
+Every case runs at several data sizes, each in a fresh process so peak RSS
+is measured per case. Input data is prepared before timing starts; the
+best of ``--repeats`` timed runs is reported as rows/second. Results are
+written to JSON and, when a baseline file exists, compared against it:
+
+    python -m benchmarks.run_benchmarks --output benchmarks/results.json
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+
+``--quick`` runs every case at its smallest size only, as CI does.
+
+A case is a regression when it fails, its throughput drops by more than
+``--tolerance`` or its peak RSS grows by more than ``--memory-tolerance``;
+the runner then exits non-zero. A failed case does so even without a
+baseline; skipped cases (e.g. optional dependencies missing) do not.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+DEFAULT_SIZES = {
+    "generate_fast": [10_000, 100_000, 1_000_000],
+    "generate_faker": [1_000, 5_000],
+    "simulate_scenarios": [100_000, 1_000_000],
+    "clean_data_local": [10_000, 100_000, 1_000_000],
+    "clean_data_spark": [10_000, 100_000, 1_000_000],
+    "encode_features": [10_000, 100_000, 1_000_000],
+    "score_batch": [10_000, 100_000, 1_000_000],
+    "score_record": [1_000, 10_000],
+    "profile_record": [10_000, 100_000],
+}
+
+# Smallest size of every case, for CI runs
+QUICK_SIZES = {name: sizes[:1] for name, sizes in DEFAULT_SIZES.items()}
+
+
+class BenchmarkSkipped(Exception):
+    pass
+
+
+def _raw_data(rows):
+    from data.generate_synthetic_data import generate_transaction_data
+    return generate_transaction_data(n_samples=rows, fraud_ratio=0.01, fast=True, seed=0)
+
+
+def _training_model():
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.scoring.local_model import LocalModel
+    return LocalModel.train(clean_data(_raw_data(20_000)))
+
+
+def setup_generate(rows):
+    return rows
+
+
+def run_generate_fast(rows):
+    from data.generate_synthetic_data import generate_transaction_data
+    generate_transaction_data(n_samples=rows, fraud_ratio=0.01, fast=True, seed=0)
+
+
+def run_generate_faker(rows):
+    from data.generate_synthetic_data import generate_transaction_data
+    # The Faker path draws from the global generators and takes no seed
+    generate_transaction_data(n_samples=rows, fraud_ratio=0.01, fast=False)
+
+
+def setup_simulate(rows):
+    from data.simulate_scenarios import expected_rows
+    # Cards whose expected spending over the default window is ``rows``
+    return max(rows * 1000 // expected_rows(1000), 1)
+
+
+def run_simulate(n_cards):
+    from data.simulate_scenarios import simulate_transactions
+    simulate_transactions(n_cards, seed=0)
+
+
+def setup_clean_local(rows):
+    # Raw CSV round trip so column types match what the ETL reads
+    from ml_pipeline.scoring.batch_score import read_uploaded_file
+    return read_uploaded_file(_raw_data(rows).to_csv(index=False).encode(), "raw.csv")
+
+
+def run_clean_local(raw):
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    clean_data(raw)
+
+
+def setup_clean_spark(rows):
+    try:
+        from pyspark.sql import SparkSession
+        spark = SparkSession.builder.master("local[*]").appName("fraudsage-benchmarks").getOrCreate()
+    except Exception as e:
+        raise BenchmarkSkipped(f"Spark unavailable: {e}")
+    raw = _raw_data(rows)
+    raw["timestamp"] = raw["timestamp"].astype(str)
+    df = spark.createDataFrame(raw).cache()
+    df.count()
+    return df
+
+
+def run_clean_spark(df):
+    from ml_pipeline.glue_jobs.etl_job import clean_data
+    # The noop sink executes the whole plan without writing output
+    clean_data(df).write.format("noop").mode("overwrite").save()
+
+
+def setup_encode(rows):
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    return _training_model(), clean_data(_raw_data(rows))
+
+
+def run_encode(state):
+    model, df = state
+    model.encoder.transform(df)
+
+
+def setup_score_batch(rows):
+    model, df = setup_encode(rows)
+    return model, model.encoder.transform(df)
+
+
+def run_score_batch(state):
+    model, X = state
+    model.predict_proba(X)
+
+
+def setup_score_record(rows):
+    model, df = setup_encode(rows)
+    return model, df.to_dict("records")
+
+
+def run_score_record(state):
+    model, records = state
+    for record in records:
+        model.predict_record(record)
+
+
+def setup_profile_record(rows):
+    import tempfile
+    from ml_pipeline.features.profiles import Profiles, build_profiles
+    from ml_pipeline.glue_jobs.local_etl import run_local_etl
+    directory = tempfile.mkdtemp(prefix="profile-bench-")
+    raw = _raw_data(rows)
+    raw.to_csv(os.path.join(directory, "raw.csv"), index=False)
+    run_local_etl(os.path.join(directory, "raw.csv"), os.path.join(directory, "processed"))
+    build_profiles(os.path.join(directory, "processed"), os.path.join(directory, "profiles"))
+    # Records as the frontend sends them, with the raw card number
+    records = raw.assign(card_number=raw["card_number"].astype(str)).to_dict("records")
+    return Profiles(os.path.join(directory, "profiles")), records
+
+
+def run_profile_record(state):
+    profiles, records = state
+    for record in records:
+        profiles.enrich_record(record)
+
+
+CASES = {
+    "generate_fast": (setup_generate, run_generate_fast),
+    "generate_faker": (setup_generate, run_generate_faker),
+    "simulate_scenarios": (setup_simulate, run_simulate),
+    "clean_data_local": (setup_clean_local, run_clean_local),
+    "clean_data_spark": (setup_clean_spark, run_clean_spark),
+    "encode_features": (setup_encode, run_encode),
+    "score_batch": (setup_score_batch, run_score_batch),
+    "score_record": (setup_score_record, run_score_record),
+    "profile_record": (setup_profile_record, run_profile_record),
+}
+
+
+def _reset_peak_rss():
+    # Linux lets a process reset its high-water mark so the peak covers the
+    # timed runs only; elsewhere the peak includes setup
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_case(name, rows, repeats, queue):
+    setup, run = CASES[name]
+    try:
+        state = setup(rows)
+    except BenchmarkSkipped as e:
+        queue.put({"case": name, "rows": rows, "status": "skipped", "reason": str(e)})
+        return
+    gc.collect()
+    _reset_peak_rss()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    queue.put({
+        "case": name,
+        "rows": rows,
+        "status": "ok",
+        "seconds": best,
+        "rows_per_second": rows / best if best else float("inf"),
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+
+
+def run_case(name, rows, repeats=3):
+    """
+    Run one case at one size in a fresh process and return its result
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(name, rows, repeats, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {"case": name, "rows": rows, "status": "failed", "reason": f"exit code {process.exitcode}"}
+    return queue.get()
+
+
+def run_benchmarks(cases=None, sizes=None, repeats=3, log=print, quick=False):
+    """
+    Run the selected cases (all by default) at their sizes, or only at
+    their smallest size with ``quick``
+    """
+    default_sizes = QUICK_SIZES if quick else DEFAULT_SIZES
+    results = []
+    for name in cases or CASES:
+        for rows in (sizes or default_sizes[name]):
+            result = run_case(name, rows, repeats)
+            results.append(result)
+            if log is not None:
+                log(format_result(result))
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def format_result(result):
+    label = f"{result['case']:<18} {result['rows']:>10,}"
+    if result["status"] != "ok":
+        return f"{label}  {result['status']}: {result.get('reason', '')}"
+    return (f"{label}  {result['rows_per_second']:>14,.0f} rows/s  "
+            f"{result['seconds']:>8.3f}s  {result['peak_rss_mb']:>8.1f} MB")
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2, memory_tolerance=0.25):
+    """
+    Return the cases that failed or got slower or bigger than the baseline
+    allows
+    """
+    reference = {
+        (result["case"], result["rows"]): result
+        for result in baseline["results"] if result["status"] == "ok"
+    }
+    regressions = []
+    for result in report["results"]:
+        if result["status"] == "failed":
+            # A case that crashed (e.g. ran out of memory) is the worst regression
+            regressions.append({**result, "metric": "status", "baseline": "ok"})
+            continue
+        expected = reference.get((result["case"], result["rows"]))
+        if expected is None or result["status"] != "ok":
+            continue
+        if result["rows_per_second"] < expected["rows_per_second"] * (1 - tolerance):
+            regressions.append({**result, "metric": "rows_per_second", "baseline": expected["rows_per_second"]})
+        if result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + memory_tolerance):
+            regressions.append({**result, "metric": "peak_rss_mb", "baseline": expected["peak_rss_mb"]})
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the generator, ETL and scoring hot paths")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, help="override the per-case data sizes")
+    parser.add_argument("--quick", action="store_true", help="run every case at its smallest size only")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline to this path")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative throughput drop")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed relative peak RSS growth")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmarks(args.cases, args.sizes, args.repeats, quick=args.quick)
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # Failed cases fail the run with or without a baseline; skipped ones do not
+    failures = [result for result in report["results"] if result["status"] == "failed"]
+    for failure in failures:
+        print(f"FAILED {failure['case']} at {failure['rows']:,} rows: {failure['reason']}")
+    if args.save_baseline or not os.path.exists(args.baseline):
+        sys.exit(1 if failures else 0)
+    with open(args.baseline) as f:
+        regressions = compare_to_baseline(report, json.load(f), args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        if regression["metric"] == "status":
+            continue
+        print(f"REGRESSION {regression['case']} at {regression['rows']:,} rows: "
+              f"{regression['metric']} {regression[regression['metric']]:,.1f} vs baseline {regression['baseline']:,.1f}")
+    sys.exit(1 if regressions else 0)
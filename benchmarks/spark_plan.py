@@ -0,0 +1,129 @@
+"""
+Local-mode Spark benchmark of the Glue ETL plan.
+
+Runs the raw CSV read and ``clean_data`` transform over a few million
+generated rows twice, in fresh sessions:
+
+* ``legacy``    - schema inference on read, eleven chained ``withColumn``
+  calls and an inline country ``isin``, adaptive execution off (the plan
+  the Glue job used to build)
+* ``optimized`` - explicit read schema, casts, fills and every derived
+  column in one projection, adaptive execution on (``etl_job``)
+
+Both feed the same velocity windows and end in a ``noop`` sink, so the
+whole plan executes without writing output. The best of ``--repeats``
+runs is reported along with the number of projections in each analyzed
+plan:
+
+    python -m benchmarks.spark_plan --rows 3000000 --output benchmarks/spark_plan.json
+"""
+import argparse
+import json
+import os
+import time
+
+from data.generate_synthetic_data import write_sharded_dataset
+from ml_pipeline.features.schema import hash_card_numbers_spark
+from ml_pipeline.features.velocity import add_velocity_features_spark
+from ml_pipeline.glue_jobs import etl_job
+from ml_pipeline.glue_jobs.local_etl import OUTPUT_COLUMNS
+
+CSV_OPTIONS = {"header": True, "multiLine": True, "escape": '"'}
+
+
+def legacy_clean_data(df):
+    """
+    The transform as chained column-at-a-time steps
+    """
+    from pyspark.sql import functions as F
+
+    df = df.withColumn("timestamp", F.to_timestamp("timestamp"))
+    df = df.na.fill("unknown", ["merchant_category", "merchant_name", "merchant_city", "merchant_country"])
+    df = df.na.fill(0, ["amount"])
+    df = df.dropDuplicates(["transaction_id"])
+    df = df.withColumn("hour", F.hour("timestamp"))
+    df = df.withColumn("day_of_week", F.dayofweek("timestamp"))
+    df = df.withColumn("month", F.month("timestamp"))
+    df = df.withColumn("is_weekend", F.when(F.col("day_of_week").isin(1, 7), 1).otherwise(0))
+    df = df.withColumn("is_night", F.when((F.col("hour") >= 22) | (F.col("hour") <= 5), 1).otherwise(0))
+    df = df.withColumn("amount_log", F.log(F.col("amount") + 1))
+    df = df.withColumn("is_high_risk_country",
+                       F.when(F.col("merchant_country").isin(["Russia", "China", "Nigeria", "Brazil"]), 1)
+                       .otherwise(0))
+    df = df.withColumn("is_online_transaction", F.when(F.col("transaction_type") == "online", 1).otherwise(0))
+    df = df.withColumn("is_mobile_device", F.when(F.col("device_type") == "mobile", 1).otherwise(0))
+    df = df.withColumn("card_hash", hash_card_numbers_spark(F.col("card_number")))
+    df = df.withColumn("is_fraud", F.col("is_fraud").cast("int"))
+    return add_velocity_features_spark(df).select(OUTPUT_COLUMNS)
+
+
+def legacy_plan(spark, path):
+    spark.conf.set("spark.sql.adaptive.enabled", "false")
+    raw = spark.read.options(inferSchema=True, **CSV_OPTIONS).csv(path)
+    return legacy_clean_data(raw)
+
+
+def optimized_plan(spark, path):
+    etl_job.configure_spark(spark)
+    return etl_job.clean_data(etl_job.read_raw(spark, path))
+
+
+PLANS = {"legacy": legacy_plan, "optimized": optimized_plan}
+
+
+def count_projections(df):
+    plan = df._jdf.queryExecution().analyzed().toString()
+    return sum(1 for line in plan.splitlines() if line.lstrip(" +-:").startswith("Project "))
+
+
+def run_plan(name, path, repeats=3, shuffle_partitions=64):
+    """
+    Best wall time of building and executing one plan, in a fresh session
+    """
+    from pyspark.sql import SparkSession
+
+    spark = (SparkSession.builder.master("local[*]").appName(f"fraudsage-plan-{name}")
+             .config("spark.sql.shuffle.partitions", shuffle_partitions)
+             .config("spark.driver.memory", "4g")
+             .getOrCreate())
+    try:
+        timings = []
+        projections = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            # Building the plan is timed too: inference scans the input
+            df = PLANS[name](spark, path)
+            df.write.format("noop").mode("overwrite").save()
+            timings.append(time.perf_counter() - started)
+            projections = count_projections(df)
+        return {"seconds": min(timings), "runs": timings, "projections": projections}
+    finally:
+        spark.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the legacy and optimized Spark ETL plans")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--data-dir", default="/tmp/fraudsage-spark-plan")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--shuffle-partitions", type=int, default=64)
+    parser.add_argument("--output", help="write results as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    data_path = os.path.join(args.data_dir, f"raw-{args.rows}")
+    if not os.path.isdir(data_path):
+        write_sharded_dataset(args.rows, data_path, file_format="csv")
+    results = {"rows": args.rows}
+    for name in PLANS:
+        results[name] = run_plan(name, data_path, args.repeats, args.shuffle_partitions)
+        print(f"{name:<10} {results[name]['seconds']:8.2f} s  "
+              f"{args.rows / results[name]['seconds']:>12,.0f} rows/s  "
+              f"{results[name]['projections']} projections")
+    results["speedup"] = results["legacy"]["seconds"] / results["optimized"]["seconds"]
+    print(f"Speedup: {results['speedup']:.2f}x")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,32 +1,65 @@
+import argparse
+import os
 import pandas as pd
 import numpy as np
+import pyarrow.dataset as ds
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 import random
 from faker import Faker
 
+from ml_pipeline.features.schema import (
+    DEVICE_TYPES, MERCHANT_CATEGORIES, TRANSACTION_TYPES, apply_pandas_schema, to_arrow_table
+)
+from ml_pipeline.features.transaction_features import (
+    HIGH_RISK_COUNTRIES, TIME_FEATURES, add_features_pandas
+)
+from ml_pipeline.monitoring import tracing
+
 # Initialize Faker for generating realistic data
 fake = Faker()
 
-def generate_transaction_data(n_samples=10000, fraud_ratio=0.01):
+# Number of distinct Faker values pre-sampled per column in fast mode
+DEFAULT_POOL_SIZE = 5000
+
+# Sharded writer defaults: rows per worker task and rows held in memory at once
+DEFAULT_SHARD_SIZE = 1000000
+DEFAULT_CHUNK_SIZE = 250000
+
+# End of the timestamp window of seeded runs that do not pass ``now``, so the
+# same seed always produces the same rows
+SEEDED_NOW = pd.Timestamp('2024-07-01')
+
+@tracing.traced('generate.transaction_data')
+def generate_transaction_data(n_samples=10000, fraud_ratio=0.01, fast=False, seed=None):
     """
     Generate synthetic credit card transaction data with realistic fraud patterns
+
+    With ``fast=True`` the columns are drawn from pre-sampled Faker pools with
+    NumPy indexing instead of calling Faker once per row, see
+    ``generate_transaction_data_fast``. ``seed`` only applies to the fast
+    path; the Faker path draws from the global generators.
     """
+    if fast:
+        return generate_transaction_data_fast(n_samples, fraud_ratio, seed=seed)
+
     # Generate base transaction data
     data = {
         'transaction_id': [f'TXN{i:08d}' for i in range(n_samples)],
         'timestamp': [fake.date_time_between(start_date='-30d', end_date='now') for _ in range(n_samples)],
         'amount': np.random.lognormal(mean=4, sigma=1, size=n_samples),
-        'merchant_category': np.random.choice(['retail', 'food', 'travel', 'entertainment', 'utilities'], size=n_samples),
+        'merchant_category': np.random.choice(MERCHANT_CATEGORIES, size=n_samples),
         'card_number': [fake.credit_card_number() for _ in range(n_samples)],
         'cardholder_name': [fake.name() for _ in range(n_samples)],
         'cardholder_address': [fake.address() for _ in range(n_samples)],
         'merchant_name': [fake.company() for _ in range(n_samples)],
         'merchant_city': [fake.city() for _ in range(n_samples)],
         'merchant_country': [fake.country() for _ in range(n_samples)],
-        'transaction_type': np.random.choice(['online', 'in_store', 'atm'], size=n_samples),
-        'device_type': np.random.choice(['mobile', 'desktop', 'pos_terminal', 'atm'], size=n_samples),
+        'transaction_type': np.random.choice(TRANSACTION_TYPES, size=n_samples),
+        'device_type': np.random.choice(DEVICE_TYPES, size=n_samples),
         'ip_address': [fake.ipv4() for _ in range(n_samples)],
-        'is_fraud': np.zeros(n_samples, dtype=int)
+        'is_fraud': np.zeros(n_samples, dtype=np.uint8)
     }
     
     # Convert to DataFrame
@@ -41,21 +74,188 @@ def generate_transaction_data(n_samples=10000, fraud_ratio=0.01):
         # Randomly modify some features to indicate fraud
         df.loc[idx, 'is_fraud'] = 1
         df.loc[idx, 'amount'] *= np.random.uniform(2, 10)  # Larger amounts
-        df.loc[idx, 'merchant_country'] = np.random.choice(['Russia', 'China', 'Nigeria', 'Brazil'])  # High-risk countries
+        df.loc[idx, 'merchant_country'] = np.random.choice(list(HIGH_RISK_COUNTRIES))  # High-risk countries
         df.loc[idx, 'device_type'] = 'mobile'  # Mobile transactions are more common in fraud
         df.loc[idx, 'transaction_type'] = 'online'  # Online transactions are more common in fraud
     
     # Add derived features
-    df['hour'] = df['timestamp'].dt.hour
-    df['day_of_week'] = df['timestamp'].dt.dayofweek
-    df['month'] = df['timestamp'].dt.month
-    df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
-    df['is_night'] = ((df['hour'] >= 22) | (df['hour'] <= 5)).astype(int)
+    df = add_features_pandas(df, TIME_FEATURES)
     
     # Add some noise to make the data more realistic
     df['amount'] = df['amount'].round(2)
-    
-    return df
+
+    # Compact dtypes from the shared schema
+    return apply_pandas_schema(df)
+
+@lru_cache(maxsize=4)
+def build_value_pools(pool_size=DEFAULT_POOL_SIZE, seed=0):
+    """
+    Pre-sample Faker values for the free-text columns
+
+    Pools are cached per process so repeated calls (e.g. one per chunk) only
+    pay the Faker cost once.
+    """
+    pool_fake = Faker()
+    pool_fake.seed_instance(seed)
+    providers = {
+        'card_number': pool_fake.credit_card_number,
+        'cardholder_name': pool_fake.name,
+        'cardholder_address': pool_fake.address,
+        'merchant_name': pool_fake.company,
+        'merchant_city': pool_fake.city,
+        'merchant_country': pool_fake.country,
+        'ip_address': pool_fake.ipv4,
+    }
+    return {
+        column: np.array([provider() for _ in range(pool_size)], dtype=object)
+        for column, provider in providers.items()
+    }
+
+@tracing.traced('generate.fast')
+def generate_transaction_data_fast(n_samples=10000, fraud_ratio=0.01, seed=None,
+                                   start_index=0, pool_size=DEFAULT_POOL_SIZE, now=None,
+                                   n_fraud=None):
+    """
+    Vectorized variant of ``generate_transaction_data``
+
+    Produces the same columns and fraud semantics (exactly
+    ``int(n_samples * fraud_ratio)`` fraud rows) but builds every column with
+    NumPy: free-text fields are indexed out of pre-sampled Faker pools and the
+    fraud mutations are applied through a single boolean mask.
+    ``start_index`` offsets the transaction ids so chunks can be concatenated
+    and ``n_fraud`` overrides the fraud row count derived from the ratio.
+    Timestamps fall in the 30 days before ``now``, which defaults to
+    ``SEEDED_NOW`` for seeded runs and the current time otherwise.
+    """
+    rng = np.random.default_rng(seed)
+    pools = build_value_pools(pool_size)
+    if now is None:
+        now = SEEDED_NOW if seed is not None else datetime.now()
+    now = pd.Timestamp(now).as_unit('us')
+
+    # Generate base transaction data
+    ids = range(start_index, start_index + n_samples)
+    window_us = 30 * 24 * 3600 * 10**6
+    offsets = rng.integers(0, window_us, size=n_samples)
+    data = {
+        'transaction_id': np.array([f'TXN{i:08d}' for i in ids], dtype=object),
+        'timestamp': now - pd.to_timedelta(offsets, unit='us'),
+        'amount': rng.lognormal(mean=4, sigma=1, size=n_samples),
+        'merchant_category': np.asarray(MERCHANT_CATEGORIES, dtype=object)[
+            rng.integers(0, len(MERCHANT_CATEGORIES), size=n_samples)],
+    }
+    for column in ['card_number', 'cardholder_name', 'cardholder_address',
+                   'merchant_name', 'merchant_city', 'merchant_country']:
+        data[column] = pools[column][rng.integers(0, pool_size, size=n_samples)]
+    data['transaction_type'] = np.asarray(TRANSACTION_TYPES, dtype=object)[
+        rng.integers(0, len(TRANSACTION_TYPES), size=n_samples)]
+    data['device_type'] = np.asarray(DEVICE_TYPES, dtype=object)[
+        rng.integers(0, len(DEVICE_TYPES), size=n_samples)]
+    data['ip_address'] = pools['ip_address'][rng.integers(0, pool_size, size=n_samples)]
+
+    # Generate fraud cases as one boolean mask
+    if n_fraud is None:
+        n_fraud = int(n_samples * fraud_ratio)
+    is_fraud = np.zeros(n_samples, dtype=bool)
+    is_fraud[rng.choice(n_samples, n_fraud, replace=False)] = True
+
+    # Add fraud patterns
+    data['amount'][is_fraud] *= rng.uniform(2, 10, size=n_fraud)
+    data['merchant_country'][is_fraud] = np.asarray(HIGH_RISK_COUNTRIES, dtype=object)[
+        rng.integers(0, len(HIGH_RISK_COUNTRIES), size=n_fraud)]
+    data['device_type'][is_fraud] = 'mobile'
+    data['transaction_type'][is_fraud] = 'online'
+    data['is_fraud'] = is_fraud.astype(np.uint8)
+
+    df = pd.DataFrame(data)
+    df['timestamp'] = df['timestamp'].dt.as_unit('us')
+
+    # Add derived features
+    df = add_features_pandas(df, TIME_FEATURES)
+    df['amount'] = df['amount'].round(2)
+
+    # Compact dtypes from the shared schema
+    return apply_pandas_schema(df)
+
+def generate_chunks(n_samples, chunk_size=DEFAULT_CHUNK_SIZE, fraud_ratio=0.01, seed=0,
+                    start_index=0, shard_id=0, now=None):
+    """
+    Yield the rows ``[start_index, start_index + n_samples)`` as DataFrames of
+    at most ``chunk_size`` rows
+
+    Every chunk gets its own seed derived from ``(seed, shard_id, chunk_id)``,
+    so a shard is reproducible regardless of which worker generates it. Fraud
+    rows are allocated on the global row index, which keeps the total exactly
+    ``int(n_rows * fraud_ratio)`` across any chunk/shard split.
+    """
+    for chunk_id, offset in enumerate(range(0, n_samples, chunk_size)):
+        chunk_start = start_index + offset
+        chunk_rows = min(chunk_size, n_samples - offset)
+        n_fraud = (int((chunk_start + chunk_rows) * fraud_ratio)
+                   - int(chunk_start * fraud_ratio))
+        chunk_seed = np.random.SeedSequence(seed, spawn_key=(shard_id, chunk_id))
+        yield generate_transaction_data_fast(
+            chunk_rows, fraud_ratio, seed=chunk_seed, start_index=chunk_start,
+            now=now, n_fraud=n_fraud
+        )
+
+@tracing.traced('generate.write_shard')
+def write_shard(shard_id, start_index, n_samples, output_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+                fraud_ratio=0.01, seed=0, file_format='parquet', partition_cols=None, now=None):
+    """
+    Generate one shard chunk by chunk and write each chunk straight to disk
+    """
+    rows = 0
+    fraud = 0
+    chunks = generate_chunks(n_samples, chunk_size, fraud_ratio, seed=seed,
+                             start_index=start_index, shard_id=shard_id, now=now)
+    for chunk_id, chunk in enumerate(chunks):
+        ds.write_dataset(
+            to_arrow_table(chunk),
+            output_dir,
+            format=file_format,
+            partitioning=partition_cols or None,
+            partitioning_flavor='hive' if partition_cols else None,
+            basename_template=f'part-{shard_id:05d}-{chunk_id:05d}-{{i}}.{file_format}',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        rows += len(chunk)
+        fraud += int(chunk['is_fraud'].sum())
+    return {'shard_id': shard_id, 'rows': rows, 'fraud': fraud}
+
+@tracing.traced('generate.sharded_dataset')
+def write_sharded_dataset(n_samples, output_dir, fraud_ratio=0.01, seed=0,
+                          shard_size=DEFAULT_SHARD_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                          n_workers=None, file_format='parquet', partition_cols=None, now=None):
+    """
+    Generate ``n_samples`` rows across a process pool and write them as
+    (optionally hive-partitioned) Parquet or CSV files
+
+    Each worker holds at most one ``chunk_size`` DataFrame, so peak memory is
+    bounded by ``n_workers * chunk_size`` rather than ``n_samples``. Reruns
+    with the same ``seed`` and ``now`` (default ``SEEDED_NOW``) produce the
+    same rows.
+    """
+    if file_format not in ('parquet', 'csv'):
+        raise ValueError(f"Unsupported file format: {file_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    now = pd.Timestamp(now) if now is not None else SEEDED_NOW
+    shards = [
+        (shard_id, start, min(shard_size, n_samples - start))
+        for shard_id, start in enumerate(range(0, n_samples, shard_size))
+    ]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(write_shard, shard_id, start, rows, output_dir, chunk_size,
+                            fraud_ratio, seed, file_format, partition_cols, now)
+            for shard_id, start, rows in shards
+        ]
+        results = [future.result() for future in futures]
+    return {
+        'rows': sum(result['rows'] for result in results),
+        'fraud': sum(result['fraud'] for result in results),
+        'shards': len(results),
+    }
 
 def save_data(df, output_path):
     """
@@ -64,17 +264,43 @@ def save_data(df, output_path):
     df.to_csv(output_path, index=False)
     print(f"Data saved to {output_path}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic credit card transactions")
+    parser.add_argument("--sharded-output", help="write a sharded dataset to this directory instead of train/test CSVs")
+    parser.add_argument("--n-samples", type=int, default=10000000)
+    parser.add_argument("--fraud-ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--partition-cols", nargs="*", default=None)
+    parser.add_argument("--now", help="end of the sharded dataset's 30-day window, e.g. 2024-07-01 "
+                                      "(default: a fixed date, so a seed always gives the same rows)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    # Generate training data
-    train_data = generate_transaction_data(n_samples=100000, fraud_ratio=0.01)
-    save_data(train_data, 'data/raw/train_data.csv')
+    args = parse_args()
+    if args.sharded_output:
+        summary = write_sharded_dataset(
+            args.n_samples, args.sharded_output, fraud_ratio=args.fraud_ratio,
+            seed=args.seed, shard_size=args.shard_size, chunk_size=args.chunk_size,
+            n_workers=args.workers, file_format=args.format,
+            partition_cols=args.partition_cols, now=args.now
+        )
+        print(f"Wrote {summary['rows']:,} rows ({summary['fraud']:,} fraud) "
+              f"in {summary['shards']} shards to {args.sharded_output}")
+    else:
+        # Generate training data
+        train_data = generate_transaction_data(n_samples=100000, fraud_ratio=0.01, fast=True)
+        save_data(train_data, 'data/raw/train_data.csv')
     
-    # Generate test data
-    test_data = generate_transaction_data(n_samples=20000, fraud_ratio=0.01)
-    save_data(test_data, 'data/raw/test_data.csv')
+        # Generate test data
+        test_data = generate_transaction_data(n_samples=20000, fraud_ratio=0.01, fast=True)
+        save_data(test_data, 'data/raw/test_data.csv')
     
-    print("Data generation completed!")
-    print(f"Training data shape: {train_data.shape}")
-    print(f"Test data shape: {test_data.shape}")
-    print(f"Fraud ratio in training: {train_data['is_fraud'].mean():.4f}")
-    print(f"Fraud ratio in test: {test_data['is_fraud'].mean():.4f}") 
\ No newline at end of file
+        print("Data generation completed!")
+        print(f"Training data shape: {train_data.shape}")
+        print(f"Test data shape: {test_data.shape}")
+        print(f"Fraud ratio in training: {train_data['is_fraud'].mean():.4f}")
+        print(f"Fraud ratio in test: {test_data['is_fraud'].mean():.4f}") 
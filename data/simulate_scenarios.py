@@ -0,0 +1,413 @@
+"""
+Entity-based, time-ordered transaction simulation.
+
+Unlike ``generate_synthetic_data``, which draws every row independently,
+this simulates a fixed population of cardholders spending at a fixed pool
+of merchants:
+
+* every card has a home country, a spending level, an online share and a
+  handful of favourite merchants in its home country
+* legitimate spending arrives as Poisson shopping sessions per card (at
+  card-specific rates, with a daily cycle) of one or more transactions a few
+  minutes apart, with the occasional trip abroad
+* ``card_testing`` - a stolen card is probed with a burst of tiny online
+  payments seconds apart, then cashed out with a few large purchases at
+  high-risk merchants
+* ``account_takeover`` - a taken-over account places a run of unusually
+  large online orders from a new device and IP address over a few hours
+
+All fraud-scenario rows are labelled fraud. Every column is built with NumPy
+over whole populations, one shard of cards at a time, and each shard's rows
+come out in timestamp order. Shards are seeded by ``(seed, shard_id)`` and a
+card belongs to exactly one shard, so per-card histories (velocity windows,
+profiles, caches) are complete and in order within every shard. The dataset
+writer emits one file per shard and day named ``part-<day>-<shard>``, so
+reading the files in name order is time-ordered to the day:
+
+    python -m data.simulate_scenarios --output data/raw/scenarios --cards 1000000 --days 30 --format csv
+    python -m ml_pipeline.glue_jobs.local_etl --input data/raw/scenarios --output data/processed
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from data.generate_synthetic_data import DEFAULT_POOL_SIZE, build_value_pools
+from ml_pipeline.features.schema import MERCHANT_CATEGORIES, apply_pandas_schema, to_arrow_table
+from ml_pipeline.features.transaction_features import (
+    HIGH_RISK_COUNTRIES, TIME_FEATURES, add_features_pandas
+)
+from ml_pipeline.monitoring import tracing
+
+SCENARIOS = ['legitimate', 'card_testing', 'account_takeover']
+
+HOME_COUNTRIES = ['United States', 'United Kingdom', 'Germany', 'France', 'Canada', 'Australia']
+HOME_COUNTRY_WEIGHTS = [0.45, 0.15, 0.12, 0.1, 0.1, 0.08]
+# Share of merchants located in high-risk countries
+HIGH_RISK_MERCHANT_SHARE = 0.1
+
+# Legitimate spending: sessions per card and day (mean), transactions per
+# session (mean) and seconds between transactions of a session (mean)
+SESSIONS_PER_DAY = 0.6
+SESSION_TRANSACTIONS = 1.6
+SESSION_GAP_SECONDS = 240.0
+FAVORITE_MERCHANTS = 12
+FAVORITE_SHARE = 0.8
+TRAVEL_SHARE = 0.02
+ATM_SHARE = 0.05
+
+# Relative session starts per hour of day
+DIURNAL = np.array([1, 0.6, 0.4, 0.3, 0.3, 0.5, 1.2, 2.5, 3.5, 4, 4.5, 5.5,
+                    6.5, 5.5, 4.5, 4.5, 5, 6, 6.5, 6, 5, 4, 3, 2])
+DIURNAL = DIURNAL / DIURNAL.sum()
+
+# Log-amount offset per merchant category
+CATEGORY_SHIFT = {'retail': 0.0, 'food': -0.7, 'travel': 1.2, 'entertainment': -0.2, 'utilities': 0.4}
+
+DEFAULT_DAYS = 30
+DEFAULT_MERCHANTS = 20000
+DEFAULT_SHARD_CARDS = 50000
+DEFAULT_CARD_TESTING_RATE = 0.003
+DEFAULT_TAKEOVER_RATE = 0.002
+
+# Spawn key of the merchant table's seed, outside the range of shard ids
+MERCHANT_SEED_KEY = 2**31
+
+US_PER_SECOND = 10**6
+
+
+def expected_rows(n_cards, days=DEFAULT_DAYS):
+    """
+    Expected number of legitimate transactions of ``n_cards`` over ``days``
+    """
+    return int(n_cards * days * SESSIONS_PER_DAY * SESSION_TRANSACTIONS)
+
+
+def _mix(values):
+    """
+    SplitMix64 finalizer: a well-spread uint64 hash of integer ids
+    """
+    z = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over='ignore'):
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def card_numbers(card_ids, seed=0):
+    """
+    Distinct, Luhn-valid 16-digit card numbers for integer card ids
+
+    The 14 digits after the leading 4 are an affine bijection of the id, so
+    ids below 10**14 never collide.
+    """
+    body = (np.asarray(card_ids, dtype=np.int64) * 7_919_000_017 + 10_007 * (seed + 1)) % 10**14
+    payload = 4 * 10**14 + body
+    digits = (payload[:, None] // 10 ** np.arange(15, dtype=np.int64)) % 10
+    # Double every other digit starting next to the check digit
+    doubled = digits[:, ::2] * 2
+    total = np.where(doubled > 9, doubled - 9, doubled).sum(axis=1) + digits[:, 1::2].sum(axis=1)
+    check = (10 - total % 10) % 10
+    return np.array([f'{p:015d}{c}' for p, c in zip(payload, check)], dtype=object)
+
+
+@lru_cache(maxsize=4)
+def build_merchants(n_merchants=DEFAULT_MERCHANTS, seed=0):
+    """
+    Merchant table shared by every shard, sorted by country, plus the
+    first row and row count of each country in ``countries`` order
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(MERCHANT_SEED_KEY,)))
+    pools = build_value_pools(DEFAULT_POOL_SIZE)
+    countries = np.array(HOME_COUNTRIES + list(HIGH_RISK_COUNTRIES), dtype=object)
+    weights = np.concatenate([
+        np.asarray(HOME_COUNTRY_WEIGHTS) * (1 - HIGH_RISK_MERCHANT_SHARE),
+        np.full(len(HIGH_RISK_COUNTRIES), HIGH_RISK_MERCHANT_SHARE / len(HIGH_RISK_COUNTRIES)),
+    ])
+    country = rng.choice(len(countries), n_merchants, p=weights)
+    # At least one merchant per country
+    country[:len(countries)] = np.arange(len(countries))
+    country = np.sort(country)
+    ids = np.arange(n_merchants)
+    # Names repeat after the pool is used up, so later merchants get a store number
+    names = pools['merchant_name'][ids % DEFAULT_POOL_SIZE]
+    store = ids // DEFAULT_POOL_SIZE
+    names = np.array([name if s == 0 else f'{name} #{s + 1}' for name, s in zip(names, store)], dtype=object)
+    merchants = pd.DataFrame({
+        'merchant_name': names,
+        'merchant_city': pools['merchant_city'][rng.integers(0, DEFAULT_POOL_SIZE, n_merchants)],
+        'merchant_country': countries[country],
+        'merchant_category': np.asarray(MERCHANT_CATEGORIES, dtype=object)[
+            rng.integers(0, len(MERCHANT_CATEGORIES), n_merchants)],
+    })
+    starts = np.searchsorted(country, np.arange(len(countries)))
+    counts = np.diff(np.append(starts, n_merchants))
+    return merchants, starts, counts
+
+
+def _bursts(starts_us, counts, mean_gap_s, rng):
+    """
+    Owner index and time of every event of bursts starting at ``starts_us``
+    with ``counts`` events exponentially ``mean_gap_s`` apart
+    """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    gaps = rng.exponential(mean_gap_s * US_PER_SECOND, len(owner)).astype(np.int64)
+    first = np.cumsum(counts) - counts
+    gaps[first[counts > 0]] = 0
+    elapsed = np.cumsum(gaps)
+    # Elapsed time since the first event of each burst
+    elapsed -= np.repeat(elapsed[first[counts > 0]], counts[counts > 0])
+    return owner, np.repeat(starts_us, counts) + elapsed
+
+
+def _pick(starts, counts, country, rng):
+    """
+    A uniformly random merchant row in each given country
+    """
+    return starts[country] + (rng.random(len(country)) * counts[country]).astype(np.int64)
+
+
+@tracing.traced('generate.simulate_shard')
+def simulate_shard(card_start, n_cards, days=DEFAULT_DAYS, seed=0, shard_id=0,
+                   n_merchants=DEFAULT_MERCHANTS, card_testing_rate=DEFAULT_CARD_TESTING_RATE,
+                   takeover_rate=DEFAULT_TAKEOVER_RATE, now=None, scenario_column=False):
+    """
+    Every transaction of cards ``[card_start, card_start + n_cards)`` over
+    the ``days`` before ``now``, in timestamp order
+
+    Columns match ``generate_transaction_data``; ``scenario_column`` adds
+    the scenario that produced each row. Transaction ids are unique per
+    ``seed``, ``now`` and shard.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard_id,)))
+    pools = build_value_pools(DEFAULT_POOL_SIZE)
+    merchants, starts, counts = build_merchants(n_merchants, seed)
+    high_risk = np.arange(len(HOME_COUNTRIES), len(starts))
+    now = pd.Timestamp(now if now is not None else datetime.now()).floor('s').as_unit('us')
+    window_us = days * 24 * 3600 * US_PER_SECOND
+
+    # Cardholders
+    card_ids = np.arange(card_start, card_start + n_cards)
+    card_hash = _mix(card_ids.astype(np.uint64) ^ np.uint64(seed))
+    home = rng.choice(len(HOME_COUNTRIES), n_cards, p=HOME_COUNTRY_WEIGHTS)
+    log_amount = rng.normal(3.5, 0.4, n_cards)
+    online_share = rng.beta(2, 4, n_cards)
+    mobile_share = rng.beta(3, 2, n_cards)
+    ip = (card_hash % np.uint64(DEFAULT_POOL_SIZE)).astype(np.int64)
+
+    # Legitimate sessions
+    sessions = rng.poisson(rng.gamma(2.0, SESSIONS_PER_DAY / 2.0, n_cards) * days)
+    session_card = np.repeat(np.arange(n_cards), sessions)
+    n_sessions = len(session_card)
+    session_start = ((rng.integers(0, days, n_sessions) * 24 + rng.choice(24, n_sessions, p=DIURNAL))
+                     * 3600 * US_PER_SECOND + rng.integers(0, 3600 * US_PER_SECOND, n_sessions))
+    lengths = rng.geometric(1.0 / SESSION_TRANSACTIONS, n_sessions)
+    session, legit_time = _bursts(session_start, lengths, SESSION_GAP_SECONDS, rng)
+    legit_card = session_card[session]
+    n_legit = len(legit_card)
+    # Favourite merchants are a fixed hash of (card, slot) into the home country's merchants
+    favorite = starts[home[legit_card]] + (
+        _mix(card_hash[legit_card] + rng.integers(0, FAVORITE_MERCHANTS, n_legit).astype(np.uint64))
+        % counts[home[legit_card]].astype(np.uint64)).astype(np.int64)
+    local = _pick(starts, counts, home[legit_card], rng)
+    abroad = _pick(starts, counts, rng.integers(0, len(starts), n_legit), rng)
+    legit_merchant = np.where(rng.random(n_legit) < FAVORITE_SHARE, favorite, local)
+    traveling = np.repeat(rng.random(n_sessions) < TRAVEL_SHARE, lengths)
+    legit_merchant = np.where(traveling, abroad, legit_merchant)
+    u = rng.random(n_legit)
+    legit_type = np.where(u < online_share[legit_card], 'online',
+                          np.where(u > 1 - ATM_SHARE, 'atm', 'in_store')).astype(object)
+    shift = merchants['merchant_category'].map(CATEGORY_SHIFT).to_numpy(dtype=np.float64)
+    legit_amount = np.exp(log_amount[legit_card] + shift[legit_merchant] + rng.normal(0, 0.7, n_legit))
+    legit_amount = np.where(legit_type == 'atm', np.ceil(legit_amount / 20) * 20, legit_amount)
+    legit_device = np.where(legit_type == 'in_store', 'pos_terminal', 'atm').astype(object)
+    online = legit_type == 'online'
+    legit_device[online] = np.where(rng.random(online.sum()) < mobile_share[legit_card[online]],
+                                    'mobile', 'desktop')
+
+    # Card testing: tiny probes at one merchant, then cash-out purchases
+    tested = np.flatnonzero(rng.random(n_cards) < card_testing_rate)
+    attack_start = rng.integers(0, window_us, len(tested))
+    probes = rng.integers(5, 31, len(tested))
+    attack, probe_time = _bursts(attack_start, probes, 20.0, rng)
+    probe_merchant = rng.integers(0, n_merchants, len(tested))[attack]
+    cashouts = rng.integers(1, 4, len(tested))
+    cashout_start = probe_time[np.cumsum(probes) - 1] + rng.exponential(
+        1800 * US_PER_SECOND, len(tested)).astype(np.int64)
+    cashout, cashout_time = _bursts(cashout_start, cashouts, 600.0, rng)
+    testing_card = np.concatenate([tested[attack], tested[cashout]])
+    testing_time = np.concatenate([probe_time, cashout_time])
+    testing_merchant = np.concatenate([
+        probe_merchant, _pick(starts, counts, rng.choice(high_risk, len(cashout)), rng)])
+    testing_amount = np.concatenate([
+        rng.uniform(0.5, 5.0, len(attack)),
+        np.exp(log_amount[tested[cashout]] + 1.5 + rng.normal(0, 0.5, len(cashout)))])
+    testing_device = np.where(np.arange(len(testing_card)) < len(attack), 'desktop', 'mobile').astype(object)
+    testing_ip = np.concatenate([np.repeat(rng.integers(0, DEFAULT_POOL_SIZE, len(tested)), probes),
+                                 np.repeat(rng.integers(0, DEFAULT_POOL_SIZE, len(tested)), cashouts)])
+
+    # Account takeover: a run of large online orders from a new device
+    taken = np.flatnonzero(rng.random(n_cards) < takeover_rate)
+    orders = rng.integers(3, 11, len(taken))
+    takeover, takeover_time = _bursts(rng.integers(0, window_us, len(taken)), orders, 900.0, rng)
+    takeover_card = taken[takeover]
+    n_takeover = len(takeover_card)
+    takeover_merchant = np.where(
+        rng.random(n_takeover) < 0.5,
+        _pick(starts, counts, rng.choice(high_risk, n_takeover), rng),
+        rng.integers(0, n_merchants, n_takeover))
+    takeover_amount = np.exp(log_amount[takeover_card] + np.log(rng.uniform(3, 10, n_takeover))
+                             + rng.normal(0, 0.3, n_takeover))
+    takeover_ip = np.repeat(rng.integers(0, DEFAULT_POOL_SIZE, len(taken)), orders)
+
+    # All scenarios as one frame, in time order, inside the window
+    card = np.concatenate([legit_card, testing_card, takeover_card])
+    offset = np.concatenate([legit_time, testing_time, takeover_time])
+    scenario = np.repeat(np.arange(len(SCENARIOS), dtype=np.int8), [n_legit, len(testing_card), n_takeover])
+    merchant = np.concatenate([legit_merchant, testing_merchant, takeover_merchant])
+    amount = np.concatenate([legit_amount, testing_amount, takeover_amount])
+    transaction_type = np.concatenate([legit_type, np.full(len(testing_card) + n_takeover, 'online', dtype=object)])
+    device = np.concatenate([legit_device, testing_device, np.full(n_takeover, 'mobile', dtype=object)])
+    ips = np.concatenate([ip[legit_card], testing_ip, takeover_ip])
+    order = np.argsort(offset, kind='stable')
+    order = order[offset[order] < window_us]
+    card, offset, scenario, merchant = card[order], offset[order], scenario[order], merchant[order]
+
+    pool_index = (card_hash[card] % np.uint64(DEFAULT_POOL_SIZE)).astype(np.int64)
+    n_rows = len(order)
+    # Ids carry the seed and the end of the window, so batches of separate
+    # runs do not collide in the ETL's deduplication index
+    id_prefix = f'TXN{seed}-{now:%Y%m%d%H%M%S}-{shard_id:05d}-'
+    df = pd.DataFrame({
+        'transaction_id': np.array([f'{id_prefix}{i:09d}' for i in range(n_rows)], dtype=object),
+        'timestamp': (now - pd.Timedelta(days=days)) + pd.to_timedelta(offset, unit='us'),
+        'amount': np.round(amount[order], 2),
+        'merchant_category': merchants['merchant_category'].to_numpy()[merchant],
+        'card_number': card_numbers(card_ids, seed)[card],
+        'cardholder_name': pools['cardholder_name'][pool_index],
+        'cardholder_address': pools['cardholder_address'][pool_index],
+        'merchant_name': merchants['merchant_name'].to_numpy()[merchant],
+        'merchant_city': merchants['merchant_city'].to_numpy()[merchant],
+        'merchant_country': merchants['merchant_country'].to_numpy()[merchant],
+        'transaction_type': transaction_type[order],
+        'device_type': device[order],
+        'ip_address': pools['ip_address'][ips[order]],
+        'is_fraud': (scenario > 0).astype(np.uint8),
+    })
+    df['timestamp'] = df['timestamp'].dt.as_unit('us')
+
+    # Add derived features
+    df = add_features_pandas(df, TIME_FEATURES)
+    if scenario_column:
+        df['scenario'] = pd.Categorical.from_codes(scenario, categories=SCENARIOS)
+
+    # Compact dtypes from the shared schema
+    return apply_pandas_schema(df)
+
+
+def _shards(n_cards, shard_cards):
+    return [
+        (shard_id, start, min(shard_cards, n_cards - start))
+        for shard_id, start in enumerate(range(0, n_cards, shard_cards))
+    ]
+
+
+def simulate_transactions(n_cards=10000, days=DEFAULT_DAYS, seed=0, shard_cards=DEFAULT_SHARD_CARDS,
+                          now=None, **options):
+    """
+    In-memory simulation of ``n_cards`` cards, in global timestamp order
+
+    ``options`` are passed to ``simulate_shard``. For populations that do
+    not fit in memory use ``write_scenario_dataset``.
+    """
+    now = now if now is not None else datetime.now()
+    shards = [
+        simulate_shard(start, cards, days, seed, shard_id, now=now, **options)
+        for shard_id, start, cards in _shards(n_cards, shard_cards)
+    ]
+    df = pd.concat(shards, ignore_index=True) if len(shards) > 1 else shards[0]
+    return df.sort_values('timestamp', kind='stable', ignore_index=True)
+
+
+def write_scenario_shard(shard_id, card_start, n_cards, output_dir, days=DEFAULT_DAYS, seed=0,
+                         file_format='parquet', now=None, **options):
+    """
+    Simulate one shard of cards and write one time-ordered file per day
+    """
+    df = simulate_shard(card_start, n_cards, days, seed, shard_id, now=now, **options)
+    day = df['timestamp'].dt.strftime('%Y%m%d').to_numpy()
+    bounds = np.flatnonzero(np.append(True, day[1:] != day[:-1]))
+    for start, end in zip(bounds, np.append(bounds[1:], len(df))):
+        ds.write_dataset(
+            to_arrow_table(df.iloc[start:end]),
+            output_dir,
+            format=file_format,
+            basename_template=f'part-{day[start]}-{shard_id:05d}-{{i}}.{file_format}',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+    return {'shard_id': shard_id, 'rows': len(df), 'fraud': int(df['is_fraud'].sum())}
+
+
+@tracing.traced('generate.scenario_dataset')
+def write_scenario_dataset(n_cards, output_dir, days=DEFAULT_DAYS, seed=0, shard_cards=DEFAULT_SHARD_CARDS,
+                           n_workers=None, file_format='parquet', now=None, **options):
+    """
+    Simulate ``n_cards`` cards across a process pool, one shard of cards
+    per task
+
+    Each worker holds one shard's rows at a time, so peak memory is bounded
+    by ``n_workers`` shards. Reruns with the same ``seed``,
+    ``shard_cards`` and ``now`` (default: the time of the run) produce the
+    same rows.
+    """
+    if file_format not in ('parquet', 'csv'):
+        raise ValueError(f"Unsupported file format: {file_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    now = now if now is not None else datetime.now()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(write_scenario_shard, shard_id, start, cards, output_dir, days, seed,
+                            file_format, now, **options)
+            for shard_id, start, cards in _shards(n_cards, shard_cards)
+        ]
+        results = [future.result() for future in futures]
+    return {
+        'cards': n_cards,
+        'rows': sum(result['rows'] for result in results),
+        'fraud': sum(result['fraud'] for result in results),
+        'shards': len(results),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate card and merchant populations with fraud scenarios")
+    parser.add_argument("--output", required=True, help="directory of per-shard, per-day files")
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("--merchants", type=int, default=DEFAULT_MERCHANTS)
+    parser.add_argument("--card-testing-rate", type=float, default=DEFAULT_CARD_TESTING_RATE,
+                        help="share of cards hit by card testing")
+    parser.add_argument("--takeover-rate", type=float, default=DEFAULT_TAKEOVER_RATE,
+                        help="share of cards hit by account takeover")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-cards", type=int, default=DEFAULT_SHARD_CARDS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--now", default=None, help="end of the simulated window (default: now)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = write_scenario_dataset(
+        args.cards, args.output, days=args.days, seed=args.seed, shard_cards=args.shard_cards,
+        n_workers=args.workers, file_format=args.format, now=args.now, n_merchants=args.merchants,
+        card_testing_rate=args.card_testing_rate, takeover_rate=args.takeover_rate
+    )
+    print(f"Wrote {summary['rows']:,} rows ({summary['fraud']:,} fraud) for {summary['cards']:,} cards "
+          f"in {summary['shards']} shards to {args.output}")
@@ -1,15 +1,32 @@
+import os
+import sys
+from pathlib import Path
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import boto3
+from botocore.exceptions import ClientError
 import json
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
 
-# Initialize AWS clients
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-s3 = boto3.client('s3')
+# `streamlit run` only puts this directory on sys.path; make the repo root importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from ml_pipeline.features.profiles import Profiles
+from ml_pipeline.features.schema import DEVICE_TYPES, MERCHANT_CATEGORIES, TRANSACTION_TYPES
+from ml_pipeline.features.transaction_features import transaction_features
+from ml_pipeline.features.velocity import VelocityStore
+from ml_pipeline.glue_jobs.historical_stats import read_stats
+from ml_pipeline.monitoring import tracing
+from ml_pipeline.monitoring.drift import DriftMonitor, load_snapshots, merge_snapshots
+from ml_pipeline.scoring.batch_score import prepare_transactions, read_uploaded_file, score_frame
+from ml_pipeline.scoring.evaluation import DEFAULT_THRESHOLD, load_threshold
+from ml_pipeline.scoring.endpoint_client import ScoringClient, create_runtime
+from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+from ml_pipeline.scoring.rules import RuleSet
 
 # Page configuration
 st.set_page_config(
@@ -24,67 +41,132 @@ st.markdown("""
 This application uses AWS SageMaker Autopilot to detect fraudulent credit card transactions in real-time.
 """)
 
+@st.cache_resource
+def get_velocity_store():
+    # Shared across sessions; bounded by the store's card and event caps
+    return VelocityStore()
+
+velocity_store = get_velocity_store()
+
+@st.cache_resource
+def get_profiles():
+    # Memory-mapped card and merchant profiles, shared by every session and
+    # (through the page cache) every app process on the host
+    path = os.environ.get("FRAUD_PROFILES", "data/profiles")
+    return Profiles(path) if os.path.isdir(path) else None
+
+profiles = get_profiles()
+
+@st.cache_resource
+def get_rule_set():
+    # Business rules decided before the model; FRAUD_RULES replaces the
+    # built-in ones with a JSON file (local or s3://)
+    path = os.environ.get("FRAUD_RULES")
+    if path:
+        return RuleSet.load(path, boto3.client('s3') if path.startswith("s3://") else None)
+    return RuleSet()
+
+@st.cache_resource
+def get_scoring_client():
+    # One pooled, cached client per process; FRAUD_LOCAL_MODEL points scoring
+    # at an in-process model and FRAUD_ENDPOINT_URL at another host (such as
+    # the local stand-in) instead of the endpoint
+    if os.environ.get("FRAUD_LOCAL_MODEL"):
+        runtime = LocalEndpoint(LocalModel.load(os.environ["FRAUD_LOCAL_MODEL"]))
+    else:
+        runtime = create_runtime(endpoint_url=os.environ.get("FRAUD_ENDPOINT_URL"))
+    return ScoringClient(runtime, rules=get_rule_set())
+
+@st.cache_resource
+def get_s3_client():
+    return boto3.client('s3')
+
+@st.cache_resource
+def get_drift_monitor():
+    # Histograms of everything this process scores, compared against the
+    # training profile in the drift panel
+    return DriftMonitor()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_drift_reference():
+    path = os.environ.get("FRAUD_DRIFT_REFERENCE", "data/state/drift_reference.json")
+    return read_stats(path, get_s3_client() if path.startswith("s3://") else None)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_decision_threshold():
+    # Cost-minimizing threshold published by the evaluation job
+    path = os.environ.get("FRAUD_THRESHOLD", "models/threshold.json")
+    return load_threshold(path, DEFAULT_THRESHOLD, get_s3_client() if path.startswith("s3://") else None)
+
+decision_threshold = load_decision_threshold()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_historical_stats():
+    # Refreshed at most every ten minutes instead of on every rerun
+    path = os.environ.get(
+        "FRAUD_HISTORICAL_STATS", "s3://your-bucket/data/stats/historical_stats.json")
+    return read_stats(path, get_s3_client() if path.startswith("s3://") else None)
+
 # Sidebar
 st.sidebar.header("Transaction Details")
 
 # Input form
 with st.sidebar.form("transaction_form"):
+    card_number = st.text_input("Card Number")
     amount = st.number_input("Transaction Amount ($)", min_value=0.0, max_value=100000.0)
     merchant_category = st.selectbox(
         "Merchant Category",
-        ["retail", "food", "travel", "entertainment", "utilities"]
+        MERCHANT_CATEGORIES
     )
     transaction_type = st.selectbox(
         "Transaction Type",
-        ["online", "in_store", "atm"]
+        TRANSACTION_TYPES
     )
     device_type = st.selectbox(
         "Device Type",
-        ["mobile", "desktop", "pos_terminal", "atm"]
+        DEVICE_TYPES
     )
     merchant_country = st.text_input("Merchant Country")
     submit_button = st.form_submit_button("Check for Fraud")
 
 # Main content
 if submit_button:
-    # Prepare input data
+    # Prepare input data with the same features the ETL computes
     input_data = {
         "amount": amount,
         "merchant_category": merchant_category,
         "transaction_type": transaction_type,
         "device_type": device_type,
         "merchant_country": merchant_country,
-        "timestamp": datetime.now().isoformat(),
-        "hour": datetime.now().hour,
-        "day_of_week": datetime.now().weekday(),
-        "month": datetime.now().month,
-        "is_weekend": 1 if datetime.now().weekday() >= 5 else 0,
-        "is_night": 1 if datetime.now().hour >= 22 or datetime.now().hour <= 5 else 0,
-        "is_high_risk_country": 1 if merchant_country in ["Russia", "China", "Nigeria", "Brazil"] else 0,
-        "is_online_transaction": 1 if transaction_type == "online" else 0,
-        "is_mobile_device": 1 if device_type == "mobile" else 0
+        "timestamp": datetime.now().isoformat()
     }
+    with tracing.span("app.features"):
+        input_data.update(transaction_features(input_data))
+    with tracing.span("app.velocity"):
+        input_data.update(velocity_store.update({**input_data, "card_number": card_number or None}))
+    if profiles is not None:
+        with tracing.span("app.profiles"):
+            profiles.reload_if_changed()
+            input_data.update(profiles.enrich_record({**input_data, "card_number": card_number or None}))
     
     # Call SageMaker endpoint
     try:
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName='fraud-detection-endpoint',
-            ContentType='application/json',
-            Body=json.dumps(input_data)
-        )
-        
-        result = json.loads(response['Body'].read().decode())
-        fraud_probability = result['predicted_probability']
+        with tracing.span("app.score"):
+            fraud_probability, rule = get_scoring_client().decide(input_data)
+        with tracing.span("app.drift"):
+            get_drift_monitor().observe(input_data, fraud_probability, rule)
         
         # Display results
         col1, col2 = st.columns(2)
         
         with col1:
             st.subheader("Fraud Detection Result")
-            if fraud_probability > 0.5:
+            if fraud_probability >= decision_threshold:
                 st.error(f"⚠️ High Risk Transaction! (Probability: {fraud_probability:.2%})")
             else:
                 st.success(f"✅ Low Risk Transaction (Probability: {fraud_probability:.2%})")
+            if rule is not None:
+                st.caption(f"Decided by rule `{rule}` without calling the model")
         
         with col2:
             # Create gauge chart
@@ -95,8 +177,8 @@ if submit_button:
                 gauge={'axis': {'range': [0, 100]},
                       'bar': {'color': "darkblue"},
                       'steps': [
-                          {'range': [0, 50], 'color': "lightgray"},
-                          {'range': [50, 100], 'color': "gray"}
+                          {'range': [0, decision_threshold * 100], 'color': "lightgray"},
+                          {'range': [decision_threshold * 100, 100], 'color': "gray"}
                       ],
                       'threshold': {
                           'line': {'color': "red", 'width': 4},
@@ -116,19 +198,173 @@ if submit_button:
     except Exception as e:
         st.error(f"Error calling SageMaker endpoint: {str(e)}")
 
+# Bulk scoring of uploaded files
+st.subheader("Bulk Scoring")
+uploaded_file = st.file_uploader("Upload transactions (CSV or Parquet)", type=["csv", "parquet"])
+
+# Columns kept from a scored upload; the rest of the frame is dropped
+BULK_RESULT_COLUMNS = [
+    "transaction_id", "card_hash", "timestamp", "amount", "merchant_category",
+    "merchant_country", "transaction_type", "device_type", "hour",
+    "card_txn_count_1h", "card_distinct_countries"
+]
+
+if uploaded_file is not None:
+    # Scored results live in the session keyed by the upload, so widget
+    # reruns only filter and page them
+    upload_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}-{uploaded_file.size}"
+    if st.session_state.get("bulk_upload_key") != upload_key:
+        try:
+            with st.spinner("Deriving features..."):
+                transactions = prepare_transactions(
+                    read_uploaded_file(uploaded_file.getvalue(), uploaded_file.name), profiles=profiles)
+            progress = st.progress(0.0, text=f"Scoring {len(transactions):,} transactions...")
+            with tracing.span("app.bulk_score", rows=len(transactions)):
+                probabilities, rules = score_frame(
+                    get_scoring_client().runtime, transactions, rules=get_rule_set(), return_rules=True,
+                    on_progress=lambda done, total: progress.progress(
+                        done / total, text=f"Scored {done:,} of {total:,} transactions")
+                )
+            progress.empty()
+            # Rule-decided rows carry fixed scores, not the model's
+            get_drift_monitor().observe_frame(transactions, probabilities, scored=pd.isna(rules))
+            results = transactions[BULK_RESULT_COLUMNS].copy()
+            results["predicted_probability"] = probabilities
+            st.session_state["bulk_results"] = results
+            st.session_state["bulk_upload_key"] = upload_key
+        except Exception as e:
+            st.error(f"Error scoring uploaded file: {str(e)}")
+
+if uploaded_file is not None and st.session_state.get("bulk_upload_key") == upload_key:
+    results = st.session_state["bulk_results"]
+
+    # Filters
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        threshold = st.slider("Flag threshold", 0.0, 1.0, round(min(decision_threshold, 1.0), 2), 0.01)
+    with col2:
+        categories = st.multiselect(
+            "Merchant categories", sorted(results["merchant_category"].dropna().unique().tolist()))
+    with col3:
+        flagged_only = st.checkbox("Flagged only")
+    mask = np.ones(len(results), dtype=bool)
+    if categories:
+        mask &= results["merchant_category"].isin(categories).to_numpy()
+    flagged = results["predicted_probability"].to_numpy() >= threshold
+    if flagged_only:
+        mask &= flagged
+    filtered = results[mask]
+
+    # Aggregates
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Transactions", f"{len(results):,}")
+    with col2:
+        st.metric("Flagged", f"{int(flagged.sum()):,}")
+    with col3:
+        st.metric("Flag Rate", f"{flagged.mean() if len(results) else 0.0:.2%}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        # Bin on the server so the chart payload stays small for large uploads
+        counts, edges = np.histogram(filtered["predicted_probability"], bins=50, range=(0.0, 1.0))
+        fig = px.bar(x=edges[:-1], y=counts, labels={"x": "Fraud probability", "y": "Transactions"},
+                     title="Score Distribution")
+        st.plotly_chart(fig)
+    with col2:
+        by_category = (
+            filtered.assign(flagged=filtered["predicted_probability"] >= threshold)
+            .groupby("merchant_category")["flagged"].mean().reset_index()
+        )
+        fig = px.bar(by_category, x="merchant_category", y="flagged", title="Flag Rate by Merchant Category")
+        st.plotly_chart(fig)
+
+    # Paginated result table
+    page_size = st.selectbox("Rows per page", [25, 100, 500], index=1)
+    n_pages = max(1, -(-len(filtered) // page_size))
+    page = st.number_input("Page", min_value=1, max_value=n_pages, value=1)
+    st.caption(f"{len(filtered):,} matching transactions, page {page} of {n_pages}")
+    st.dataframe(filtered.iloc[(page - 1) * page_size:page * page_size])
+
+# Transactions the business rules decided without calling the model
+with st.expander("Rule Hits"):
+    rule_stats = get_rule_set().stats()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Evaluated", f"{rule_stats['evaluated']:,}")
+    with col2:
+        st.metric("Decided by Rules", f"{rule_stats['decided_rate']:.2%}")
+    st.dataframe(pd.DataFrame({"rule": list(rule_stats["hits"]), "hits": list(rule_stats["hits"].values())}))
+
+# Drift of live features and scores against the training profile
+st.subheader("Feature and Score Drift")
+try:
+    drift_monitor = get_drift_monitor()
+    # With FRAUD_DRIFT_SNAPSHOTS set, every worker publishes its counts there
+    # and the panel reports on the traffic of all of them
+    snapshot_location = os.environ.get("FRAUD_DRIFT_SNAPSHOTS")
+    other_snapshots = []
+    if snapshot_location:
+        drift_monitor.maybe_publish(snapshot_location)
+        other_snapshots = load_snapshots(
+            snapshot_location, exclude=drift_monitor.worker_id,
+            s3_client=get_s3_client() if snapshot_location.startswith("s3://") else None)
+    drift_reference = load_drift_reference()
+    drift = drift_monitor.report(drift_reference, other_snapshots)
+    drift_table = pd.DataFrame(drift["features"])
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Scored Since Start", f"{drift['events']:,}")
+    with col2:
+        st.metric("Features Drifting", int((drift_table["status"] == "alert").sum()))
+    with col3:
+        st.metric("Features to Watch", int((drift_table["status"] == "warn").sum()))
+    st.dataframe(drift_table)
+
+    feature = st.selectbox("Compare distribution", drift_table["feature"].tolist())
+    expected = np.asarray(drift_reference["counts"][feature], dtype=float)
+    live = merge_snapshots(drift_monitor.snapshot(), *other_snapshots)
+    actual = np.asarray(live["counts"][feature], dtype=float)
+    labels = drift_monitor.labels(feature)
+    comparison = pd.DataFrame({
+        "bin": labels * 2,
+        "share": np.concatenate([expected / max(expected.sum(), 1), actual / max(actual.sum(), 1)]),
+        "source": ["training"] * len(labels) + ["live"] * len(labels),
+    })
+    fig = px.bar(comparison, x="bin", y="share", color="source", barmode="group",
+                 title=f"{feature}: training vs live")
+    st.plotly_chart(fig)
+except (OSError, ClientError) as e:
+    # No training profile published yet (missing file or S3 object)
+    st.warning(f"Drift reference not available: {e}")
+except Exception as e:
+    st.error(f"Error computing drift: {str(e)}")
+
+# Where the time of this process's requests goes, per instrumented stage
+st.subheader("Latency Breakdown")
+stages = pd.DataFrame(tracing.TRACER.summary())
+if not tracing.is_enabled():
+    st.info("Stage timing is off; start the app with FRAUD_TRACING=1 to turn it on")
+elif stages.empty:
+    st.caption("No stages timed yet")
+else:
+    fig = px.bar(stages, x="stage", y=["p50_ms", "p95_ms", "p99_ms"], barmode="group",
+                 labels={"value": "ms", "variable": "latency"}, title="Latency by Stage")
+    st.plotly_chart(fig)
+    st.dataframe(stages)
+    st.download_button("Download Prometheus metrics", tracing.TRACER.prometheus_text(),
+                       file_name="fraudsage_metrics.prom", mime="text/plain")
+
 # Add historical data visualization
 st.subheader("Historical Fraud Detection Statistics")
 try:
-    # Load historical data from S3
-    response = s3.get_object(
-        Bucket='your-bucket',
-        Key='data/processed/historical_stats.json'
-    )
-    historical_data = json.loads(response['Body'].read().decode())
+    # Load the rollups published by the historical stats job
+    historical_data = load_historical_stats()
     
     # Create time series plot
     fig = px.line(
-        historical_data,
+        pd.DataFrame({'date': historical_data['date'], 'fraud_rate': historical_data['fraud_rate']}),
         x='date',
         y='fraud_rate',
         title='Historical Fraud Rate'
@@ -1,13 +1,67 @@
-import boto3
-import sagemaker
-from sagemaker.automl.automl import AutoML
-from sagemaker.automl.automl_inputs import AutoMLInput
-from sagemaker.inputs import TrainingInput
-
-def create_autopilot_job():
-    # Initialize SageMaker client
-    sagemaker_client = boto3.client('sagemaker')
-    
+import time
+from functools import lru_cache
+
+from ml_pipeline.monitoring import tracing
+
+ROLE_ARN = 'arn:aws:iam::xxxxxxxx:role/service-role/AmazonSageMaker-ExecutionRole'
+TRAIN_DATA_URI = 's3://your-bucket/data/train/'
+OUTPUT_PATH = 's3://your-bucket/models/autopilot/'
+
+AUTOML_JOB_NAME = 'fraud-detection-autopilot'
+MODEL_NAME = 'fraud-detection-model'
+ENDPOINT_CONFIG_NAME = 'fraud-detection-endpoint-config'
+ENDPOINT_NAME = 'fraud-detection-endpoint'
+
+class WaiterError(Exception):
+    """A SageMaker resource reached a failure state or did not settle in time"""
+
+@lru_cache(maxsize=None)
+def get_sagemaker_client():
+    # One client per process; boto3 clients are thread-safe
+    import boto3
+    return boto3.client('sagemaker')
+
+def wait_for(describe, status_key, success, failure, initial_delay=5, max_delay=60,
+             timeout=86400, sleep=time.sleep):
+    """
+    Poll ``describe()`` with exponential backoff until ``status_key`` reaches
+    one of ``success`` (returns the description) or ``failure`` (raises)
+    """
+    delay = initial_delay
+    waited = 0
+    while True:
+        with tracing.span('autopilot.describe', status_key=status_key):
+            description = describe()
+        tracing.count('autopilot.polls')
+        status = description[status_key]
+        if status in success:
+            return description
+        if status in failure:
+            reason = description.get('FailureReason', 'no reason given')
+            raise WaiterError(f"{status_key} is {status}: {reason}")
+        if waited >= timeout:
+            raise WaiterError(f"{status_key} still {status} after {waited:.0f}s")
+        sleep(delay)
+        waited += delay
+        delay = min(delay * 2, max_delay)
+
+def bucket_paths(bucket):
+    """
+    Training data and model output locations in ``bucket``, laid out like
+    the placeholders above
+    """
+    return f's3://{bucket}/data/train/', f's3://{bucket}/models/autopilot/'
+
+def _is_not_found(error):
+    message = str(error)
+    return 'Could not find' in message or 'does not exist' in message
+
+@tracing.traced('autopilot.create_autopilot_job')
+def create_autopilot_job(sagemaker_client=None, job_name=AUTOML_JOB_NAME, train_data_uri=TRAIN_DATA_URI,
+                         role_arn=ROLE_ARN, output_path=OUTPUT_PATH):
+    # Shared SageMaker client
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+
     # Define job configuration
     job_config = {
         'ProblemType': 'BinaryClassification',
@@ -15,6 +69,8 @@ def create_autopilot_job():
             'MetricName': 'AUC'
         },
         'AutoMLJobConfig': {
+            # Sample weights are supported in ensembling mode
+            'Mode': 'ENSEMBLING',
             'CompletionCriteria': {
                 'MaxCandidates': 100,
                 'MaxTimePerTrainingJobInSeconds': 3600,
@@ -28,100 +84,134 @@ def create_autopilot_job():
                 }
             }
         },
-        'RoleArn': 'arn:aws:iam::xxxxxxxx:role/service-role/AmazonSageMaker-ExecutionRole',
+        'RoleArn': role_arn,
         'InputDataConfig': [
             {
                 'DataSource': {
                     'S3DataSource': {
-                        'S3DataType': 'Parquet',
-                        'S3Uri': 's3://your-bucket/data/processed/train/'
+                        'S3DataType': 'S3Prefix',
+                        'S3Uri': train_data_uri
                     }
                 },
-                'TargetAttributeName': 'is_fraud'
+                'ContentType': 'x-application/vnd.amazon+parquet',
+                'TargetAttributeName': 'is_fraud',
+                # Written by the downsampling stage; restores the original class balance
+                'SampleWeightAttributeName': 'sample_weight'
             }
         ],
         'OutputDataConfig': {
-            'S3OutputPath': 's3://your-bucket/models/autopilot/'
+            'S3OutputPath': output_path
         }
     }
-    
+
     # Create AutoML job
     response = sagemaker_client.create_auto_ml_job(
-        AutoMLJobName='fraud-detection-autopilot',
+        AutoMLJobName=job_name,
         **job_config
     )
-    
+
     return response
 
-def create_autopilot_model():
-    # Initialize SageMaker client
-    sagemaker_client = boto3.client('sagemaker')
-    
+@tracing.traced('autopilot.wait_for_autopilot_job')
+def wait_for_autopilot_job(sagemaker_client=None, job_name=AUTOML_JOB_NAME, **wait_options):
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+    return wait_for(
+        lambda: sagemaker_client.describe_auto_ml_job(AutoMLJobName=job_name),
+        'AutoMLJobStatus', success={'Completed'}, failure={'Failed', 'Stopped'}, **wait_options
+    )
+
+@tracing.traced('autopilot.get_best_candidate')
+def get_best_candidate(sagemaker_client=None, job_name=AUTOML_JOB_NAME):
+    """
+    Name, objective metric and inference containers of the job's best candidate
+    """
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+    candidate = sagemaker_client.describe_auto_ml_job(AutoMLJobName=job_name)['BestCandidate']
+    return {
+        'name': candidate['CandidateName'],
+        'objective': candidate.get('FinalAutoMLJobObjectiveMetric', {}),
+        'containers': [
+            {key: container[key] for key in ('Image', 'ModelDataUrl', 'Environment') if key in container}
+            for container in candidate['InferenceContainers']
+        ]
+    }
+
+@tracing.traced('autopilot.create_autopilot_model')
+def create_autopilot_model(sagemaker_client=None, containers=None, model_name=MODEL_NAME, role_arn=ROLE_ARN):
+    # Shared SageMaker client
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+
+    # Serve the best candidate's inference pipeline rather than a fixed path
+    if containers is None:
+        containers = get_best_candidate(sagemaker_client)['containers']
+
     # Define model configuration
     model_config = {
-        'ModelName': 'fraud-detection-model',
-        'ExecutionRoleArn': 'arn:aws:iam::xxxxxxxx:role/service-role/AmazonSageMaker-ExecutionRole',
-        'PrimaryContainer': {
-            'Image': '683313688378.dkr.ecr.us-east-1.amazonaws.com/autopilot:1.0-cpu-py3',
-            'ModelDataUrl': 's3://your-bucket/models/autopilot/best-candidate/'
-        }
+        'ModelName': model_name,
+        'ExecutionRoleArn': role_arn,
+        'Containers': containers
     }
-    
+
     # Create model
     response = sagemaker_client.create_model(**model_config)
-    
+
     return response
 
-def create_endpoint_config():
-    # Initialize SageMaker client
-    sagemaker_client = boto3.client('sagemaker')
-    
+@tracing.traced('autopilot.create_endpoint_config')
+def create_endpoint_config(sagemaker_client=None, endpoint_config_name=ENDPOINT_CONFIG_NAME,
+                           model_name=MODEL_NAME):
+    # Shared SageMaker client
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+
     # Define endpoint configuration
     endpoint_config = {
-        'EndpointConfigName': 'fraud-detection-endpoint-config',
+        'EndpointConfigName': endpoint_config_name,
         'ProductionVariants': [
             {
                 'VariantName': 'AllTraffic',
-                'ModelName': 'fraud-detection-model',
+                'ModelName': model_name,
                 'InstanceType': 'ml.m5.xlarge',
                 'InitialInstanceCount': 1
             }
         ]
     }
-    
+
     # Create endpoint configuration
     response = sagemaker_client.create_endpoint_config(**endpoint_config)
-    
+
     return response
 
-def create_endpoint():
-    # Initialize SageMaker client
-    sagemaker_client = boto3.client('sagemaker')
-    
+@tracing.traced('autopilot.create_endpoint')
+def create_endpoint(sagemaker_client=None, endpoint_name=ENDPOINT_NAME,
+                    endpoint_config_name=ENDPOINT_CONFIG_NAME):
+    # Shared SageMaker client
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+
     # Define endpoint configuration
     endpoint_config = {
-        'EndpointName': 'fraud-detection-endpoint',
-        'EndpointConfigName': 'fraud-detection-endpoint-config'
+        'EndpointName': endpoint_name,
+        'EndpointConfigName': endpoint_config_name
     }
-    
-    # Create endpoint
-    response = sagemaker_client.create_endpoint(**endpoint_config)
-    
-    return response
+
+    # Update an existing endpoint in place (no downtime), otherwise create it
+    try:
+        sagemaker_client.describe_endpoint(EndpointName=endpoint_name)
+    except Exception as e:
+        if not _is_not_found(e):
+            raise
+        return sagemaker_client.create_endpoint(**endpoint_config)
+    return sagemaker_client.update_endpoint(**endpoint_config)
+
+@tracing.traced('autopilot.wait_for_endpoint')
+def wait_for_endpoint(sagemaker_client=None, endpoint_name=ENDPOINT_NAME, **wait_options):
+    sagemaker_client = sagemaker_client or get_sagemaker_client()
+    return wait_for(
+        lambda: sagemaker_client.describe_endpoint(EndpointName=endpoint_name),
+        'EndpointStatus', success={'InService'}, failure={'Failed', 'RollingBack', 'OutOfService'},
+        **wait_options
+    )
 
 if __name__ == "__main__":
-    # Create AutoML job
-    job_response = create_autopilot_job()
-    print("AutoML job created:", job_response)
-    
-    # Create model
-    model_response = create_autopilot_model()
-    print("Model created:", model_response)
-    
-    # Create endpoint configuration
-    endpoint_config_response = create_endpoint_config()
-    print("Endpoint configuration created:", endpoint_config_response)
-    
-    # Create endpoint
-    endpoint_response = create_endpoint()
-    print("Endpoint created:", endpoint_response) 
\ No newline at end of file
+    # The full retrain runs as a resumable DAG; see orchestrator.py
+    from ml_pipeline.autopilot.orchestrator import main
+    main()
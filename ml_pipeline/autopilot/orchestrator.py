@@ -0,0 +1,263 @@
+"""
+Resumable DAG runner for the Autopilot retrain and deploy pipeline.
+
+Steps declare their dependencies and run on a thread pool as soon as those
+have completed, so independent steps overlap. After every step the run's
+state is written to a JSON checkpoint; running again with the same
+checkpoint skips completed steps and reuses their outputs, so a retrain
+that failed while deploying does not train again.
+
+    python -m ml_pipeline.autopilot.orchestrator --checkpoint data/state/retrain.json
+    python -m ml_pipeline.autopilot.orchestrator --checkpoint data/state/retrain.json --fresh
+
+The execution role and bucket come from ``--role-arn`` / ``--bucket`` or
+the ``SAGEMAKER_ROLE`` / ``S3_BUCKET`` environment variables.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ml_pipeline.autopilot import autopilot_config
+from ml_pipeline.monitoring import tracing
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Step:
+    """
+    A named unit of work: ``run(outputs)`` receives the outputs of the
+    completed steps by name and returns a JSON-serializable output
+    """
+
+    def __init__(self, name, run, depends_on=()):
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+
+
+class Pipeline:
+    """
+    Runs a DAG of steps with bounded concurrency and a JSON checkpoint
+    """
+
+    def __init__(self, steps, checkpoint_path=None, max_workers=4, log=print):
+        self.steps = {step.name: step for step in steps}
+        for step in steps:
+            missing = [name for name in step.depends_on if name not in self.steps]
+            if missing:
+                raise ValueError(f"Step {step.name} depends on unknown steps {missing}")
+        self.checkpoint_path = checkpoint_path
+        self.max_workers = max_workers
+        self.log = log or (lambda message: None)
+        self.state = {"steps": {}}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self.state = json.load(f)
+        self._lock = threading.Lock()
+
+    def completed(self):
+        return {
+            name: record["output"] for name, record in self.state["steps"].items()
+            if record["status"] == "completed"
+        }
+
+    def save(self):
+        """
+        Write the state to the checkpoint, if there is one
+        """
+        if self.checkpoint_path:
+            os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+            tmp_path = f"{self.checkpoint_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2, default=str)
+            os.replace(tmp_path, self.checkpoint_path)
+
+    def _record(self, name, **record):
+        with self._lock:
+            self.state["steps"][name] = record
+            self.save()
+
+    def _run_step(self, step, outputs):
+        started = time.perf_counter()
+        self.log(f"[{step.name}] started")
+        with tracing.span(f"autopilot.step.{step.name}"):
+            output = step.run(outputs)
+        seconds = time.perf_counter() - started
+        self.log(f"[{step.name}] completed in {seconds:.1f}s")
+        return output, seconds
+
+    def run(self):
+        """
+        Run every step not completed yet and return all outputs by name
+        """
+        outputs = self.completed()
+        for name in outputs:
+            self.log(f"[{name}] already completed, skipping")
+        pending = {name for name in self.steps if name not in outputs}
+        running = {}
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if not failures:
+                    ready = [
+                        name for name in sorted(pending)
+                        if all(dependency in outputs for dependency in self.steps[name].depends_on)
+                    ]
+                    for name in ready:
+                        pending.discard(name)
+                        running[executor.submit(self._run_step, self.steps[name], dict(outputs))] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        output, seconds = future.result()
+                    except Exception as e:
+                        self.log(f"[{name}] failed: {e}")
+                        self._record(name, status="failed", error=str(e))
+                        failures.append((name, e))
+                        continue
+                    outputs[name] = output
+                    self._record(name, status="completed", output=output, seconds=seconds)
+        if failures:
+            name, error = failures[0]
+            raise StepFailed(f"Step {name} failed: {error}") from error
+        if pending:
+            raise StepFailed(f"Steps {sorted(pending)} have unsatisfiable dependencies")
+        return outputs
+
+
+def _already_exists(error):
+    message = str(error)
+    return "ResourceInUse" in message or "already exists" in message
+
+
+def retrain_steps(sagemaker_client, run_id, train_data_uri=autopilot_config.TRAIN_DATA_URI,
+                  endpoint_name=autopilot_config.ENDPOINT_NAME, wait_options=None,
+                  role_arn=autopilot_config.ROLE_ARN, output_path=autopilot_config.OUTPUT_PATH):
+    """
+    Train with Autopilot, then deploy the best candidate to the endpoint
+
+    Resources are named after ``run_id`` so each retrain gets its own job,
+    model and endpoint config; an existing endpoint is updated in place.
+    A step resumed after creating its resource but before being
+    checkpointed reuses that resource.
+    """
+    wait_options = wait_options or {}
+    job_name = f"fraud-autopilot-{run_id}"
+    model_name = f"{autopilot_config.MODEL_NAME}-{run_id}"
+    endpoint_config_name = f"{autopilot_config.ENDPOINT_CONFIG_NAME}-{run_id}"
+
+    def train(outputs):
+        try:
+            autopilot_config.create_autopilot_job(
+                sagemaker_client, job_name, train_data_uri, role_arn, output_path)
+        except Exception as e:
+            # Resuming after the job was created but before it was checkpointed
+            if not _already_exists(e):
+                raise
+        autopilot_config.wait_for_autopilot_job(sagemaker_client, job_name, **wait_options)
+        return autopilot_config.get_best_candidate(sagemaker_client, job_name)
+
+    def candidate_report(outputs):
+        response = sagemaker_client.list_candidates_for_auto_ml_job(
+            AutoMLJobName=job_name, SortBy="FinalObjectiveMetricValue", SortOrder="Descending", MaxResults=10)
+        return [
+            {
+                "name": candidate["CandidateName"],
+                "objective": candidate.get("FinalAutoMLJobObjectiveMetric", {}).get("Value"),
+            }
+            for candidate in response["Candidates"]
+        ]
+
+    def model(outputs):
+        try:
+            autopilot_config.create_autopilot_model(
+                sagemaker_client, outputs["train"]["containers"], model_name, role_arn)
+        except Exception as e:
+            if not _already_exists(e):
+                raise
+        return {"model_name": model_name}
+
+    def endpoint_config(outputs):
+        try:
+            autopilot_config.create_endpoint_config(
+                sagemaker_client, endpoint_config_name, outputs["model"]["model_name"])
+        except Exception as e:
+            if not _already_exists(e):
+                raise
+        return {"endpoint_config_name": endpoint_config_name}
+
+    def endpoint(outputs):
+        autopilot_config.create_endpoint(
+            sagemaker_client, endpoint_name, outputs["endpoint_config"]["endpoint_config_name"])
+        description = autopilot_config.wait_for_endpoint(sagemaker_client, endpoint_name, **wait_options)
+        return {"endpoint_name": endpoint_name, "endpoint_arn": description.get("EndpointArn")}
+
+    return [
+        Step("train", train),
+        Step("candidate_report", candidate_report, ["train"]),
+        Step("model", model, ["train"]),
+        Step("endpoint_config", endpoint_config, ["model"]),
+        Step("endpoint", endpoint, ["endpoint_config"]),
+    ]
+
+
+def run_retrain(checkpoint_path, sagemaker_client=None, fresh=False, max_workers=4, wait_options=None,
+                log=print, **step_options):
+    """
+    Run (or resume) the retrain pipeline recorded in ``checkpoint_path``
+    """
+    if fresh and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    run_id = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            run_id = json.load(f).get("run_id")
+    run_id = run_id or time.strftime("%Y%m%d%H%M", time.gmtime())
+    sagemaker_client = sagemaker_client or autopilot_config.get_sagemaker_client()
+    steps = retrain_steps(sagemaker_client, run_id, wait_options=wait_options, **step_options)
+    pipeline = Pipeline(steps, checkpoint_path, max_workers, log)
+    # Checkpoint the run id before any step creates resources named after it
+    pipeline.state["run_id"] = run_id
+    pipeline.save()
+    return pipeline.run()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retrain with Autopilot and deploy the best candidate")
+    parser.add_argument("--checkpoint", default="data/state/retrain.json")
+    parser.add_argument("--fresh", action="store_true", help="start a new run instead of resuming")
+    parser.add_argument("--role-arn", default=os.environ.get("SAGEMAKER_ROLE", autopilot_config.ROLE_ARN),
+                        help="SageMaker execution role (default: $SAGEMAKER_ROLE)")
+    parser.add_argument("--bucket", default=os.environ.get("S3_BUCKET"),
+                        help="bucket holding data/train/ and models/autopilot/ (default: $S3_BUCKET)")
+    parser.add_argument("--train-data-uri", help="overrides the training data location in --bucket")
+    parser.add_argument("--output-path", help="overrides the model output location in --bucket")
+    parser.add_argument("--endpoint-name", default=autopilot_config.ENDPOINT_NAME)
+    parser.add_argument("--max-poll-seconds", type=int, default=60)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.bucket:
+        train_data_uri, output_path = autopilot_config.bucket_paths(args.bucket)
+    else:
+        train_data_uri, output_path = autopilot_config.TRAIN_DATA_URI, autopilot_config.OUTPUT_PATH
+    outputs = run_retrain(
+        args.checkpoint, fresh=args.fresh, wait_options={"max_delay": args.max_poll_seconds},
+        train_data_uri=args.train_data_uri or train_data_uri, output_path=args.output_path or output_path,
+        role_arn=args.role_arn, endpoint_name=args.endpoint_name
+    )
+    print(f"Deployed candidate {outputs['train']['name']} to {outputs['endpoint']['endpoint_name']}")
+
+
+if __name__ == "__main__":
+    main()
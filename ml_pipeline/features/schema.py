@@ -0,0 +1,265 @@
+"""
+Typed schema of the transaction data shared by the generator, both ETL
+engines, scoring and the frontend.
+
+Every column is declared once in ``FIELDS`` with a logical type, which is
+mapped to the matching pandas dtype, Arrow type and Spark type:
+
+* ``category``  - low-cardinality strings; pandas ``category``, Arrow
+  ``dictionary<int32, string>`` (dictionary-encoded in Parquet), Spark string
+* ``uint8``     - 0/1 flags and small calendar values; Spark has no unsigned
+  types, so ``ByteType`` is used there (every value fits)
+* ``int32``     - counts
+* ``float32``   - derived features where 7 significant digits are plenty
+* ``float64``   - money, which must round-trip exactly to the cent
+* ``timestamp`` - microsecond precision, as Spark stores timestamps
+* ``date``      - calendar day, used for partitioning
+* ``string``    - identifiers and free text; pandas ``string[pyarrow]``, which
+  keeps nulls as ``<NA>`` on pandas 2 and 3 alike
+
+Card numbers never leave the raw data: cleaning replaces them with
+``card_hash``, the first 16 hex digits of SHA-256 over the secret
+``FRAUD_CARD_HASH_KEY`` followed by the card number. Both engines compute
+the same value, so velocity windows, profiles and the processed sort order
+all work on the pseudonym. Without the key the hash is unsalted, and a
+card number can be recovered by hashing every candidate.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from ml_pipeline.features.velocity import VELOCITY_WINDOWS
+
+# Vocabularies of the categorical fields the generator draws from and the
+# frontend offers; other values are still accepted everywhere
+MERCHANT_CATEGORIES = ['retail', 'food', 'travel', 'entertainment', 'utilities']
+TRANSACTION_TYPES = ['online', 'in_store', 'atm']
+DEVICE_TYPES = ['mobile', 'desktop', 'pos_terminal', 'atm']
+
+UNKNOWN = "unknown"
+
+CARD_HASH_KEY_VAR = "FRAUD_CARD_HASH_KEY"
+CARD_HASH_DIGITS = 16
+# Read once: looking up os.environ costs more than the hash itself
+CARD_HASH_KEY = os.environ.get(CARD_HASH_KEY_VAR, "")
+
+FIELDS = {
+    # Raw transaction
+    "transaction_id": "string",
+    "timestamp": "timestamp",
+    "amount": "float64",
+    "merchant_category": "category",
+    "card_number": "string",
+    "card_hash": "string",
+    "cardholder_name": "string",
+    "cardholder_address": "string",
+    "merchant_name": "string",
+    "merchant_city": "string",
+    "merchant_country": "category",
+    "transaction_type": "category",
+    "device_type": "category",
+    "ip_address": "string",
+    "is_fraud": "uint8",
+    # Derived features
+    "hour": "uint8",
+    "day_of_week": "uint8",
+    "month": "uint8",
+    "is_weekend": "uint8",
+    "is_night": "uint8",
+    "amount_log": "float32",
+    "is_high_risk_country": "uint8",
+    "is_online_transaction": "uint8",
+    "is_mobile_device": "uint8",
+    # Velocity features
+    **{f"card_txn_count_{window}": "int32" for window in VELOCITY_WINDOWS},
+    **{f"card_amount_{window}": "float64" for window in VELOCITY_WINDOWS},
+    "card_distinct_countries": "uint8",
+    # Profile features
+    "card_history_count": "int32",
+    "card_amount_zscore": "float32",
+    "card_foreign_country": "uint8",
+    "card_new_category": "uint8",
+    "merchant_history_count": "int32",
+    "merchant_amount_zscore": "float32",
+    # Partitioning
+    "event_date": "date",
+    # Training split
+    "sample_weight": "float32",
+}
+
+_ARROW_TYPES = {
+    "string": pa.string(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "timestamp": pa.timestamp("us"),
+    "date": pa.date32(),
+    "float64": pa.float64(),
+    "float32": pa.float32(),
+    "int32": pa.int32(),
+    "uint8": pa.uint8(),
+}
+
+_PANDAS_TYPES = {
+    "string": "string[pyarrow]",
+    "category": "category",
+    "timestamp": "datetime64[us]",
+    "date": "datetime64[s]",
+    "float64": "float64",
+    "float32": "float32",
+    "int32": "int32",
+    "uint8": "uint8",
+}
+
+# Column order of raw transaction files, as the generator writes them
+RAW_COLUMNS = [
+    "transaction_id", "timestamp", "amount", "merchant_category", "card_number",
+    "cardholder_name", "cardholder_address", "merchant_name", "merchant_city",
+    "merchant_country", "transaction_type", "device_type", "ip_address", "is_fraud",
+]
+
+# Nullable pandas dtypes, used for integer columns that contain nulls
+_NULLABLE_TYPES = {"int32": "Int32", "uint8": "UInt8"}
+
+
+def _fields(columns):
+    if columns is None:
+        return list(FIELDS)
+    return [column for column in columns if column in FIELDS]
+
+
+def arrow_schema(columns=None):
+    """
+    Arrow schema of ``columns`` (every field by default); columns outside
+    the registry are left out
+    """
+    return pa.schema([(name, _ARROW_TYPES[FIELDS[name]]) for name in _fields(columns)])
+
+
+def arrow_type(column):
+    return _ARROW_TYPES[FIELDS[column]]
+
+
+def spark_schema(columns=None):
+    """
+    Spark ``StructType`` of ``columns`` (every field by default)
+    """
+    from pyspark.sql import types as T
+
+    spark_types = {
+        "string": T.StringType(),
+        "category": T.StringType(),
+        "timestamp": T.TimestampType(),
+        "date": T.DateType(),
+        "float64": T.DoubleType(),
+        "float32": T.FloatType(),
+        "int32": T.IntegerType(),
+        "uint8": T.ByteType(),
+    }
+    return T.StructType([T.StructField(name, spark_types[FIELDS[name]]) for name in _fields(columns)])
+
+
+def cast_spark_frame(df, columns=None):
+    """
+    Cast the registered columns of a Spark DataFrame to their schema types
+    in one projection, keeping column order and unregistered columns
+
+    With ``columns``, only those are selected, in that order.
+    """
+    from pyspark.sql import functions as F
+
+    columns = df.columns if columns is None else list(columns)
+    types = {field.name: field.dataType for field in spark_schema(columns)}
+    return df.select(*[
+        F.col(column).cast(types[column]).alias(column) if column in types else F.col(column)
+        for column in columns
+    ])
+
+
+def fill_unknown(series, value=UNKNOWN):
+    """
+    ``fillna`` that also works on categoricals lacking ``value``
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def hash_card_number(card_number, key=None):
+    """
+    ``card_hash`` of one card number; ``None`` stays ``None``
+    """
+    if card_number is None or pd.isna(card_number):
+        return None
+    key = CARD_HASH_KEY if key is None else key
+    return hashlib.sha256(f"{key}{card_number}".encode()).hexdigest()[:CARD_HASH_DIGITS]
+
+
+def hash_card_numbers(cards, key=None):
+    """
+    ``card_hash`` of a Series of card numbers, hashing each distinct card once
+    """
+    key = CARD_HASH_KEY if key is None else key
+    codes, uniques = pd.factorize(cards.astype("string"))
+    hashes = np.array([hash_card_number(card, key) for card in uniques] + [None], dtype=object)
+    return pd.Series(hashes[codes], index=cards.index, dtype="string")
+
+
+def hash_card_numbers_spark(column, key=None):
+    """
+    ``card_hash`` of a Spark column of card numbers
+    """
+    from pyspark.sql import functions as F
+
+    key = CARD_HASH_KEY if key is None else key
+    return F.substring(F.sha2(F.concat(F.lit(key), column.cast("string")), 256), 1, CARD_HASH_DIGITS)
+
+
+def apply_pandas_schema(df):
+    """
+    Cast the registered columns of ``df`` in place to their compact dtypes
+
+    Integer columns that hold nulls (e.g. ``is_fraud`` of unlabeled
+    uploads) get the nullable pandas type instead.
+    """
+    for column in _fields(df.columns):
+        kind = FIELDS[column]
+        dtype = _PANDAS_TYPES[kind]
+        series = df[column]
+        if kind in ("timestamp", "date"):
+            df[column] = pd.to_datetime(series).astype(dtype)
+        elif kind in _NULLABLE_TYPES and series.isna().any():
+            df[column] = series.astype(_NULLABLE_TYPES[kind])
+        elif kind == "string":
+            df[column] = series.astype(dtype) if series.dtype != dtype else series
+        elif series.dtype != dtype:
+            df[column] = series.astype(dtype)
+    return df
+
+
+def to_arrow_table(df):
+    """
+    Arrow table of a pandas frame with the registered columns at their
+    schema types, so every written batch has the same Parquet schema
+    """
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.Table.from_pandas(df, schema=_registered(inferred), preserve_index=False)
+
+
+def _registered(schema):
+    fields = [
+        pa.field(field.name, arrow_type(field.name)) if field.name in FIELDS else field
+        for field in schema
+    ]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def cast_arrow_table(table):
+    """
+    Cast the registered columns of an Arrow table to their schema types
+    """
+    schema = _registered(table.schema)
+    if schema.equals(table.schema):
+        return table
+    return table.cast(schema)
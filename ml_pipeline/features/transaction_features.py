@@ -0,0 +1,186 @@
+"""
+Transaction feature definitions shared by the batch ETL, the data generator
+and online scoring.
+
+The features are declared once in ``FEATURE_SPEC`` and evaluated by one of
+three backends:
+
+* ``add_features_spark``   - Spark column expressions (Glue ETL)
+* ``add_features_pandas``  - vectorized pandas/NumPy (local ETL, generator)
+* ``compile_record_features`` - a precompiled closure for a single record
+  (online scoring)
+
+``day_of_week`` follows Spark's ``dayofweek`` convention (1 = Sunday ...
+7 = Saturday) in every backend, since that is what the processed training
+data contains.
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+HIGH_RISK_COUNTRIES = ("Russia", "China", "Nigeria", "Brazil")
+
+# Spark dayofweek: Sunday = 1, Saturday = 7
+WEEKEND_DAYS = (1, 7)
+NIGHT_HOURS = (22, 23, 0, 1, 2, 3, 4, 5)
+
+# Each feature is computed by `op` from `source`, which is either a raw
+# column or a feature declared earlier in the list.
+FEATURE_SPEC = [
+    {"name": "hour", "op": "hour", "source": "timestamp"},
+    {"name": "day_of_week", "op": "day_of_week", "source": "timestamp"},
+    {"name": "month", "op": "month", "source": "timestamp"},
+    {"name": "is_weekend", "op": "isin", "source": "day_of_week", "values": WEEKEND_DAYS},
+    {"name": "is_night", "op": "isin", "source": "hour", "values": NIGHT_HOURS},
+    {"name": "amount_log", "op": "log1p", "source": "amount"},
+    {"name": "is_high_risk_country", "op": "isin", "source": "merchant_country",
+     "values": HIGH_RISK_COUNTRIES},
+    {"name": "is_online_transaction", "op": "isin", "source": "transaction_type",
+     "values": ("online",)},
+    {"name": "is_mobile_device", "op": "isin", "source": "device_type", "values": ("mobile",)},
+]
+
+FEATURE_NAMES = [feature["name"] for feature in FEATURE_SPEC]
+TIME_FEATURES = ["hour", "day_of_week", "month", "is_weekend", "is_night"]
+
+_SPEC_BY_NAME = {feature["name"]: feature for feature in FEATURE_SPEC}
+
+
+def _select_spec(names):
+    """
+    Resolve the requested feature names to spec entries, pulling in any
+    features they are derived from
+    """
+    if names is None:
+        return list(FEATURE_SPEC)
+    unknown = set(names) - set(_SPEC_BY_NAME)
+    if unknown:
+        raise ValueError(f"Unknown features: {sorted(unknown)}")
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        source = _SPEC_BY_NAME[name]["source"]
+        if source in _SPEC_BY_NAME:
+            pending.append(source)
+    return [feature for feature in FEATURE_SPEC if feature["name"] in needed]
+
+
+def add_features_spark(df, names=None, base=None):
+    """
+    Add the derived features to a Spark DataFrame in a single projection
+
+    ``base`` optionally maps input columns to expressions (casts, null
+    fills) that replace them in the output and feed the features, so the
+    cleaning of the raw columns shares the same projection.
+    """
+    from pyspark.sql import functions as F
+
+    base = base or {}
+
+    def expression(source):
+        # Derived sources are inlined so every feature depends on raw columns only
+        if source in exprs:
+            return exprs[source]
+        return base.get(source, F.col(source))
+
+    exprs = {}
+    for feature in _select_spec(names):
+        source = expression(feature["source"])
+        op = feature["op"]
+        if op == "hour":
+            expr = F.hour(source)
+        elif op == "day_of_week":
+            expr = F.dayofweek(source)
+        elif op == "month":
+            expr = F.month(source)
+        elif op == "log1p":
+            expr = F.log1p(source)
+        elif op == "isin":
+            expr = F.when(source.isin(list(feature["values"])), 1).otherwise(0)
+        else:
+            raise ValueError(f"Unsupported feature op: {op}")
+        exprs[feature["name"]] = expr
+
+    kept = [base[column].alias(column) if column in base else F.col(column)
+            for column in df.columns if column not in exprs]
+    return df.select(*kept, *[expr.alias(name) for name, expr in exprs.items()])
+
+
+def add_features_pandas(df, names=None):
+    """
+    Add the derived features to a pandas DataFrame with vectorized operations
+    """
+    timestamps = None
+    for feature in _select_spec(names):
+        op = feature["op"]
+        if op in ("hour", "day_of_week", "month"):
+            if timestamps is None:
+                timestamps = pd.to_datetime(df[feature["source"]]).dt
+            if op == "hour":
+                values = timestamps.hour
+            elif op == "day_of_week":
+                values = (timestamps.dayofweek + 1) % 7 + 1
+            else:
+                values = timestamps.month
+        elif op == "log1p":
+            values = np.log1p(df[feature["source"]].astype("float64"))
+        elif op == "isin":
+            values = df[feature["source"]].isin(feature["values"]).astype(int)
+        else:
+            raise ValueError(f"Unsupported feature op: {op}")
+        df[feature["name"]] = values
+    return df
+
+
+def _record_op(feature):
+    source = feature["source"]
+    op = feature["op"]
+    if op == "hour":
+        return lambda values: values[source].hour
+    if op == "day_of_week":
+        return lambda values: values[source].isoweekday() % 7 + 1
+    if op == "month":
+        return lambda values: values[source].month
+    if op == "log1p":
+        log1p = math.log1p
+        return lambda values: log1p(float(values.get(source) or 0.0))
+    if op == "isin":
+        members = frozenset(feature["values"])
+        return lambda values: 1 if values.get(source) in members else 0
+    raise ValueError(f"Unsupported feature op: {op}")
+
+
+def compile_record_features(names=None):
+    """
+    Build a function that computes the features for one transaction dict
+
+    The spec is resolved once here, so the returned function only does dict
+    lookups and constant-set membership tests per call. A missing or empty
+    ``timestamp`` is treated as "now"; ISO-8601 strings are parsed.
+    """
+    steps = [(feature["name"], _record_op(feature)) for feature in _select_spec(names)]
+    requested = FEATURE_NAMES if names is None else list(names)
+    fromisoformat = datetime.fromisoformat
+    now = datetime.now
+
+    def transform(record):
+        values = dict(record)
+        timestamp = values.get("timestamp")
+        if not timestamp:
+            values["timestamp"] = now()
+        elif isinstance(timestamp, str):
+            values["timestamp"] = fromisoformat(timestamp)
+        for name, op in steps:
+            values[name] = op(values)
+        return {name: values[name] for name in requested}
+
+    return transform
+
+
+transaction_features = compile_record_features()
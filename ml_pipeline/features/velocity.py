@@ -0,0 +1,312 @@
+"""
+Per-card velocity features.
+
+For every transaction, over the same card's transactions (the current one
+included):
+
+* ``card_txn_count_1h`` / ``card_amount_1h``   - count and amount in the last hour
+* ``card_txn_count_24h`` / ``card_amount_24h`` - count and amount in the last day
+* ``card_distinct_countries`` - distinct merchant countries in the last
+  ``COUNTRY_HISTORY`` transactions
+
+Windows are closed on both ends and measured in whole seconds, matching a
+Spark ``rangeBetween(-window, 0)`` over the timestamp cast to long.
+
+The batch backends (Spark window functions, vectorized pandas) and the
+online ``VelocityStore`` produce the same values for time-ordered input.
+The batch backends group cleaned rows by their ``card_hash``; the online
+store keeps its per-card state in memory, keyed by the card number.
+"""
+import os
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+VELOCITY_WINDOWS = {"1h": 3600, "24h": 86400}
+COUNTRY_HISTORY = 10
+
+VELOCITY_FEATURES = [
+    f"card_{stat}_{window}"
+    for window in VELOCITY_WINDOWS
+    for stat in ("txn_count", "amount")
+] + ["card_distinct_countries"]
+
+CONTEXT_COLUMNS = ["card_hash", "timestamp", "amount", "merchant_country"]
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def add_velocity_features_spark(df):
+    """
+    Add the velocity features with Spark window functions
+    """
+    from pyspark.sql import Window
+    from pyspark.sql import functions as F
+
+    seconds = F.col("timestamp").cast("long")
+    by_card = Window.partitionBy("card_hash").orderBy(seconds)
+    columns = {}
+    for window, length in VELOCITY_WINDOWS.items():
+        frame = by_card.rangeBetween(-length, 0)
+        columns[f"card_txn_count_{window}"] = F.count(F.lit(1)).over(frame)
+        columns[f"card_amount_{window}"] = F.coalesce(F.sum("amount").over(frame), F.lit(0.0))
+    recent = by_card.rowsBetween(-(COUNTRY_HISTORY - 1), 0)
+    columns["card_distinct_countries"] = F.size(
+        F.array_distinct(F.collect_list("merchant_country").over(recent)))
+    return df.select("*", *[expr.alias(name) for name, expr in columns.items()])
+
+
+def _card_codes(cards):
+    codes, _ = pd.factorize(cards)
+    codes = codes.astype(np.int64)
+    # Rows without a card never share history with each other
+    missing = codes < 0
+    codes[missing] = codes.max(initial=-1) + 1 + np.arange(missing.sum())
+    return codes
+
+
+def _epoch_seconds(timestamps):
+    timestamps = pd.to_datetime(timestamps)
+    seconds = timestamps.astype("datetime64[s]").astype("int64").to_numpy()
+    return np.where(timestamps.isna().to_numpy(), 0, seconds)
+
+
+def add_velocity_features_pandas(df, history=None):
+    """
+    Add the velocity features to a pandas DataFrame without per-row Python
+
+    ``history`` optionally holds earlier rows (``CONTEXT_COLUMNS``) that are
+    used as window context but not returned, which is how the streaming
+    local ETL carries state across record batches.
+    """
+    context = df[CONTEXT_COLUMNS]
+    if history is not None and len(history):
+        context = pd.concat([history[CONTEXT_COLUMNS], context], ignore_index=True)
+    n_history = len(context) - len(df)
+
+    codes = _card_codes(context["card_hash"].to_numpy(dtype=object))
+    seconds = _epoch_seconds(context["timestamp"])
+    amounts = pd.to_numeric(context["amount"], errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+
+    # One sort by (card, time); windows are then searchsorted ranges in the
+    # combined key, which never crosses a card boundary thanks to `span`
+    base = seconds.min(initial=0)
+    longest = max(VELOCITY_WINDOWS.values())
+    span = int(seconds.max(initial=0) - base) + longest + 1
+    keys = codes * span + (seconds - base + longest)
+    order = np.lexsort((seconds, codes))
+    sorted_keys = keys[order]
+    cumulative = np.concatenate(([0.0], np.cumsum(amounts[order])))
+    right = np.searchsorted(sorted_keys, sorted_keys, side="right")
+
+    features = {}
+    for window, length in VELOCITY_WINDOWS.items():
+        left = np.searchsorted(sorted_keys, sorted_keys - length, side="left")
+        features[f"card_txn_count_{window}"] = right - left
+        features[f"card_amount_{window}"] = cumulative[right] - cumulative[left]
+
+    # Distinct countries over the previous COUNTRY_HISTORY rows of the card
+    countries, _ = pd.factorize(context["merchant_country"].to_numpy(dtype=object)[order])
+    sorted_codes = codes[order]
+    recent = np.full((len(order), COUNTRY_HISTORY), -1, dtype=np.int64)
+    for lag in range(min(COUNTRY_HISTORY, len(order))):
+        same_card = np.zeros(len(order), dtype=bool)
+        same_card[lag:] = sorted_codes[lag:] == sorted_codes[:len(order) - lag]
+        lagged = np.full(len(order), -1, dtype=np.int64)
+        lagged[lag:] = countries[:len(order) - lag]
+        recent[:, lag] = np.where(same_card & (lagged >= 0), lagged, -1)
+    recent.sort(axis=1)
+    changes = (recent[:, 1:] != recent[:, :-1]) & (recent[:, 1:] >= 0)
+    features["card_distinct_countries"] = changes.sum(axis=1) + (recent[:, 0] >= 0)
+
+    # Scatter back to input order and drop the history rows
+    df = df.copy()
+    for name in VELOCITY_FEATURES:
+        values = np.empty(len(order), dtype=features[name].dtype)
+        values[order] = features[name]
+        df[name] = values[n_history:]
+    return df
+
+
+class BatchVelocity:
+    """
+    Velocity features for a stream of record batches
+
+    Keeps the rows of the longest window as context for the next batch, and
+    for rows older than that only what ``card_distinct_countries`` still
+    needs: each card's last ``COUNTRY_HISTORY - 1`` rows, for at most
+    ``max_cards`` cards (least recently seen dropped first). Exact when
+    batches arrive in time order and no card is dropped; late rows only see
+    the context still retained. ``save`` and ``load`` carry that context
+    from one incremental run to the next.
+    """
+
+    def __init__(self, history=None, max_cards=1_000_000):
+        self.history = history
+        self.max_cards = max_cards
+
+    @classmethod
+    def load(cls, path, max_cards=1_000_000):
+        """
+        Restore the context saved at ``path``, or start empty if there is none
+        """
+        if not os.path.exists(path):
+            return cls(max_cards=max_cards)
+        return cls(pd.read_parquet(path), max_cards)
+
+    def save(self, path):
+        """
+        Atomically write the retained context to ``path`` as Parquet
+        """
+        if self.history is None:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        self.history.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def apply(self, df):
+        df = add_velocity_features_pandas(df, self.history)
+        context = df[CONTEXT_COLUMNS].reset_index(drop=True)
+        if self.history is not None:
+            context = pd.concat([self.history, context], ignore_index=True)
+        seconds = _epoch_seconds(context["timestamp"])
+        keep = seconds >= seconds.max(initial=0) - max(VELOCITY_WINDOWS.values())
+
+        # Older rows only feed the country count of each card's next rows
+        by_time = context.iloc[np.argsort(seconds, kind="stable")]
+        last_rows = by_time.groupby("card_hash", sort=False).tail(COUNTRY_HISTORY - 1).index.to_numpy()
+        last_seen = pd.Series(seconds).groupby(context["card_hash"]).max()
+        if len(last_seen) > self.max_cards:
+            active = last_seen.nlargest(self.max_cards).index
+            last_rows = last_rows[context["card_hash"].iloc[last_rows].isin(active).to_numpy()]
+        keep[last_rows] = True
+        self.history = context[keep].reset_index(drop=True)
+        return df
+
+
+class _CardState:
+    __slots__ = ("events", "window_sums", "window_starts", "countries")
+
+    def __init__(self, max_events):
+        # (seconds, amount) of the last day, oldest first
+        self.events = deque(maxlen=max_events)
+        # Running count/amount per window and index of its oldest event
+        self.window_sums = [[0, 0.0] for _ in VELOCITY_WINDOWS]
+        self.window_starts = [0 for _ in VELOCITY_WINDOWS]
+        self.countries = deque(maxlen=COUNTRY_HISTORY)
+
+
+class VelocityStore:
+    """
+    Online per-card velocity state with O(1) update and lookup
+
+    Each card keeps a ring buffer of at most ``max_events_per_card`` recent
+    events plus running window sums that are advanced as events expire, and
+    at most ``max_cards`` cards are kept (least recently seen evicted). The
+    hard memory cap is therefore about ``max_cards * max_events_per_card``
+    events.
+    """
+
+    def __init__(self, max_cards=1_000_000, max_events_per_card=256):
+        self.max_cards = max_cards
+        self.max_events_per_card = max_events_per_card
+        self.cards = OrderedDict()
+        self.windows = list(VELOCITY_WINDOWS.values())
+
+    def __len__(self):
+        return len(self.cards)
+
+    @staticmethod
+    def _seconds(timestamp):
+        # Naive timestamps count as UTC, as they do in pandas and Spark
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        elif not timestamp:
+            timestamp = datetime.now()
+        if not isinstance(timestamp, datetime):
+            return int(timestamp)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return (timestamp - _EPOCH) // timedelta(seconds=1)
+
+    def _expire(self, state, now):
+        events = state.events
+        for i, length in enumerate(self.windows):
+            start = state.window_starts[i]
+            sums = state.window_sums[i]
+            while start < len(events) and events[start][0] < now - length:
+                sums[0] -= 1
+                sums[1] -= events[start][1]
+                start += 1
+            state.window_starts[i] = start
+        # Drop events no window needs any more
+        expired = min(state.window_starts)
+        for _ in range(expired):
+            events.popleft()
+        if expired:
+            state.window_starts = [start - expired for start in state.window_starts]
+
+    def _state(self, card_number):
+        state = self.cards.get(card_number)
+        if state is None:
+            state = _CardState(self.max_events_per_card)
+            self.cards[card_number] = state
+            if len(self.cards) > self.max_cards:
+                self.cards.popitem(last=False)
+        else:
+            self.cards.move_to_end(card_number)
+        return state
+
+    def update(self, record):
+        """
+        Add a transaction and return its velocity features (including
+        itself), matching the batch definition for time-ordered events
+        """
+        now = self._seconds(record.get("timestamp"))
+        amount = float(record.get("amount") or 0.0)
+        card_number = record.get("card_number")
+        if card_number is None:
+            # Cardless transactions have no history, as in the batch features
+            state = _CardState(1)
+        else:
+            state = self._state(card_number)
+        if len(state.events) == state.events.maxlen:
+            # Ring buffer full: the oldest event falls out of every window
+            oldest_seconds, oldest_amount = state.events[0]
+            for i, sums in enumerate(state.window_sums):
+                if state.window_starts[i] == 0:
+                    sums[0] -= 1
+                    sums[1] -= oldest_amount
+                else:
+                    state.window_starts[i] -= 1
+        state.events.append((now, amount))
+        for sums in state.window_sums:
+            sums[0] += 1
+            sums[1] += amount
+        state.countries.append(record.get("merchant_country"))
+        self._expire(state, now)
+        return self._features(state)
+
+    def lookup(self, card_number, timestamp=None):
+        """
+        Return the velocity features of a card as of ``timestamp`` without
+        adding an event
+        """
+        state = self.cards.get(card_number)
+        if state is None:
+            return {name: 0 for name in VELOCITY_FEATURES}
+        self._expire(state, self._seconds(timestamp))
+        return self._features(state)
+
+    def _features(self, state):
+        features = {}
+        for (window, _), (count, amount) in zip(VELOCITY_WINDOWS.items(), state.window_sums):
+            features[f"card_txn_count_{window}"] = count
+            features[f"card_amount_{window}"] = amount
+        # `country == country` filters NaN as well as None
+        features["card_distinct_countries"] = len(set(
+            country for country in state.countries if country is not None and country == country))
+        return features
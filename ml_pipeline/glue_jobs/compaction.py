@@ -0,0 +1,212 @@
+"""
+Small-file compaction for the processed Parquet output.
+
+Every ETL run appends a few files per date partition, so partitions slowly
+fill up with small files that are expensive to list and open. Compaction
+merges the small files of a partition into files of about the layout's
+target size, re-sorted by the layout's sort order.
+
+A partition is replaced with a journal so an interrupted compaction never
+loses or duplicates rows: the merged files are written under hidden names,
+the journal is written, the merged files are renamed into place and only
+then are the inputs deleted. Any journal left behind is rolled forward by
+the next run. Compaction holds the dataset's lock exclusively while ETL
+appends hold it shared (``local_etl.dataset_lock``), so the two never run on
+the same output at once. Each merged file records the files it replaced (Parquet
+metadata ``fraudsage.compacted_from``), which lets incremental readers such
+as the historical stats rollup carry their counts over instead of
+rebuilding.
+
+    python -m ml_pipeline.glue_jobs.compaction --input data/processed --target-file-mb 128
+"""
+import argparse
+import glob
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ml_pipeline.features.schema import cast_arrow_table
+from ml_pipeline.glue_jobs.local_etl import DEFAULT_LAYOUT, add_layout_args, dataset_lock, layout_from_args
+
+JOURNAL_NAME = "_compaction.json"
+COMPACTED_FROM_KEY = b"fraudsage.compacted_from"
+
+
+def list_partitions(path):
+    """
+    Map every directory under ``path`` holding Parquet files to its files
+    """
+    partitions = {}
+    for file_path in sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)):
+        partitions.setdefault(os.path.dirname(file_path), []).append(file_path)
+    return partitions
+
+
+def compacted_sources(path):
+    """
+    Paths of the files a compacted file replaced (empty for other files)
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    names = json.loads(metadata.get(COMPACTED_FROM_KEY, b"[]"))
+    return [os.path.join(os.path.dirname(path), name) for name in names]
+
+
+def plan_compaction(path, layout=DEFAULT_LAYOUT, small_file_fraction=0.5):
+    """
+    Partitions with at least two files smaller than ``small_file_fraction``
+    of the target size, and those files
+    """
+    threshold = layout.target_file_bytes * small_file_fraction
+    plan = {}
+    for partition, files in list_partitions(path).items():
+        small = [file_path for file_path in files if os.path.getsize(file_path) < threshold]
+        if len(small) >= 2:
+            plan[partition] = small
+    return plan
+
+
+def _write_journal(partition, journal):
+    journal_path = os.path.join(partition, JOURNAL_NAME)
+    tmp_path = os.path.join(partition, f".{JOURNAL_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(journal, f, indent=2)
+    os.replace(tmp_path, journal_path)
+
+
+def finish_compaction(partition):
+    """
+    Roll an interrupted compaction of ``partition`` forward and remove
+    leftover hidden files of one that never reached its journal
+    """
+    journal_path = os.path.join(partition, JOURNAL_NAME)
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            journal = json.load(f)
+        for hidden, name in journal["outputs"].items():
+            hidden_path = os.path.join(partition, hidden)
+            if os.path.exists(hidden_path):
+                os.replace(hidden_path, os.path.join(partition, name))
+        for name in journal["inputs"]:
+            input_path = os.path.join(partition, name)
+            if os.path.exists(input_path):
+                os.remove(input_path)
+        os.remove(journal_path)
+    for orphan in glob.glob(os.path.join(partition, ".compacting-*")):
+        os.remove(orphan)
+
+
+def recover(path):
+    """
+    Finish every interrupted compaction under ``path``
+    """
+    with dataset_lock(path, exclusive=True):
+        return _recover(path)
+
+
+def _recover(path):
+    journals = glob.glob(os.path.join(path, "**", JOURNAL_NAME), recursive=True)
+    for journal_path in journals:
+        finish_compaction(os.path.dirname(journal_path))
+    return len(journals)
+
+
+def compact_partition(partition, files, layout=DEFAULT_LAYOUT):
+    """
+    Merge ``files`` of one partition directory into target-sized files
+    """
+    # Files of one partition share the schema, and partition values are in
+    # the directory name, so the files are read without partitioning
+    table = cast_arrow_table(ds.dataset(files, format="parquet").to_table())
+    table = layout.sort(table)
+    bytes_in = sum(os.path.getsize(file_path) for file_path in files)
+    rows_per_file = layout.rows_per_file(bytes_in / max(table.num_rows, 1))
+    run_id = uuid.uuid4().hex[:12]
+    metadata = {COMPACTED_FROM_KEY: json.dumps([os.path.basename(f) for f in files]).encode()}
+
+    outputs = {}
+    for file_id, offset in enumerate(range(0, max(table.num_rows, 1), rows_per_file)):
+        name = f"part-compacted-{run_id}-{file_id:05d}.parquet"
+        hidden = f".compacting-{name}"
+        chunk = table.slice(offset, rows_per_file)
+        chunk = chunk.replace_schema_metadata({**(chunk.schema.metadata or {}), **metadata})
+        pq.write_table(chunk, os.path.join(partition, hidden), row_group_size=layout.row_group_rows)
+        outputs[hidden] = name
+
+    # The journal is the commit point; from here on the swap is rolled forward
+    _write_journal(partition, {"inputs": [os.path.basename(f) for f in files], "outputs": outputs})
+    finish_compaction(partition)
+    bytes_out = sum(os.path.getsize(os.path.join(partition, name)) for name in outputs.values())
+    return {"files_in": len(files), "files_out": len(outputs), "bytes_in": bytes_in, "bytes_out": bytes_out,
+            "rows": table.num_rows}
+
+
+def compact(path, layout=DEFAULT_LAYOUT, small_file_fraction=0.5, max_workers=4):
+    """
+    Compact every partition under ``path`` that has small files
+
+    Partitions are independent and compacted in parallel. ETL appends to
+    ``path`` wait until compaction is done, and the other way round.
+    """
+    with dataset_lock(path, exclusive=True):
+        recovered = _recover(path)
+        plan = plan_compaction(path, layout, small_file_fraction)
+        stats = {"partitions": len(plan), "files_in": 0, "files_out": 0, "bytes_in": 0, "bytes_out": 0,
+                 "rows": 0, "recovered": recovered}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda item: compact_partition(item[0], item[1], layout), plan.items())
+            for result in results:
+                for key, value in result.items():
+                    stats[key] += value
+    return stats
+
+
+def compact_spark(spark, path, partition_values, layout=DEFAULT_LAYOUT, bytes_per_row=None):
+    """
+    Spark version: rewrite the given partitions (dicts of partition column
+    values) in place with dynamic partition overwrite
+
+    The rows are checkpointed first, because Spark cannot overwrite files it
+    is still reading from. The local dataset lock does not reach S3, so
+    this must be scheduled between runs of the Glue ETL job, never while
+    it appends to the same partitions.
+    """
+    from functools import reduce
+
+    from pyspark.sql import functions as F
+
+    from ml_pipeline.features.schema import cast_spark_frame
+
+    condition = reduce(lambda a, b: a | b, [
+        reduce(lambda a, b: a & b, [F.col(column) == F.lit(str(value)) for column, value in values.items()])
+        for values in partition_values
+    ])
+    df = cast_spark_frame(spark.read.parquet(path).where(condition)).localCheckpoint(eager=True)
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    rows_per_file = layout.rows_per_file(bytes_per_row) if bytes_per_row else layout.rows_per_file()
+    (df.repartition(*layout.partition_by)
+       .sortWithinPartitions(*layout.partition_by, *layout.sort_by)
+       .write.mode("overwrite")
+       .option("maxRecordsPerFile", rows_per_file)
+       .partitionBy(*layout.partition_by)
+       .parquet(path))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge small processed Parquet files")
+    parser.add_argument("--input", default="data/processed")
+    parser.add_argument("--small-file-fraction", type=float, default=0.5,
+                        help="files below this fraction of the target size are merged")
+    parser.add_argument("--workers", type=int, default=4)
+    add_layout_args(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stats = compact(args.input, layout_from_args(args), args.small_file_fraction, args.workers)
+    print(f"Merged {stats['files_in']:,} files ({stats['bytes_in'] / 1e6:,.1f} MB) into "
+          f"{stats['files_out']:,} ({stats['bytes_out'] / 1e6:,.1f} MB) in {stats['partitions']} partitions")
@@ -0,0 +1,205 @@
+"""
+Negative downsampling of the processed data into a compact training split.
+
+Fraud is about 1% of transactions, so almost all of Autopilot's training
+time goes to legitimate rows. This stage keeps every fraud row and a
+deterministic, hash-based sample of ``negative_rate`` of the legitimate
+ones, chosen so that about ``negative_ratio`` negatives remain per positive.
+Each row gets a ``sample_weight`` (1 for fraud, ``1 / negative_rate`` for
+kept legitimate rows) so weighted training sees the original class
+balance. A model trained *without* the weights over-predicts fraud; its
+scores ``q`` are corrected with the rate stored in the metadata:
+
+    p = r * q / (r * q + 1 - q)
+
+The split is written as plain (unpartitioned) Parquet so ``is_fraud`` is a
+column in the files, and identifier columns no model should learn from
+are dropped:
+
+    python -m ml_pipeline.glue_jobs.downsample --input data/processed --output data/train --negative-ratio 20
+"""
+import argparse
+import glob
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ml_pipeline.features.profiles import PROFILE_FEATURES
+from ml_pipeline.features.schema import cast_arrow_table
+from ml_pipeline.glue_jobs.local_etl import OUTPUT_COLUMNS, TransactionIdIndex, read_processed
+
+# Identifiers and free text: unique per row or entity, no signal to learn
+ID_COLUMNS = ["transaction_id", "card_hash", "timestamp", "merchant_name", "merchant_city"]
+
+WEIGHT_COLUMN = "sample_weight"
+
+TRAINING_COLUMNS = [column for column in OUTPUT_COLUMNS if column not in ID_COLUMNS] + [WEIGHT_COLUMN]
+
+
+def metadata_path_for(output_path):
+    # Kept beside the split: Autopilot reads every file under its prefix
+    return f"{output_path.rstrip('/')}_metadata.json"
+
+
+def negative_sample_rate(n_positive, n_negative, negative_ratio):
+    """
+    Fraction of negatives to keep for ``negative_ratio`` negatives per
+    positive (never more than all of them)
+    """
+    if n_negative == 0:
+        return 1.0
+    return float(min(1.0, negative_ratio * max(n_positive, 1) / n_negative))
+
+
+def keep_mask(transaction_ids, is_fraud, negative_rate):
+    """
+    Keep every positive and the negatives whose id hash falls below
+    ``negative_rate``; the same id is always kept or dropped
+    """
+    hashes = TransactionIdIndex.hash_ids(transaction_ids)
+    # Top 53 bits of the hash as a uniform float in [0, 1)
+    uniform = (hashes >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+    return (np.asarray(is_fraud) == 1) | (uniform < negative_rate)
+
+
+def sample_weights(is_fraud, negative_rate):
+    return np.where(np.asarray(is_fraud) == 1, 1.0, 1.0 / negative_rate)
+
+
+def calibrate(probabilities, negative_rate):
+    """
+    Map scores of a model trained on unweighted downsampled data back to
+    the original class balance
+    """
+    q = np.asarray(probabilities, dtype="float64")
+    return negative_rate * q / (negative_rate * q + 1.0 - q)
+
+
+def date_filter(start_date=None, end_date=None):
+    """
+    Filter on the ``event_date`` partitions in ``[start_date, end_date]``
+    (ISO dates, either end open); None when unbounded
+    """
+    condition = None
+    if start_date:
+        condition = ds.field("event_date") >= date.fromisoformat(start_date)
+    if end_date:
+        upper = ds.field("event_date") <= date.fromisoformat(end_date)
+        condition = upper if condition is None else condition & upper
+    return condition
+
+
+def write_training_split(input_path, output_path, negative_ratio=20.0, batch_size=262144,
+                         rows_per_file=1_000_000, metadata_path=None, start_date=None, end_date=None):
+    """
+    Downsample the date-partitioned processed output into ``output_path``
+
+    Only the ``event_date`` partitions between ``start_date`` and
+    ``end_date`` are read. Counts come from Parquet metadata, then the data
+    is streamed once, so memory stays bounded by one record batch. Returns
+    the metadata, which is also written to ``metadata_path`` (next to the
+    split by default).
+    """
+    dataset = read_processed(input_path)
+    window = date_filter(start_date, end_date)
+    is_positive = ds.field("is_fraud") == 1
+    n_positive = dataset.count_rows(filter=is_positive if window is None else window & is_positive)
+    n_negative = dataset.count_rows(filter=window) - n_positive
+    rate = negative_sample_rate(n_positive, n_negative, negative_ratio)
+
+    # The split is rewritten as a whole; drop files of an earlier run
+    os.makedirs(output_path, exist_ok=True)
+    for stale in glob.glob(os.path.join(output_path, "part-*.parquet")):
+        os.remove(stale)
+    columns = [column for column in TRAINING_COLUMNS if column != WEIGHT_COLUMN]
+    # Profile features are kept when the ETL enriched the rows with them
+    columns += [column for column in PROFILE_FEATURES if column in dataset.schema.names]
+    scan_columns = list(dict.fromkeys(columns + ["transaction_id"]))
+    writer = None
+    file_id = 0
+    rows_in_file = 0
+    kept = {"positive": 0, "negative": 0}
+    try:
+        for batch in dataset.to_batches(columns=scan_columns, filter=window, batch_size=batch_size):
+            if not batch.num_rows:
+                continue
+            is_fraud = batch.column("is_fraud").to_numpy(zero_copy_only=False).astype(np.int64)
+            mask = keep_mask(batch.column("transaction_id").to_numpy(zero_copy_only=False), is_fraud, rate)
+            if not mask.any():
+                continue
+            table = pa.Table.from_batches([batch]).filter(pa.array(mask)).select(columns)
+            table = table.append_column(WEIGHT_COLUMN, pa.array(sample_weights(is_fraud[mask], rate)))
+            # Store schema types regardless of how the input was written
+            table = cast_arrow_table(table)
+            if writer is None or rows_in_file >= rows_per_file:
+                if writer is not None:
+                    writer.close()
+                writer = pq.ParquetWriter(os.path.join(output_path, f"part-{file_id:05d}.parquet"), table.schema)
+                file_id += 1
+                rows_in_file = 0
+            writer.write_table(table)
+            rows_in_file += table.num_rows
+            n_kept_positive = int((is_fraud[mask] == 1).sum())
+            kept["positive"] += n_kept_positive
+            kept["negative"] += table.num_rows - n_kept_positive
+    finally:
+        if writer is not None:
+            writer.close()
+
+    metadata = {
+        "negative_ratio": negative_ratio,
+        "negative_rate": rate,
+        "calibration": "p = negative_rate * q / (negative_rate * q + 1 - q)",
+        "weight_column": WEIGHT_COLUMN,
+        "input_rows": {"positive": int(n_positive), "negative": int(n_negative)},
+        "output_rows": kept,
+        "files": file_id,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    with open(metadata_path or metadata_path_for(output_path), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def downsample_spark(df, negative_ratio=20.0):
+    """
+    Spark version: returns the downsampled training split with weights and
+    the negative sampling rate
+    """
+    from pyspark.sql import functions as F
+
+    counts = {row["is_fraud"]: row["count"] for row in df.groupBy("is_fraud").count().collect()}
+    rate = negative_sample_rate(counts.get(1, 0), counts.get(0, 0), negative_ratio)
+    # Non-negative 63-bit hash as a uniform draw in [0, 1)
+    uniform = F.abs(F.xxhash64("transaction_id") % F.lit(1 << 62)) / F.lit(float(1 << 62))
+    is_fraud = F.col("is_fraud").cast("int") == 1
+    sampled = df.where(is_fraud | (uniform < F.lit(rate)))
+    sampled = sampled.withColumn(
+        WEIGHT_COLUMN, F.when(is_fraud, F.lit(1.0)).otherwise(F.lit(1.0 / rate)))
+    return sampled.select(TRAINING_COLUMNS), rate
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write a negatively downsampled training split")
+    parser.add_argument("--input", default="data/processed")
+    parser.add_argument("--output", default="data/train")
+    parser.add_argument("--negative-ratio", type=float, default=20.0, help="negatives kept per positive")
+    parser.add_argument("--start-date", help="first event date to train on (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="last event date to train on (YYYY-MM-DD)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    metadata = write_training_split(args.input, args.output, args.negative_ratio,
+                                    start_date=args.start_date, end_date=args.end_date)
+    kept = metadata["output_rows"]
+    total_in = sum(metadata["input_rows"].values())
+    print(f"Kept {kept['positive'] + kept['negative']:,} of {total_in:,} rows "
+          f"(negative rate {metadata['negative_rate']:.4f})")
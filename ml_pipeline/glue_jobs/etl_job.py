@@ -1,95 +1,221 @@
 import sys
-from awsglue.transforms import *
-from awsglue.utils import getResolvedOptions
-from awsglue.context import GlueContext
-from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrame
-from pyspark.context import SparkContext
-from pyspark.sql.functions import *
-from pyspark.sql.types import *
-
-# Initialize Glue context
-args = getResolvedOptions(sys.argv, ['JOB_NAME'])
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-job.init(args['JOB_NAME'], args)
+import time
+
+import pandas as pd
+
+# Shipped to the job with --extra-py-files alongside this script
+from ml_pipeline.features.schema import (
+    RAW_COLUMNS, UNKNOWN, cast_spark_frame, hash_card_numbers_spark, spark_schema
+)
+from ml_pipeline.features.transaction_features import FEATURE_NAMES, add_features_spark
+from ml_pipeline.features.velocity import add_velocity_features_spark
+from ml_pipeline.glue_jobs import local_etl
+from ml_pipeline.glue_jobs.downsample import downsample_spark, metadata_path_for
+from ml_pipeline.glue_jobs.historical_stats import append_rollup_spark, publish_historical_stats_spark, write_stats
+from ml_pipeline.glue_jobs.incremental import append_history_index, dedup_against_history
+from ml_pipeline.glue_jobs.local_etl import DEFAULT_LAYOUT, OUTPUT_COLUMNS, UNKNOWN_FILL_COLUMNS
+from ml_pipeline.glue_jobs.validation import (
+    DEFAULT_RULES, ValidationError, check, decide, load_profile, profile_exprs_spark, summary_from_metrics
+)
+from ml_pipeline.monitoring import tracing
 
 # Define input and output paths
 input_path = "s3://your-bucket/data/raw/"
 output_path = "s3://your-bucket/data/processed/"
+dedup_index_path = "s3://your-bucket/data/state/dedup_index/"
+stats_rollup_path = "s3://your-bucket/data/state/hourly_rollup/"
+historical_stats_path = "s3://your-bucket/data/stats/historical_stats.json"
+train_output_path = "s3://your-bucket/data/train/"
+negative_ratio = 20.0
+training_window_days = 180
+layout = DEFAULT_LAYOUT
+reference_profile_path = "s3://your-bucket/data/state/reference_profile.json"
+quarantine_path = "s3://your-bucket/data/quarantine/"
+validation_rules = DEFAULT_RULES
 
-# Read raw data
-raw_data = glueContext.create_dynamic_frame.from_options(
-    connection_type="s3",
-    connection_options={"paths": [input_path]},
-    format="csv",
-    format_options={"withHeader": True}
-)
+# Adaptive query execution re-plans at shuffle boundaries with runtime
+# statistics: it merges the small post-shuffle partitions of the dedup and
+# partitioned write, splits skewed joins and turns joins into broadcasts
+# once one side turns out small
+SPARK_CONF = {
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.adaptive.skewJoin.enabled": "true",
+    "spark.sql.adaptive.localShuffleReader.enabled": "true",
+}
+
+def configure_spark(spark, conf=SPARK_CONF):
+    for key, value in conf.items():
+        spark.conf.set(key, value)
+    return spark
+
+def raw_read_schema():
+    """
+    Explicit schema of the raw CSV files, so Spark neither scans them to
+    infer types nor reads every column as a string
+
+    Timestamps stay strings here and are parsed by the cast in
+    ``clean_data``, which accepts both ISO forms the generator writes.
+    """
+    from pyspark.sql import types as T
 
-# Convert to Spark DataFrame
-df = raw_data.toDF()
+    return T.StructType([
+        T.StructField(field.name, T.StringType()) if field.name == "timestamp" else field
+        for field in spark_schema(RAW_COLUMNS)
+    ])
+
+def read_raw(spark, path):
+    """
+    Read raw CSV with the explicit schema (addresses span lines)
+    """
+    return (spark.read.schema(raw_read_schema())
+            .options(header=True, multiLine=True, escape='"')
+            .csv(path))
+
+def use_job_bookmarks(argv=None):
+    # Bookmarks are the only Glue-only feature the job uses; Glue passes
+    # the option to the script as --job-bookmark-option job-bookmark-enable
+    return "job-bookmark-enable" in (sys.argv if argv is None else argv)
 
 # Data cleaning and transformation
 def clean_data(df):
-    # Convert timestamp to datetime
-    df = df.withColumn("timestamp", to_timestamp("timestamp"))
-    
-    # Handle missing values
-    df = df.na.fill("unknown", ["merchant_category", "merchant_name", "merchant_city", "merchant_country"])
-    df = df.na.fill(0, ["amount"])
-    
-    # Remove duplicates
-    df = df.dropDuplicates(["transaction_id"])
-    
-    # Add derived features
-    df = df.withColumn("hour", hour("timestamp"))
-    df = df.withColumn("day_of_week", dayofweek("timestamp"))
-    df = df.withColumn("month", month("timestamp"))
-    df = df.withColumn("is_weekend", when(col("day_of_week").isin(6, 7), 1).otherwise(0))
-    df = df.withColumn("is_night", when((col("hour") >= 22) | (col("hour") <= 5), 1).otherwise(0))
-    
-    # Feature engineering
-    df = df.withColumn("amount_log", log(col("amount") + 1))
-    df = df.withColumn("is_high_risk_country", 
-                      when(col("merchant_country").isin(["Russia", "China", "Nigeria", "Brazil"]), 1)
-                      .otherwise(0))
-    df = df.withColumn("is_online_transaction", 
-                      when(col("transaction_type") == "online", 1)
-                      .otherwise(0))
-    df = df.withColumn("is_mobile_device", 
-                      when(col("device_type") == "mobile", 1)
-                      .otherwise(0))
-    
-    # Select and order features
-    feature_columns = [
-        "transaction_id", "timestamp", "amount", "amount_log",
-        "merchant_category", "merchant_name", "merchant_city",
-        "merchant_country", "transaction_type", "device_type",
-        "hour", "day_of_week", "month", "is_weekend", "is_night",
-        "is_high_risk_country", "is_online_transaction", "is_mobile_device",
-        "is_fraud"
-    ]
-    
-    return df.select(feature_columns)
-
-# Clean and transform data
-cleaned_df = clean_data(df)
-
-# Convert back to DynamicFrame
-cleaned_dynamic_frame = DynamicFrame.fromDF(cleaned_df, glueContext, "cleaned_data")
-
-# Write processed data
-glueContext.write_dynamic_frame.from_options(
-    frame=cleaned_dynamic_frame,
-    connection_type="s3",
-    connection_options={
-        "path": output_path,
-        "partitionKeys": ["merchant_category", "is_fraud"]
-    },
-    format="parquet"
-)
+    # pandas frames go through the single-node engine
+    if isinstance(df, pd.DataFrame):
+        return local_etl.clean_data(df)
+
+    from pyspark.sql import Window
+    from pyspark.sql import functions as F
+
+    # Pseudonymize the card and shuffle once by its hash: the windows and
+    # the output only see the hash, and re-delivered copies of a
+    # transaction carry the same card, so they land in the same partition
+    df = df.withColumn("card_hash", hash_card_numbers_spark(F.col("card_number"))).drop("card_number")
+    df = df.repartition("card_hash")
+
+    # Remove duplicates inside those partitions, keeping the earliest copy;
+    # a global dropDuplicates would shuffle every column a second time
+    copies = Window.partitionBy("card_hash", "transaction_id").orderBy("timestamp")
+    df = df.withColumn("_copy", F.row_number().over(copies)).where(F.col("_copy") == 1).drop("_copy")
+
+    # Schema casts, missing values and every derived feature in one projection
+    types = {field.name: field.dataType for field in spark_schema(df.columns)}
+    base = {column: F.col(column).cast(types[column]) for column in types}
+    for column in UNKNOWN_FILL_COLUMNS:
+        if column in base:
+            base[column] = F.coalesce(base[column], F.lit(UNKNOWN))
+    base["amount"] = F.coalesce(base["amount"], F.lit(0.0))
+    df = add_features_spark(df, FEATURE_NAMES, base)
+
+    # Per-card velocity windows
+    df = add_velocity_features_spark(df)
+
+    # Select and order features at their schema types
+    return cast_spark_frame(df, OUTPUT_COLUMNS)
+
+def write_processed_spark(df, path, layout=layout):
+    """
+    Append a cleaned batch in the processed layout
+
+    Each date goes to one task, which sorts its rows and splits them into
+    files of about the target size.
+    """
+    from pyspark.sql import functions as F
+
+    if "event_date" in layout.partition_by:
+        df = df.withColumn("event_date", F.to_date("timestamp"))
+    (df.repartition(*layout.partition_by)
+       .sortWithinPartitions(*layout.partition_by, *layout.sort_by)
+       .write.mode("append")
+       .option("maxRecordsPerFile", layout.rows_per_file())
+       .partitionBy(*layout.partition_by)
+       .parquet(path))
+
+def main():
+    from awsglue.context import GlueContext
+    from awsglue.job import Job
+    from awsglue.utils import getResolvedOptions
+    from pyspark.context import SparkContext
+    from pyspark.sql import Observation
+    from pyspark.sql import functions as F
+
+    # Initialize Glue context
+    args = getResolvedOptions(sys.argv, ['JOB_NAME'])
+    sc = SparkContext()
+    glueContext = GlueContext(sc)
+    spark = configure_spark(glueContext.spark_session)
+    job = Job(glueContext)
+    job.init(args['JOB_NAME'], args)
+
+    if use_job_bookmarks():
+        # The transformation_ctx lets job bookmarks skip files read by
+        # earlier runs; DynamicFrames read every column as a string, which
+        # clean_data casts
+        raw_data = glueContext.create_dynamic_frame.from_options(
+            connection_type="s3",
+            connection_options={"paths": [input_path]},
+            format="csv",
+            format_options={"withHeader": True, "multiline": True},
+            transformation_ctx="raw_data"
+        )
+        df = raw_data.toDF()
+    else:
+        # Without bookmarks a plain DataFrame read skips the DynamicFrame
+        # conversion and its schema inference pass
+        df = read_raw(spark, input_path)
+
+    # Profile the raw rows as they stream through the cleaning pass; observe
+    # adds no extra scan or shuffle
+    reference = load_profile(reference_profile_path)
+    reference_summary = reference.summary() if reference is not None else None
+    observation = Observation("raw_profile")
+    df = df.observe(observation, *profile_exprs_spark(reference_summary))
+
+    # Clean and transform data, dropping ids already processed by earlier runs
+    cleaned_df = dedup_against_history(clean_data(df), dedup_index_path).cache()
+
+    # Materializing the cache is the pass that fills in the observed profile;
+    # Spark is lazy, so spans time the actions that execute the plan
+    with tracing.span("glue.clean_data"):
+        tracing.count("glue.rows_out", cleaned_df.count())
+    summary = summary_from_metrics(observation.get, reference_summary)
+    violations = check(summary, reference_summary, validation_rules)
+    decision = decide(violations)
+    if decision == "reject":
+        raise ValidationError(f"Batch rejected: {violations}")
+    if decision == "quarantine":
+        # Set the batch aside with its report; the bookmark still advances
+        run_path = f"{quarantine_path}{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}/"
+        cleaned_df.drop("id_hash").write.mode("overwrite").parquet(run_path)
+        write_stats({"violations": violations, "summary": summary}, f"{run_path.rstrip('/')}_report.json")
+        job.commit()
+        return
+
+    # Write processed data: date partitions, rows sorted inside each file and
+    # files capped near the layout's target size
+    with tracing.span("glue.write_processed"):
+        write_processed_spark(cleaned_df.drop("id_hash"), output_path)
+
+    # Record the new ids only once the output is written, then advance the bookmark
+    with tracing.span("glue.history_index"):
+        append_history_index(cleaned_df, dedup_index_path)
+
+    # Fold this batch into the dashboard's historical statistics
+    with tracing.span("glue.historical_stats"):
+        append_rollup_spark(cleaned_df, stats_rollup_path)
+        publish_historical_stats_spark(spark, stats_rollup_path, historical_stats_path)
+
+    # Rewrite the compact, negatively downsampled Autopilot training split
+    # Only the training window's event_date partitions are read
+    processed_df = spark.read.parquet(output_path).where(
+        F.col("event_date") >= F.date_sub(F.current_date(), training_window_days))
+    training_df, negative_rate = downsample_spark(processed_df, negative_ratio)
+    with tracing.span("glue.training_split"):
+        training_df.write.mode("overwrite").parquet(train_output_path)
+    write_stats({"negative_ratio": negative_ratio, "negative_rate": negative_rate,
+                 "weight_column": "sample_weight"}, metadata_path_for(train_output_path))
+
+    # Job completion
+    job.commit()
 
-# Job completion
-job.commit() 
\ No newline at end of file
+if __name__ == "__main__":
+    main()
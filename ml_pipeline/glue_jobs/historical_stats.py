@@ -0,0 +1,280 @@
+"""
+Historical fraud statistics for the dashboard.
+
+Processed transactions are rolled up into hourly buckets of transaction
+count, fraud count, amount and fraud amount. Rollups are plain sums, so
+rollups of disjoint inputs merge by adding them up: each run reads only the
+Parquet files written since the previous run (their size and mtime are
+stored with the rollup), merges their rollup into the stored one and rewrites
+``historical_stats.json`` with daily series and summary metrics. The JSON
+lives outside the processed root: Parquet readers of that dataset would
+otherwise try to read it as a data file.
+
+    python -m ml_pipeline.glue_jobs.historical_stats --input data/processed \\
+        --state-dir data/state/stats --output data/stats/historical_stats.json
+
+The Glue job appends the rollup of each cleaned batch with
+``append_rollup_spark`` and publishes the JSON with
+``publish_historical_stats_spark``.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from ml_pipeline.glue_jobs.compaction import compacted_sources, recover as recover_compactions
+from ml_pipeline.glue_jobs.incremental import FileBookmark
+
+ROLLUP_COLUMNS = ["transactions", "fraud", "amount", "fraud_amount"]
+
+# The dashboard gets every day but only the most recent week of hours
+HOURLY_WINDOW_DAYS = 7
+
+
+def empty_rollup():
+    rollup = pd.DataFrame({column: pd.Series(dtype="float64") for column in ROLLUP_COLUMNS})
+    rollup.index = pd.DatetimeIndex([], name="hour")
+    return rollup
+
+
+def rollup_transactions(df):
+    """
+    Hourly rollup of a DataFrame with ``timestamp``, ``amount`` and
+    ``is_fraud`` columns
+    """
+    hours = pd.to_datetime(df["timestamp"]).to_numpy().astype("datetime64[h]")
+    fraud = pd.to_numeric(df["is_fraud"]).to_numpy(dtype="float64")
+    amount = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+    valid = ~np.isnat(hours)
+    # Batches span few distinct hours, so bincount over their codes beats a groupby
+    unique_hours, codes = np.unique(hours[valid], return_inverse=True)
+    fraud, amount = fraud[valid], amount[valid]
+    rollup = pd.DataFrame({
+        "transactions": np.bincount(codes, minlength=len(unique_hours)).astype("float64"),
+        "fraud": np.bincount(codes, weights=fraud, minlength=len(unique_hours)),
+        "amount": np.bincount(codes, weights=amount, minlength=len(unique_hours)),
+        "fraud_amount": np.bincount(codes, weights=amount * fraud, minlength=len(unique_hours)),
+    }, index=pd.DatetimeIndex(unique_hours.astype("datetime64[us]"), name="hour"))
+    return rollup
+
+
+def merge_rollups(*rollups):
+    """
+    Combine rollups of disjoint inputs
+    """
+    rollups = [rollup for rollup in rollups if len(rollup)]
+    if not rollups:
+        return empty_rollup()
+    return pd.concat(rollups).groupby(level="hour").sum().sort_index()
+
+
+def rollup_files(paths, base_dir, batch_size=262144):
+    """
+    Roll up a list of hive-partitioned Parquet files batch by batch
+    """
+    if not paths:
+        return empty_rollup()
+    dataset = ds.dataset(paths, format="parquet", partitioning="hive", partition_base_dir=base_dir)
+    rollups = [
+        rollup_transactions(batch.to_pandas())
+        for batch in dataset.to_batches(columns=["timestamp", "amount", "is_fraud"], batch_size=batch_size)
+        if batch.num_rows
+    ]
+    return merge_rollups(*rollups)
+
+
+def build_stats(rollup, hourly_window_days=HOURLY_WINDOW_DAYS):
+    """
+    Dashboard payload: daily series, recent hourly series and totals
+    """
+    daily = rollup.groupby(rollup.index.floor("D")).sum()
+    transactions = daily["transactions"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily_rate = np.where(transactions > 0, daily["fraud"].to_numpy() / transactions, 0.0)
+    total = float(rollup["transactions"].sum())
+    detected = float(rollup["fraud"].sum())
+    if len(rollup):
+        recent = rollup[rollup.index > rollup.index.max() - pd.Timedelta(days=hourly_window_days)]
+    else:
+        recent = rollup
+    recent_transactions = recent["transactions"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hourly_rate = np.where(recent_transactions > 0, recent["fraud"].to_numpy() / recent_transactions, 0.0)
+    return {
+        "date": [day.strftime("%Y-%m-%d") for day in daily.index],
+        "fraud_rate": daily_rate.tolist(),
+        "transactions": daily["transactions"].astype("int64").tolist(),
+        "fraud": daily["fraud"].astype("int64").tolist(),
+        "amount": daily["amount"].round(2).tolist(),
+        "hourly": {
+            "hour": [hour.strftime("%Y-%m-%dT%H:00:00") for hour in recent.index],
+            "fraud_rate": hourly_rate.tolist(),
+            "transactions": recent["transactions"].astype("int64").tolist(),
+        },
+        "avg_fraud_rate": detected / total if total else 0.0,
+        "total_transactions": int(total),
+        "detected_fraud": int(detected),
+        "total_amount": round(float(rollup["amount"].sum()), 2),
+        "fraud_amount": round(float(rollup["fraud_amount"].sum()), 2),
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_stats(stats, path, s3_client=None):
+    """
+    Write the stats JSON to a local path or an ``s3://bucket/key`` URI
+    """
+    body = json.dumps(stats)
+    if path.startswith("s3://"):
+        import boto3
+
+        bucket, key = path[len("s3://"):].split("/", 1)
+        (s3_client or boto3.client("s3")).put_object(
+            Bucket=bucket, Key=key, Body=body.encode(), ContentType="application/json")
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def read_stats(path, s3_client=None):
+    """
+    Read the stats JSON from a local path or an ``s3://bucket/key`` URI
+    """
+    if path.startswith("s3://"):
+        import boto3
+
+        bucket, key = path[len("s3://"):].split("/", 1)
+        response = (s3_client or boto3.client("s3")).get_object(Bucket=bucket, Key=key)
+        return json.loads(response["Body"].read().decode())
+    with open(path) as f:
+        return json.load(f)
+
+
+def _inside(path, directory):
+    if path.startswith("s3://") or directory.startswith("s3://"):
+        return path.startswith(directory.rstrip("/") + "/")
+    directory = os.path.abspath(directory)
+    return os.path.commonpath([os.path.abspath(path), directory]) == directory
+
+
+def _file_signatures(paths):
+    return {path: FileBookmark._signature(path) for path in paths}
+
+
+def load_rollup(path):
+    """
+    Return the stored rollup and the signatures of the files it covers
+    """
+    if not os.path.exists(path):
+        return empty_rollup(), {}
+    table = pq.read_table(path)
+    files = json.loads(table.schema.metadata.get(b"fraudsage.files", b"{}"))
+    return table.to_pandas(), files
+
+
+def save_rollup(rollup, files, path):
+    """
+    Atomically persist a rollup together with the files it covers, so the
+    two can never disagree after a failed run
+    """
+    table = pa.Table.from_pandas(rollup)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}), b"fraudsage.files": json.dumps(files).encode()})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def update_historical_stats(processed_path, state_dir, stats_path):
+    """
+    Fold Parquet files written since the last run into the stored rollup
+    and republish the stats JSON
+
+    Files written by compaction only hold rows of counted files they
+    replaced, so they are marked as counted without reading them. If any
+    other counted file was removed or rewritten its old contribution cannot
+    be subtracted, so the rollup is rebuilt from scratch instead.
+    """
+    if _inside(stats_path, processed_path):
+        raise ValueError(f"stats path {stats_path} is inside the processed dataset {processed_path}")
+    # A half-finished compaction would show its rows twice
+    recover_compactions(processed_path)
+    rollup_path = os.path.join(state_dir, "hourly_rollup.parquet")
+    rollup, covered = load_rollup(rollup_path)
+    signatures = _file_signatures(
+        sorted(glob.glob(os.path.join(processed_path, "**", "*.parquet"), recursive=True)))
+    new_files = [path for path, signature in signatures.items() if covered.get(path) != signature]
+    replaced = set()
+    for path in list(new_files):
+        sources = compacted_sources(path)
+        if sources and all(source in covered and source not in signatures for source in sources):
+            replaced.update(sources)
+            new_files.remove(path)
+    rebuild = bool(set(covered) - set(signatures) - replaced) or any(path in covered for path in new_files)
+    if rebuild:
+        rollup, new_files = empty_rollup(), list(signatures)
+    rollup = merge_rollups(rollup, rollup_files(new_files, processed_path))
+    save_rollup(rollup, signatures, rollup_path)
+    write_stats(build_stats(rollup), stats_path)
+    return {"files_read": len(new_files), "rebuilt": rebuild, "hours": len(rollup)}
+
+
+def append_rollup_spark(df, rollup_path):
+    """
+    Append the hourly rollup of a cleaned Spark batch to ``rollup_path``
+
+    Each run appends its own rows; readers sum them per hour.
+    """
+    from pyspark.sql import functions as F
+
+    fraud = F.col("is_fraud").cast("double")
+    amount = F.col("amount").cast("double")
+    rollup = df.groupBy(F.date_trunc("hour", "timestamp").alias("hour")).agg(
+        F.count(F.lit(1)).cast("double").alias("transactions"),
+        F.sum(fraud).alias("fraud"),
+        F.sum(amount).alias("amount"),
+        F.sum(amount * fraud).alias("fraud_amount"),
+    )
+    rollup.coalesce(1).write.mode("append").parquet(rollup_path)
+
+
+def publish_historical_stats_spark(spark, rollup_path, stats_path):
+    """
+    Merge every appended rollup and publish the stats JSON
+
+    The merged rollup has at most one row per hour, so it is collected to
+    the driver and formatted with the same code as the local job.
+    """
+    from pyspark.sql import functions as F
+
+    merged = spark.read.parquet(rollup_path).groupBy("hour").agg(
+        *[F.sum(column).alias(column) for column in ROLLUP_COLUMNS])
+    rollup = merged.toPandas().set_index("hour").sort_index()
+    rollup.index = pd.DatetimeIndex(rollup.index, name="hour")
+    write_stats(build_stats(rollup), stats_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Update the historical fraud statistics")
+    parser.add_argument("--input", default="data/processed")
+    parser.add_argument("--state-dir", default="data/state/stats")
+    parser.add_argument("--output", default="data/stats/historical_stats.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stats = update_historical_stats(args.input, args.state_dir, args.output)
+    print(f"Read {stats['files_read']} new files; rollup covers {stats['hours']:,} hours"
+          + (" (rebuilt)" if stats["rebuilt"] else ""))
@@ -0,0 +1,280 @@
+"""
+Incremental processing state for the ETL.
+
+* ``FileBookmark`` remembers which raw files (by size and mtime) were already
+  consumed, so a run only reads new or changed input.
+* ``BatchVelocity`` context (the last day of rows, plus the last few
+  countries of recently seen cards) is saved as Parquet, so velocity
+  windows span run boundaries.
+* ``DedupIndex`` is a persistent set of transaction id hashes: an in-memory
+  Bloom filter answers "definitely new" for almost every id, and only Bloom
+  positives are checked exactly against sorted, memory-mapped segment files.
+  Each run appends one segment, so a daily run costs time proportional to
+  its own input rather than to the accumulated history.
+
+The Glue job uses Glue job bookmarks for the first part and
+``dedup_against_history`` (a broadcast semi-join on a compact Parquet hash
+index) for the second.
+"""
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.features.velocity import BatchVelocity
+from ml_pipeline.glue_jobs.local_etl import (
+    DEFAULT_BLOCK_SIZE, DEFAULT_LAYOUT, TransactionIdIndex, list_input_files, run_local_etl
+)
+
+
+class FileBookmark:
+    """
+    JSON record of consumed input files keyed by path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)["files"]
+        self.pending = {}
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def new_files(self, paths):
+        """
+        Return the paths that were never consumed or changed since
+        """
+        return [path for path in paths if self.files.get(path) != self._signature(path)]
+
+    def mark(self, path):
+        self.pending[path] = self._signature(path)
+
+    def commit(self):
+        self.files.update(self.pending)
+        self.pending = {}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files, "updated_at": time.time()}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class DedupIndex:
+    """
+    Persistent transaction id set: Bloom filter with exact segment fallback
+
+    ``capacity`` and ``error_rate`` size the Bloom filter once, when the
+    index is created. Past capacity the false positive rate rises, which
+    only costs more exact lookups, never wrong answers.
+
+    Every file is written under a temporary name and renamed into place,
+    and a new segment only becomes visible after the Bloom filter covering
+    it. If the files still disagree on load (the segments hold a different
+    number of ids than ``meta.json`` records), the filter is rebuilt from
+    the segments.
+    """
+
+    def __init__(self, path, capacity=50_000_000, error_rate=0.01, max_segments=32):
+        self.path = path
+        self.max_segments = max_segments
+        os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.bloom = np.fromfile(os.path.join(path, "bloom.bin"), dtype=np.uint8)
+        else:
+            n_bits = int(-capacity * np.log(error_rate) / np.log(2) ** 2)
+            meta = {
+                "n_bits": n_bits,
+                "n_hashes": max(1, int(round(n_bits / capacity * np.log(2)))),
+                "size": 0,
+            }
+            self.bloom = np.zeros((n_bits + 7) // 8, dtype=np.uint8)
+        self.n_bits = np.uint64(meta["n_bits"])
+        self.n_hashes = meta["n_hashes"]
+        self.size = meta["size"]
+        self.segments = [
+            np.load(segment, mmap_mode="r")
+            for segment in sorted(glob.glob(os.path.join(path, "segments", "*.npy")))
+        ]
+        stored = sum(len(segment) for segment in self.segments)
+        if stored != self.size or len(self.bloom) != (meta["n_bits"] + 7) // 8:
+            # Left behind by an interrupted commit: trust the segments
+            self.bloom = np.zeros((meta["n_bits"] + 7) // 8, dtype=np.uint8)
+            for segment in self.segments:
+                self._bloom_add(np.asarray(segment))
+            self.size = stored
+        # Hashes accepted during this run, flushed as one segment on commit
+        self.pending = TransactionIdIndex()
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def _bit_positions(self, hashes):
+        # Kirsch-Mitzenmacher double hashing on the two 32-bit halves
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        return [(low + np.uint64(i) * high) % self.n_bits for i in range(self.n_hashes)]
+
+    def _bloom_contains(self, hashes):
+        found = np.ones(len(hashes), dtype=bool)
+        for bits in self._bit_positions(hashes):
+            found &= (self.bloom[bits >> np.uint64(3)] >> (bits & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return found
+
+    def _bloom_add(self, hashes):
+        for bits in self._bit_positions(hashes):
+            np.bitwise_or.at(
+                self.bloom, bits >> np.uint64(3),
+                np.left_shift(1, (bits & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+            )
+
+    def contains(self, hashes):
+        """
+        Return a boolean mask of the hashes already in the index
+        """
+        found = self.pending.contains(hashes)
+        candidates = np.flatnonzero(~found & self._bloom_contains(hashes))
+        for segment in self.segments:
+            if len(candidates) == 0:
+                break
+            probe = hashes[candidates]
+            positions = np.minimum(np.searchsorted(segment, probe), len(segment) - 1)
+            hit = segment[positions] == probe
+            found[candidates[hit]] = True
+            candidates = candidates[~hit]
+        return found
+
+    def filter_new(self, ids):
+        """
+        Return a mask keeping the first occurrence of every id not seen in
+        this run or any committed run, and record those ids
+        """
+        hashes = TransactionIdIndex.hash_ids(ids)
+        keep = ~pd.Series(hashes).duplicated().to_numpy()
+        keep &= ~self.contains(hashes)
+        self.pending.add(hashes[keep])
+        self._bloom_add(hashes[keep])
+        return keep
+
+    def commit(self):
+        """
+        Persist the ids accepted since the last commit as a new segment
+
+        The Bloom filter (which already holds the new ids) is replaced
+        first, then the segment is renamed into place, then ``meta.json``.
+        """
+        _write_atomic(os.path.join(self.path, "bloom.bin"), self.bloom.tofile)
+        if len(self.pending):
+            new_hashes = np.concatenate([bucket for bucket in self.pending.buckets if len(bucket)])
+            new_hashes.sort()
+            segment_path = os.path.join(
+                self.path, "segments", f"segment-{time.time_ns():020d}.npy")
+            _write_atomic(segment_path, lambda f: np.save(f, new_hashes))
+            self.segments.append(np.load(segment_path, mmap_mode="r"))
+            self.size += len(new_hashes)
+            self.pending = TransactionIdIndex()
+        if len(self.segments) > self.max_segments:
+            self.compact()
+        meta = {"n_bits": int(self.n_bits), "n_hashes": self.n_hashes, "size": self.size}
+        _write_atomic(os.path.join(self.path, "meta.json"), lambda f: f.write(json.dumps(meta).encode()))
+
+    def compact(self):
+        """
+        Merge all segments into one so exact lookups stay a single search
+
+        An interrupted compaction leaves ids in both the merged and the old
+        segments, which lookups tolerate; the next compaction drops the
+        repeats.
+        """
+        old_paths = sorted(glob.glob(os.path.join(self.path, "segments", "*.npy")))
+        merged = np.unique(np.concatenate([np.asarray(segment) for segment in self.segments]))
+        segment_path = os.path.join(self.path, "segments", f"segment-{time.time_ns():020d}.npy")
+        _write_atomic(segment_path, lambda f: np.save(f, merged))
+        self.segments = [np.load(segment_path, mmap_mode="r")]
+        self.size = len(merged)
+        for old_path in old_paths:
+            os.remove(old_path)
+
+
+def _write_atomic(path, write):
+    """
+    Call ``write`` with a binary file under a temporary name, then rename
+    it to ``path``
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def run_incremental_etl(input_path, output_path, state_dir, block_size=DEFAULT_BLOCK_SIZE,
+                        layout=DEFAULT_LAYOUT, index_capacity=50_000_000, validator=None, profiles=None):
+    """
+    Run the local ETL over raw files not yet consumed, deduplicating against
+    every previous run
+
+    State is committed only after the output is written (index, velocity
+    context, then bookmark), so a run that fails before writing is simply
+    repeated and never loses rows. The output and the state are not one
+    transaction, though: if the run dies after writing output but before
+    the index is committed, the rerun writes those rows a second time, and
+    dying between the index and the velocity context leaves the next run's
+    windows without that run's rows. ``index_capacity`` only matters when
+    the index is first created.
+    """
+    bookmark = FileBookmark(os.path.join(state_dir, "bookmark.json"))
+    index = DedupIndex(os.path.join(state_dir, "dedup_index"), capacity=index_capacity)
+    velocity_path = os.path.join(state_dir, "velocity.parquet")
+    velocity = BatchVelocity.load(velocity_path)
+    all_files = list_input_files(input_path)
+    new_files = bookmark.new_files(all_files)
+    stats = run_local_etl(new_files, output_path, block_size, layout, seen_ids=index, validator=validator,
+                          profiles=profiles, velocity=velocity)
+    index.commit()
+    velocity.save(velocity_path)
+    for path in new_files:
+        bookmark.mark(path)
+    bookmark.commit()
+    stats["files_skipped"] = len(all_files) - len(new_files)
+    return stats
+
+
+def dedup_against_history(df, index_path):
+    """
+    Drop rows of a Spark DataFrame whose transaction id is already in the
+    Parquet hash index at ``index_path``
+
+    The batch's hashes are broadcast into a semi-join over the compact
+    ``id_hash`` column, so the processed history itself is never shuffled.
+    The surviving rows keep their ``id_hash`` column; hand them to
+    ``append_history_index`` once the output has been written.
+    """
+    from pyspark.sql import functions as F
+    from pyspark.sql.utils import AnalysisException
+
+    df = df.withColumn("id_hash", F.xxhash64("transaction_id"))
+    try:
+        history = df.sparkSession.read.parquet(index_path)
+    except AnalysisException:
+        # No index yet: first incremental run
+        return df
+    batch_hashes = df.select("id_hash").distinct()
+    seen = history.join(F.broadcast(batch_hashes), "id_hash", "left_semi")
+    return df.join(F.broadcast(seen), "id_hash", "left_anti")
+
+
+def append_history_index(df, index_path):
+    """
+    Record the ``id_hash`` values of a written batch in the Parquet index
+    """
+    df.select("id_hash").write.mode("append").parquet(index_path)
@@ -0,0 +1,594 @@
+"""
+Single-pass validation and profiling of raw transaction batches.
+
+Each batch is profiled once, column by column, into mergeable sketches:
+
+* null counts, min/max
+* ``HyperLogLog`` distinct counts (about 1.6% error)
+* ``TDigest`` quantiles of numeric columns
+* ``FrequencySketch`` category counts, bounded to the most frequent values
+
+The batch profile is summarized and checked against a stored reference
+profile with declarative rules (``DEFAULT_RULES``). Each failed rule has an
+action: ``warn`` only reports, ``quarantine`` sets the batch aside with its
+report instead of loading it, and ``reject`` stops the run. Accepted
+batches are merged into a running profile that can become the next
+reference.
+
+The Glue job computes the same summary with ``DataFrame.observe`` while
+the batch is materialized anyway, so validation adds neither a scan nor a
+shuffle:
+
+    python -m ml_pipeline.glue_jobs.local_etl --input data/raw --output data/processed \\
+        --validate data/state/reference_profile.json --quarantine data/quarantine --update-reference
+"""
+import base64
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.features.schema import DEVICE_TYPES, MERCHANT_CATEGORIES, TRANSACTION_TYPES
+
+# How each raw column is profiled
+PROFILE_COLUMNS = {
+    "transaction_id": "id",
+    "card_number": "id",
+    "timestamp": "timestamp",
+    "amount": "numeric",
+    "merchant_category": "categorical",
+    "merchant_country": "categorical",
+    "transaction_type": "categorical",
+    "device_type": "categorical",
+    "is_fraud": "categorical",
+}
+
+QUANTILES = {"p01": 0.01, "p50": 0.5, "p99": 0.99}
+
+# Categories counted by the Spark profile when the reference has none
+DEFAULT_VOCABULARIES = {
+    "merchant_category": MERCHANT_CATEGORIES,
+    "transaction_type": TRANSACTION_TYPES,
+    "device_type": DEVICE_TYPES,
+    "is_fraud": ["0", "1"],
+}
+
+ACTIONS = ("warn", "quarantine", "reject")
+
+# Rules comparing against the reference are skipped until one exists
+DEFAULT_RULES = [
+    {"column": "transaction_id", "check": "max_null_rate", "value": 0.0, "action": "reject"},
+    {"column": "timestamp", "check": "max_null_rate", "value": 0.01, "action": "quarantine"},
+    {"column": "amount", "check": "max_null_rate", "value": 0.01, "action": "quarantine"},
+    {"column": "amount", "check": "range", "min": 0.0, "max": 1_000_000.0, "action": "quarantine"},
+    {"column": "transaction_id", "check": "min_distinct_ratio", "value": 0.9, "action": "warn"},
+    {"column": "merchant_category", "check": "max_new_category_share", "value": 0.05, "action": "quarantine"},
+    {"column": "transaction_type", "check": "max_new_category_share", "value": 0.05, "action": "quarantine"},
+    {"column": "device_type", "check": "max_new_category_share", "value": 0.05, "action": "quarantine"},
+    {"column": "amount", "check": "quantile_drift", "quantile": "p50", "max_ratio": 2.0, "action": "warn"},
+    {"column": "amount", "check": "quantile_drift", "quantile": "p99", "max_ratio": 3.0, "action": "warn"},
+]
+
+
+class ValidationError(Exception):
+    """A batch failed a rule whose action is ``reject``"""
+
+
+def _popcount64(values):
+    """
+    Set bits per uint64; SWAR bit counting where np.bitwise_count (NumPy 2)
+    is missing
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    values = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    values = (values & np.uint64(0x3333333333333333)) + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    values = (values + (values >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (values * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class HyperLogLog:
+    """
+    Distinct count sketch over 64-bit hashes with ``2 ** precision``
+    one-byte registers; merged by taking the register-wise maximum
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return self
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        # A guard bit caps the rank at 64 - precision + 1
+        rest = (hashes << p) | (np.uint64(1) << (p - np.uint64(1)))
+        # Leading zeros: smear the highest set bit down, then count the ones
+        smeared = rest.copy()
+        for shift in (1, 2, 4, 8, 16, 32):
+            smeared |= smeared >> np.uint64(shift)
+        rank = (65 - _popcount64(smeared)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        return cls(data["precision"], registers)
+
+
+class TDigest:
+    """
+    Mergeable quantile sketch: weighted centroids, small near the tails
+    (arcsine scale function) so extreme quantiles stay accurate
+
+    ``compression`` bounds the number of centroids.
+    """
+
+    def __init__(self, compression=200, means=None, weights=None, minimum=np.inf, maximum=-np.inf):
+        self.compression = compression
+        self.means = means if means is not None else np.empty(0)
+        self.weights = weights if weights is not None else np.empty(0)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(np.intp)
+        merged_weights = np.bincount(groups, weights=weights)
+        merged_means = np.bincount(groups, weights=weights * means)
+        keep = merged_weights > 0
+        self.weights = merged_weights[keep]
+        self.means = merged_means[keep] / self.weights
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other):
+        merged = TDigest(self.compression, minimum=min(self.minimum, other.minimum),
+                         maximum=max(self.maximum, other.maximum))
+        if self.count or other.count:
+            merged._compress(np.concatenate([self.means, other.means]),
+                             np.concatenate([self.weights, other.weights]))
+        return merged
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0.0], cumulative, [self.count]))
+        values = np.concatenate(([self.minimum], self.means, [self.maximum]))
+        return float(np.interp(q * self.count, positions, values))
+
+    def to_dict(self):
+        return {"compression": self.compression, "means": self.means.tolist(),
+                "weights": self.weights.tolist(), "min": self.minimum, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["compression"], np.array(data["means"], dtype=np.float64),
+                   np.array(data["weights"], dtype=np.float64), data["min"], data["max"])
+
+
+def _hashes(values):
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def _value_counts(series):
+    """
+    Non-zero counts of the non-null values keyed by their string form
+    """
+    counts = series.value_counts(dropna=True, sort=False)
+    counts = counts[counts > 0]
+    return dict(zip(counts.index.astype("str"), counts.to_numpy().tolist()))
+
+
+class FrequencySketch:
+    """
+    Category counts bounded to the ``capacity`` most frequent values; the
+    counts of evicted values are kept in ``other`` so shares stay exact
+    for what is kept
+    """
+
+    def __init__(self, capacity=1000, counts=None, other=0):
+        self.capacity = capacity
+        self.counts = counts or {}
+        self.other = other
+
+    def _trim(self):
+        if len(self.counts) > self.capacity:
+            kept = sorted(self.counts.items(), key=lambda item: -item[1])[:self.capacity]
+            self.other += sum(self.counts.values()) - sum(count for _, count in kept)
+            self.counts = dict(kept)
+
+    def add_counts(self, counts):
+        for value, count in counts.items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        self._trim()
+        return self
+
+    def add(self, values):
+        return self.add_counts(_value_counts(pd.Series(values)))
+
+    def merge(self, other):
+        merged = FrequencySketch(max(self.capacity, other.capacity), dict(self.counts), self.other + other.other)
+        return merged.add_counts(other.counts)
+
+    def shares(self):
+        total = sum(self.counts.values()) + self.other
+        return {value: count / total for value, count in self.counts.items()} if total else {}
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "counts": self.counts, "other": self.other}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["capacity"], dict(data["counts"]), data["other"])
+
+
+class ColumnProfile:
+    """
+    Sketches of one column; ``kind`` is one of ``PROFILE_COLUMNS``' values
+    """
+
+    def __init__(self, kind, rows=0, nulls=0, minimum=None, maximum=None, hll=None, digest=None,
+                 frequencies=None):
+        self.kind = kind
+        self.rows = rows
+        self.nulls = nulls
+        self.minimum = minimum
+        self.maximum = maximum
+        self.hll = hll or HyperLogLog()
+        self.digest = digest if digest is not None else (TDigest() if kind == "numeric" else None)
+        self.frequencies = frequencies if frequencies is not None else (
+            FrequencySketch() if kind == "categorical" else None)
+
+    def add(self, series):
+        if self.kind == "timestamp":
+            series = pd.to_datetime(series, errors="coerce")
+        elif self.kind == "numeric":
+            series = pd.to_numeric(series, errors="coerce")
+        present = series.notna().to_numpy()
+        values = series[present]
+        self.rows += len(series)
+        self.nulls += int(len(series) - present.sum())
+        if not len(values):
+            return self
+        if self.kind == "timestamp":
+            microseconds = values.astype("datetime64[us]").astype("int64").to_numpy()
+            self._extend(float(microseconds.min()) / 1e6, float(microseconds.max()) / 1e6)
+            self.hll.add_hashes(pd.util.hash_array(microseconds))
+        elif self.kind == "numeric":
+            array = values.to_numpy(dtype=np.float64)
+            self._extend(float(array.min()), float(array.max()))
+            self.digest.add(array)
+            self.hll.add_hashes(pd.util.hash_array(array))
+        elif self.kind == "categorical":
+            # Few distinct values: count them, then sketch only the distinct ones
+            counts = _value_counts(values)
+            self.frequencies.add_counts(counts)
+            self.hll.add_hashes(_hashes(list(counts)))
+        else:
+            self.hll.add_hashes(_hashes(values.astype("str").to_numpy()))
+        return self
+
+    def _extend(self, minimum, maximum):
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def merge(self, other):
+        merged = ColumnProfile(
+            self.kind, self.rows + other.rows, self.nulls + other.nulls, hll=self.hll.merge(other.hll),
+            digest=self.digest.merge(other.digest) if self.digest is not None else None,
+            frequencies=self.frequencies.merge(other.frequencies) if self.frequencies is not None else None)
+        for value in (self.minimum, self.maximum, other.minimum, other.maximum):
+            if value is not None:
+                merged._extend(value, value)
+        return merged
+
+    def summary(self):
+        summary = {
+            "rows": self.rows,
+            "null_rate": self.nulls / self.rows if self.rows else 0.0,
+            "distinct": self.hll.count(),
+            "min": self.minimum,
+            "max": self.maximum,
+        }
+        if self.digest is not None:
+            summary["quantiles"] = {name: self.digest.quantile(q) for name, q in QUANTILES.items()}
+        if self.frequencies is not None:
+            summary["frequencies"] = self.frequencies.shares()
+        return summary
+
+    def to_dict(self):
+        return {
+            "kind": self.kind, "rows": self.rows, "nulls": self.nulls, "min": self.minimum, "max": self.maximum,
+            "hll": self.hll.to_dict(),
+            "digest": self.digest.to_dict() if self.digest is not None else None,
+            "frequencies": self.frequencies.to_dict() if self.frequencies is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["kind"], data["rows"], data["nulls"], data["min"], data["max"],
+            HyperLogLog.from_dict(data["hll"]),
+            TDigest.from_dict(data["digest"]) if data["digest"] is not None else None,
+            FrequencySketch.from_dict(data["frequencies"]) if data["frequencies"] is not None else None)
+
+
+class Profile:
+    """
+    Per-column sketches of a batch or of many merged batches
+    """
+
+    def __init__(self, columns=None):
+        self.columns = columns or {}
+
+    @classmethod
+    def from_frame(cls, df, columns=PROFILE_COLUMNS):
+        return cls({
+            column: ColumnProfile(kind).add(df[column])
+            for column, kind in columns.items() if column in df.columns
+        })
+
+    def merge(self, other):
+        columns = dict(self.columns)
+        for column, profile in other.columns.items():
+            columns[column] = columns[column].merge(profile) if column in columns else profile
+        return Profile(columns)
+
+    def summary(self):
+        return {column: profile.summary() for column, profile in self.columns.items()}
+
+    def to_dict(self):
+        return {"columns": {column: profile.to_dict() for column, profile in self.columns.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({column: ColumnProfile.from_dict(profile) for column, profile in data["columns"].items()})
+
+
+def check(summary, reference=None, rules=DEFAULT_RULES):
+    """
+    Evaluate ``rules`` on a batch summary (and the reference summary, if
+    any) and return the violations
+    """
+    violations = []
+    for rule in rules:
+        column = summary.get(rule["column"])
+        expected = (reference or {}).get(rule["column"])
+        if column is None:
+            continue
+        check_name = rule["check"]
+        observed = None
+        failed = False
+        if check_name == "max_null_rate":
+            observed = column["null_rate"]
+            failed = observed > rule["value"]
+        elif check_name == "range":
+            observed = [column["min"], column["max"]]
+            failed = column["min"] is not None and (
+                ("min" in rule and column["min"] < rule["min"]) or ("max" in rule and column["max"] > rule["max"]))
+        elif check_name == "min_distinct_ratio":
+            present = column["rows"] * (1 - column["null_rate"])
+            observed = column["distinct"] / present if present else 1.0
+            failed = observed < rule["value"]
+        elif check_name == "max_new_category_share":
+            if expected is None or not expected.get("frequencies"):
+                continue
+            observed = sum(share for value, share in column.get("frequencies", {}).items()
+                           if value not in expected["frequencies"])
+            failed = observed > rule["value"]
+        elif check_name == "quantile_drift":
+            if expected is None or not expected.get("quantiles"):
+                continue
+            current = column.get("quantiles", {}).get(rule["quantile"])
+            baseline = expected["quantiles"].get(rule["quantile"])
+            if current is None or not baseline or current <= 0:
+                continue
+            observed = current / baseline
+            failed = max(observed, 1 / observed) > rule["max_ratio"]
+        else:
+            raise ValueError(f"Unsupported check: {check_name}")
+        if failed:
+            violations.append({**rule, "observed": observed})
+    return violations
+
+
+def decide(violations):
+    """
+    The strictest action among the violations, or ``accept``
+    """
+    actions = [violation.get("action", "warn") for violation in violations]
+    for action in reversed(ACTIONS):
+        if action in actions and action != "warn":
+            return action
+    return "accept"
+
+
+def load_profile(path):
+    from ml_pipeline.glue_jobs.historical_stats import read_stats
+
+    if path is None or (not path.startswith("s3://") and not os.path.exists(path)):
+        return None
+    try:
+        return Profile.from_dict(read_stats(path))
+    except Exception as e:
+        if path.startswith("s3://") and "NoSuchKey" in str(e):
+            return None
+        raise
+
+
+def save_profile(profile, path):
+    from ml_pipeline.glue_jobs.historical_stats import write_stats
+
+    write_stats(profile.to_dict(), path)
+
+
+class BatchValidator:
+    """
+    Validates record batches against a reference profile
+
+    Quarantined batches are written to ``quarantine_path`` as Parquet with
+    a JSON report beside them. ``stats`` counts batches and rows by
+    outcome, and ``profile`` merges every accepted batch.
+    """
+
+    def __init__(self, reference_path=None, rules=DEFAULT_RULES, quarantine_path=None, log=print):
+        self.reference_path = reference_path
+        self.reference = load_profile(reference_path)
+        self.reference_summary = self.reference.summary() if self.reference is not None else None
+        self.rules = rules
+        self.quarantine_path = quarantine_path
+        self.log = log or (lambda message: None)
+        self.profile = Profile()
+        self.stats = {"batches": 0, "accepted": 0, "quarantined": 0, "rows_quarantined": 0, "warnings": 0}
+
+    def validate(self, df, name="batch"):
+        """
+        Profile and check one batch; returns True if it should be loaded
+
+        Raises ``ValidationError`` for a rejected batch.
+        """
+        profile = Profile.from_frame(df)
+        violations = check(profile.summary(), self.reference_summary, self.rules)
+        decision = decide(violations)
+        self.stats["batches"] += 1
+        self.stats["warnings"] += sum(violation.get("action", "warn") == "warn" for violation in violations)
+        for violation in violations:
+            self.log(f"[{name}] {violation['column']} {violation['check']} failed "
+                     f"({violation.get('action', 'warn')}): observed {violation['observed']}")
+        if decision == "reject":
+            raise ValidationError(f"Batch {name} rejected: {violations}")
+        if decision == "quarantine":
+            self.quarantine(df, name, profile, violations)
+            return False
+        self.stats["accepted"] += 1
+        self.profile = self.profile.merge(profile)
+        return True
+
+    def quarantine(self, df, name, profile, violations):
+        self.stats["quarantined"] += 1
+        self.stats["rows_quarantined"] += len(df)
+        if not self.quarantine_path:
+            return
+        os.makedirs(self.quarantine_path, exist_ok=True)
+        df.to_parquet(os.path.join(self.quarantine_path, f"{name}.parquet"), index=False)
+        report = {"batch": name, "rows": len(df), "violations": violations, "summary": profile.summary(),
+                  "quarantined_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        with open(os.path.join(self.quarantine_path, f"{name}.json"), "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    def update_reference(self):
+        """
+        Fold the accepted batches into the stored reference profile
+        """
+        reference = self.reference.merge(self.profile) if self.reference is not None else self.profile
+        save_profile(reference, self.reference_path)
+        return reference
+
+
+def profile_exprs_spark(reference_summary=None, columns=PROFILE_COLUMNS):
+    """
+    Aggregate expressions computing a batch summary, for
+    ``DataFrame.observe``; every one of them is computed per partition and
+    merged on the driver, so none needs a shuffle
+
+    Category shares are counted for the reference's categories (or the
+    default vocabulary), which is what the new-category rule needs.
+    """
+    from pyspark.sql import functions as F
+
+    exprs = [F.count(F.lit(1)).alias("rows")]
+    for column, kind in columns.items():
+        value = F.col(column)
+        if kind == "timestamp":
+            value = value.cast("timestamp")
+        elif kind == "numeric":
+            value = value.cast("double")
+        exprs.append(F.sum(F.when(value.isNull(), 1).otherwise(0)).alias(f"{column}__nulls"))
+        exprs.append(F.approx_count_distinct(value, 0.02).alias(f"{column}__distinct"))
+        if kind == "numeric":
+            exprs.append(F.min(value).alias(f"{column}__min"))
+            exprs.append(F.max(value).alias(f"{column}__max"))
+            exprs.append(F.percentile_approx(value, list(QUANTILES.values()), 1000).alias(f"{column}__quantiles"))
+        elif kind == "timestamp":
+            exprs.append(F.min(F.unix_timestamp(value)).alias(f"{column}__min"))
+            exprs.append(F.max(F.unix_timestamp(value)).alias(f"{column}__max"))
+        elif kind == "categorical":
+            known = (reference_summary or {}).get(column, {}).get("frequencies") or DEFAULT_VOCABULARIES.get(column)
+            for i, category in enumerate(sorted(known or [])):
+                exprs.append(F.sum(F.when(value.cast("string") == F.lit(category), 1).otherwise(0))
+                             .alias(f"{column}__category_{i}"))
+    return exprs
+
+
+def summary_from_metrics(metrics, reference_summary=None, columns=PROFILE_COLUMNS):
+    """
+    Turn the observed metrics row into the summary format of
+    ``Profile.summary``
+    """
+    rows = metrics["rows"]
+    summary = {}
+    for column, kind in columns.items():
+        if f"{column}__nulls" not in metrics:
+            continue
+        nulls = metrics[f"{column}__nulls"] or 0
+        summary[column] = {
+            "rows": rows, "null_rate": nulls / rows if rows else 0.0, "distinct": metrics[f"{column}__distinct"],
+            "min": metrics.get(f"{column}__min"), "max": metrics.get(f"{column}__max"),
+        }
+        if kind == "numeric":
+            values = metrics.get(f"{column}__quantiles") or [None] * len(QUANTILES)
+            summary[column]["quantiles"] = dict(zip(QUANTILES, values))
+        elif kind == "categorical":
+            known = (reference_summary or {}).get(column, {}).get("frequencies") or DEFAULT_VOCABULARIES.get(column)
+            present = rows - nulls
+            frequencies = {}
+            for i, category in enumerate(sorted(known or [])):
+                count = metrics.get(f"{column}__category_{i}") or 0
+                if count and present:
+                    frequencies[category] = count / present
+            # Everything outside the counted categories is new to the reference
+            counted = sum(frequencies.values())
+            if present and counted < 1.0 - 1e-9:
+                frequencies["__other__"] = 1.0 - counted
+            summary[column]["frequencies"] = frequencies
+    return summary
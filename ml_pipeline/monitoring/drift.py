@@ -0,0 +1,396 @@
+"""
+Feature and score drift monitor for the real-time scoring path.
+
+Each monitored feature, and the predicted probability, is counted into a
+fixed-bin histogram declared in ``DRIFT_SPEC``. Bins are uniform (after an
+optional ``log1p``), so placing a value is one multiply and one increment
+and the monitor adds next to nothing to a request. Every histogram ends
+with a ``missing`` bin, and categoricals have an ``other`` bin for values
+outside the vocabulary.
+
+Because all workers share the same bins, snapshots merge by adding counts.
+A report compares the merged counts with the training profile using the
+population stability index (PSI) and, for numeric features, the
+Kolmogorov-Smirnov statistic on the binned distributions.
+
+The training profile is built from the training split (weighted by
+``sample_weight`` when present) and, given a model, its scores. Rows the
+scoring rules decide are left out of the score histogram, as they are in
+live snapshots:
+
+    python -m ml_pipeline.monitoring.drift --input data/train --model models/local_model.json \\
+        --output data/state/drift_reference.json
+"""
+import argparse
+import glob
+import math
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.features.schema import DEVICE_TYPES, MERCHANT_CATEGORIES, TRANSACTION_TYPES
+
+PREDICTION = "predicted_probability"
+
+DRIFT_SPEC = [
+    {"name": "amount", "kind": "numeric", "transform": "log1p", "low": 0.0, "high": 12.0, "bins": 48},
+    {"name": "hour", "kind": "numeric", "low": 0, "high": 24, "bins": 24},
+    {"name": "is_weekend", "kind": "numeric", "low": 0, "high": 2, "bins": 2},
+    {"name": "is_night", "kind": "numeric", "low": 0, "high": 2, "bins": 2},
+    {"name": "is_high_risk_country", "kind": "numeric", "low": 0, "high": 2, "bins": 2},
+    {"name": "card_txn_count_1h", "kind": "numeric", "transform": "log1p", "low": 0.0, "high": 6.0, "bins": 24},
+    {"name": "card_txn_count_24h", "kind": "numeric", "transform": "log1p", "low": 0.0, "high": 8.0, "bins": 32},
+    {"name": "card_amount_1h", "kind": "numeric", "transform": "log1p", "low": 0.0, "high": 14.0, "bins": 56},
+    {"name": "card_amount_24h", "kind": "numeric", "transform": "log1p", "low": 0.0, "high": 16.0, "bins": 64},
+    {"name": "card_distinct_countries", "kind": "numeric", "low": 0, "high": 11, "bins": 11},
+    {"name": "merchant_category", "kind": "categorical", "values": MERCHANT_CATEGORIES},
+    {"name": "transaction_type", "kind": "categorical", "values": TRANSACTION_TYPES},
+    {"name": "device_type", "kind": "categorical", "values": DEVICE_TYPES},
+    {"name": PREDICTION, "kind": "numeric", "low": 0.0, "high": 1.0, "bins": 50},
+]
+
+# Conventional PSI bands: below 0.1 stable, above 0.25 a significant shift
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+
+
+class NumericBins:
+    """
+    ``bins`` uniform bins over ``[low, high)`` (of ``log1p(value)`` with the
+    log transform); out-of-range values go to the first or last bin
+    """
+
+    def __init__(self, spec):
+        self.bins = spec["bins"]
+        self.low = float(spec["low"])
+        self.scale = spec["bins"] / (float(spec["high"]) - self.low)
+        self.log = spec.get("transform") == "log1p"
+        self.size = self.bins + 1
+        self.labels = [f"{spec['low'] + i / self.scale:g}" for i in range(self.bins)] + ["missing"]
+
+    def index(self, value):
+        if value is None:
+            return self.bins
+        try:
+            x = float(value)
+        except (TypeError, ValueError):
+            return self.bins
+        if x != x:
+            return self.bins
+        if self.log:
+            x = math.log1p(x) if x > 0 else 0.0
+        i = int((x - self.low) * self.scale)
+        return 0 if i < 0 else (self.bins - 1 if i >= self.bins else i)
+
+    def indices(self, values):
+        x = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)
+        missing = np.isnan(x)
+        if self.log:
+            x = np.log1p(np.maximum(np.nan_to_num(x), 0.0))
+        i = np.clip(np.floor((np.nan_to_num(x) - self.low) * self.scale), 0, self.bins - 1).astype(np.intp)
+        i[missing] = self.bins
+        return i
+
+
+class CategoricalBins:
+    """
+    One bin per vocabulary value, then ``other`` and ``missing``
+    """
+
+    def __init__(self, spec):
+        self.lookup = {value: i for i, value in enumerate(spec["values"])}
+        self.other = len(self.lookup)
+        self.missing = self.other + 1
+        self.size = self.missing + 1
+        self.labels = list(spec["values"]) + ["other", "missing"]
+
+    def index(self, value):
+        if value is None or value != value:
+            return self.missing
+        return self.lookup.get(value, self.other)
+
+    def indices(self, values):
+        series = pd.Series(values)
+        codes = np.array(series.astype(object).map(self.lookup).fillna(self.other), dtype=np.intp)
+        codes[series.isna().to_numpy()] = self.missing
+        return codes
+
+
+def make_bins(spec):
+    return NumericBins(spec) if spec["kind"] == "numeric" else CategoricalBins(spec)
+
+
+def empty_snapshot(spec=DRIFT_SPEC):
+    return {"events": 0, "rule_decided": 0,
+            "counts": {feature["name"]: [0] * make_bins(feature).size for feature in spec}}
+
+
+def merge_snapshots(*snapshots):
+    """
+    Add up the counts of snapshots taken with the same spec
+    """
+    merged = {"events": 0, "rule_decided": 0, "counts": {}}
+    for snapshot in snapshots:
+        merged["events"] += snapshot["events"]
+        merged["rule_decided"] += snapshot.get("rule_decided", 0)
+        for name, counts in snapshot["counts"].items():
+            total = merged["counts"].get(name)
+            merged["counts"][name] = list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+    return merged
+
+
+def snapshot_from_frame(df, probabilities=None, weights=None, spec=DRIFT_SPEC, scored=None):
+    """
+    Vectorized snapshot of a whole frame (e.g. the training split);
+    ``weights`` count rows more than once, such as downsampling weights
+
+    ``scored`` marks the rows the model scored; the others (decided by
+    rules) count towards the features and ``rule_decided`` but not the
+    prediction histogram.
+    """
+    weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+    snapshot = {"events": float(len(df) if weights is None else weights.sum()), "counts": {}}
+    if scored is not None:
+        scored = np.asarray(scored, dtype=bool)
+        snapshot["rule_decided"] = int((~scored).sum())
+    for feature in spec:
+        bins = make_bins(feature)
+        feature_weights = weights
+        if feature["name"] == PREDICTION:
+            values = probabilities
+            if values is not None and scored is not None:
+                values = np.asarray(values)[scored]
+                feature_weights = None if weights is None else weights[scored]
+        else:
+            values = df[feature["name"]] if feature["name"] in df.columns else None
+        if values is None:
+            continue
+        counts = np.bincount(bins.indices(values), weights=feature_weights, minlength=bins.size)
+        snapshot["counts"][feature["name"]] = counts.tolist()
+    return snapshot
+
+
+class DriftMonitor:
+    """
+    In-memory histograms of live traffic
+
+    ``observe`` costs one bin lookup per feature plus a short critical
+    section; ``snapshot`` copies the counts for merging or publishing.
+    """
+
+    def __init__(self, spec=DRIFT_SPEC, clock=time.time):
+        self.spec = spec
+        self.clock = clock
+        self.bins = [(feature["name"], make_bins(feature)) for feature in spec]
+        self.started_at = clock()
+        self._state = empty_snapshot(spec)
+        self._lock = threading.Lock()
+        self._report = None
+        self._report_at = None
+        self._published_at = None
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def observe(self, record, probability=None, rule=None):
+        """
+        Count one scored transaction
+
+        A transaction decided by ``rule`` counts towards the features and
+        ``rule_decided``; its fixed score stays out of the prediction
+        histogram, which tracks the model.
+        """
+        indices = [
+            (name, bins.index(probability if name == PREDICTION else record.get(name)))
+            for name, bins in self.bins
+            if rule is None or name != PREDICTION
+        ]
+        with self._lock:
+            counts = self._state["counts"]
+            for name, i in indices:
+                counts[name][i] += 1
+            self._state["events"] += 1
+            if rule is not None:
+                self._state["rule_decided"] += 1
+
+    def observe_frame(self, df, probabilities=None, scored=None):
+        """
+        Count a scored frame (e.g. a bulk upload) in one vectorized update;
+        ``scored`` marks the rows the model scored, as in ``observe``
+        """
+        snapshot = snapshot_from_frame(df, probabilities, spec=self.spec, scored=scored)
+        with self._lock:
+            self._state = merge_snapshots(self._state, snapshot)
+
+    def labels(self, name):
+        return next(bins.labels for feature, bins in self.bins if feature == name)
+
+    def snapshot(self):
+        with self._lock:
+            return {"events": self._state["events"], "rule_decided": self._state["rule_decided"],
+                    "counts": {name: list(counts) for name, counts in self._state["counts"].items()},
+                    "worker": self.worker_id, "started_at": self.started_at, "taken_at": self.clock()}
+
+    def report(self, reference, others=(), max_age=60.0):
+        """
+        Drift of this worker's traffic merged with ``others`` against
+        ``reference``, recomputed at most every ``max_age`` seconds
+        """
+        now = self.clock()
+        if self._report is None or now - self._report_at >= max_age:
+            self._report = drift_report(merge_snapshots(self.snapshot(), *others), reference, self.spec)
+            self._report_at = now
+        return self._report
+
+    def maybe_publish(self, location, interval=60.0):
+        """
+        Write this worker's snapshot to ``location`` (a directory or an
+        ``s3://`` prefix) at most every ``interval`` seconds
+        """
+        now = self.clock()
+        if self._published_at is not None and now - self._published_at < interval:
+            return False
+        from ml_pipeline.glue_jobs.historical_stats import write_stats
+
+        write_stats(self.snapshot(), f"{location.rstrip('/')}/{self.worker_id}.json")
+        self._published_at = now
+        return True
+
+
+def load_snapshots(location, exclude=None, s3_client=None):
+    """
+    Every snapshot published under ``location`` except worker ``exclude``
+    """
+    from ml_pipeline.glue_jobs.historical_stats import read_stats
+
+    if location.startswith("s3://"):
+        import boto3
+
+        s3_client = s3_client or boto3.client("s3")
+        bucket, prefix = location[len("s3://"):].split("/", 1)
+        paths = [
+            f"s3://{bucket}/{item['Key']}"
+            for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+            for item in page.get("Contents", []) if item["Key"].endswith(".json")
+        ]
+    else:
+        paths = sorted(glob.glob(os.path.join(location, "*.json")))
+    snapshots = [read_stats(path, s3_client) if path.startswith("s3://") else read_stats(path) for path in paths]
+    return [snapshot for snapshot in snapshots if snapshot.get("worker") != exclude]
+
+
+def _distribution(counts, epsilon):
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if not total:
+        return None
+    shares = counts / total
+    # Empty bins would make the log ratio infinite
+    shares = np.maximum(shares, epsilon)
+    return shares / shares.sum()
+
+
+def psi(expected, actual, epsilon=1e-4):
+    """
+    Population stability index between two binned distributions
+    """
+    p = _distribution(expected, epsilon)
+    q = _distribution(actual, epsilon)
+    if p is None or q is None:
+        return None
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks(expected, actual):
+    """
+    Largest gap between the two binned cumulative distributions
+    """
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if not expected.sum() or not actual.sum():
+        return None
+    return float(np.max(np.abs(np.cumsum(expected) / expected.sum() - np.cumsum(actual) / actual.sum())))
+
+
+def drift_report(current, reference, spec=DRIFT_SPEC, min_events=100, psi_warn=PSI_WARN, psi_alert=PSI_ALERT):
+    """
+    PSI and KS per feature with a status of ``ok``, ``warn``, ``alert`` or
+    ``insufficient data``
+    """
+    features = []
+    for feature in spec:
+        name = feature["name"]
+        if name not in current["counts"] or name not in reference["counts"]:
+            continue
+        actual = current["counts"][name]
+        expected = reference["counts"][name]
+        observed = sum(actual)
+        value = psi(expected, actual)
+        # KS compares ordered bins; the trailing missing bin is left out
+        ks_value = ks(expected[:-1], actual[:-1]) if feature["kind"] == "numeric" else None
+        if observed < min_events or value is None:
+            status = "insufficient data"
+        elif value >= psi_alert:
+            status = "alert"
+        elif value >= psi_warn:
+            status = "warn"
+        else:
+            status = "ok"
+        features.append({"feature": name, "psi": value, "ks": ks_value, "events": observed, "status": status})
+    return {"events": current["events"], "rule_decided": current.get("rule_decided", 0), "features": features}
+
+
+def build_reference(input_path, model_path=None, batch_size=262144, spec=DRIFT_SPEC, rules=None):
+    """
+    Training profile of a Parquet dataset, weighted by ``sample_weight``
+    when present, with the model's scores if a model is given
+
+    Given a ``RuleSet``, rows its rules decide count towards the features
+    and ``rule_decided`` but not the prediction histogram.
+    """
+    import pyarrow.dataset as ds
+
+    from ml_pipeline.glue_jobs.downsample import WEIGHT_COLUMN
+
+    model = None
+    if model_path:
+        from ml_pipeline.scoring.local_model import LocalModel
+        model = LocalModel.load(model_path)
+    dataset = ds.dataset(input_path, format="parquet", partitioning="hive")
+    snapshots = []
+    for batch in dataset.to_batches(batch_size=batch_size):
+        if not batch.num_rows:
+            continue
+        df = batch.to_pandas()
+        weights = df[WEIGHT_COLUMN].to_numpy() if WEIGHT_COLUMN in df.columns else None
+        probabilities = model.predict_proba(df) if model is not None else None
+        scored = rules.apply(df)[0] < 0 if rules is not None else None
+        snapshots.append(snapshot_from_frame(df, probabilities, weights, spec, scored))
+    reference = merge_snapshots(*snapshots) if snapshots else empty_snapshot(spec)
+    reference["built_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return reference
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the training profile for drift monitoring")
+    parser.add_argument("--input", default="data/train")
+    parser.add_argument("--model", help="local model artifact used to profile the score distribution")
+    parser.add_argument("--output", default="data/state/drift_reference.json")
+    parser.add_argument("--rules", help="rules JSON decided before the model (default: built-in rules)")
+    parser.add_argument("--no-rules", action="store_true", help="profile the model's score on every row")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from ml_pipeline.glue_jobs.historical_stats import write_stats
+    from ml_pipeline.scoring.rules import RuleSet
+
+    args = parse_args()
+    rules = None
+    if not args.no_rules:
+        rules = RuleSet.load(args.rules) if args.rules else RuleSet()
+    reference = build_reference(args.input, args.model, rules=rules)
+    write_stats(reference, args.output)
+    print(f"Profiled {reference['events']:,.0f} weighted rows into {args.output}")
@@ -0,0 +1,343 @@
+"""
+Lightweight tracing and timing instrumentation for the whole pipeline.
+
+Code marks the stages worth measuring with spans, counters and direct
+observations:
+
+    from ml_pipeline.monitoring import tracing
+
+    with tracing.span("etl.clean_data.velocity", rows=len(df)):
+        ...
+    tracing.count("etl.rows_out", len(df))
+
+Every finished span adds its duration to a fixed-bucket latency histogram
+per span name and, optionally, a record (name, parent, start, duration,
+attributes) to a bounded buffer. Spans nest through a context variable, so
+a span knows the span it was opened in, also across ``await``.
+
+Tracing is off unless ``FRAUD_TRACING`` is set (or ``enable()`` is
+called). A disabled ``span()`` returns a shared no-op context manager after
+one attribute check, so instrumented hot paths cost next to nothing. With
+``FRAUD_TRACE_FILE`` and/or ``FRAUD_TRACE_PROMETHEUS`` set, a process
+writes its spans and metrics as JSON lines and the Prometheus text
+exposition format when it exits:
+
+    FRAUD_TRACING=1 FRAUD_TRACE_FILE=trace.jsonl \\
+        python -m ml_pipeline.glue_jobs.local_etl --input data/raw --output data/processed
+"""
+import atexit
+import bisect
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+ENV_VAR = "FRAUD_TRACING"
+TRACE_FILE_VAR = "FRAUD_TRACE_FILE"
+PROMETHEUS_FILE_VAR = "FRAUD_TRACE_PROMETHEUS"
+FALSE_VALUES = ("", "0", "false", "no", "off")
+
+# Upper bounds of the latency buckets in seconds, 10 us to 5 min; the
+# last bucket is unbounded
+BUCKETS = tuple(scale * 10.0 ** exponent for exponent in range(-5, 3) for scale in (1, 2.5, 5)) + (300.0,)
+
+DEFAULT_MAX_SPANS = 10000
+
+_current = contextvars.ContextVar("fraudsage_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class _NoopSpan:
+    """
+    Returned by ``span()`` while tracing is disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    One timed stage; use as a context manager
+    """
+    __slots__ = ("tracer", "name", "attributes", "span_id", "parent_id", "trace_id",
+                 "start_time", "_started", "_token")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start_time = time.time()
+        self._token = _current.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self._started
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._finish(self, seconds)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class LatencyHistogram:
+    """
+    Counts of durations per ``BUCKETS`` bucket, plus their sum and maximum
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        Duration at quantile ``q``, interpolated inside its bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+                return low + (high - low) * max(rank - seen, 0) / count
+            seen += count
+        return self.max
+
+
+class Tracer:
+    """
+    Span, counter and latency histogram registry with JSON lines and
+    Prometheus exporters
+    """
+
+    def __init__(self, enabled=False, max_spans=DEFAULT_MAX_SPANS):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.spans = deque(maxlen=max_spans)
+        self.max_spans = max_spans
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        """
+        Context manager timing the stage ``name``
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def traced(self, name):
+        """
+        Decorator running every call of a function in a span
+        """
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, name, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """
+        Record a duration measured elsewhere under ``name``
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histogram(name).add(seconds)
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    def _finish(self, span, seconds):
+        record = None
+        if self.max_spans:
+            # Attributes go first, so one named like a field cannot overwrite it
+            record = {
+                **span.attributes,
+                "type": "span", "name": span.name, "span_id": span.span_id, "parent_id": span.parent_id,
+                "trace_id": span.trace_id, "start": span.start_time, "duration_ms": seconds * 1000.0,
+                "thread": threading.current_thread().name,
+            }
+        with self._lock:
+            self._histogram(span.name).add(seconds)
+            if record is not None:
+                self.spans.append(record)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.spans.clear()
+            self.started_at = time.time()
+
+    def summary(self):
+        """
+        Count, total and mean/p50/p95/p99/max latency (ms) per span name,
+        slowest total first
+        """
+        with self._lock:
+            histograms = list(self.histograms.items())
+        rows = [
+            {
+                "stage": name, "count": h.count, "total_s": h.sum,
+                "mean_ms": 1000.0 * h.sum / h.count if h.count else 0.0,
+                "p50_ms": 1000.0 * h.quantile(0.5), "p95_ms": 1000.0 * h.quantile(0.95),
+                "p99_ms": 1000.0 * h.quantile(0.99), "max_ms": 1000.0 * h.max,
+            }
+            for name, h in histograms
+        ]
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def write_jsonl(self, path):
+        """
+        Append the buffered spans, then one metrics record, as JSON lines
+
+        Written spans leave the buffer, so repeated exports do not repeat
+        them.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            self.spans.clear()
+            counters = dict(self.counters)
+        metrics = {"type": "metrics", "time": time.time(), "pid": os.getpid(),
+                   "stages": self.summary(), "counters": counters}
+        with open(path, "a") as f:
+            for record in spans + [metrics]:
+                f.write(json.dumps(record, default=str) + "\n")
+        return len(spans)
+
+    def prometheus_text(self, prefix="fraudsage"):
+        """
+        Histograms and counters in the Prometheus text exposition format
+        """
+        with self._lock:
+            histograms = [(name, list(h.counts), h.count, h.sum) for name, h in self.histograms.items()]
+            counters = sorted(self.counters.items())
+        lines = [f"# HELP {prefix}_stage_seconds Duration of instrumented pipeline stages",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for name, counts, total, seconds in sorted(histograms):
+            label = f'stage="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{prefix}_stage_seconds_sum{{{label}}} {seconds:.9g}")
+            lines.append(f"{prefix}_stage_seconds_count{{{label}}} {total}")
+        for name, value in counters:
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="fraudsage"):
+        """
+        Atomically replace ``path`` with the current metrics, as the node
+        exporter's textfile collector expects
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    """
+    Sample value without the precision loss of ``:g`` on large counters
+    """
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+TRACER = Tracer(enabled=os.environ.get(ENV_VAR, "").lower() not in FALSE_VALUES)
+
+span = TRACER.span
+traced = TRACER.traced
+count = TRACER.count
+observe = TRACER.observe
+
+
+def enable(enabled=True):
+    TRACER.enabled = enabled
+
+
+def is_enabled():
+    return TRACER.enabled
+
+
+def _export_at_exit():
+    if not TRACER.enabled:
+        return
+    if os.environ.get(TRACE_FILE_VAR):
+        TRACER.write_jsonl(os.environ[TRACE_FILE_VAR])
+    if os.environ.get(PROMETHEUS_FILE_VAR):
+        TRACER.write_prometheus(os.environ[PROMETHEUS_FILE_VAR])
+
+
+if os.environ.get(TRACE_FILE_VAR) or os.environ.get(PROMETHEUS_FILE_VAR):
+    atexit.register(_export_at_exit)
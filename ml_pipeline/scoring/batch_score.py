@@ -0,0 +1,385 @@
+"""
+Batch scoring of ETL output against the fraud endpoint.
+
+Streams CSV or Parquet input in record batches, packs rows into multi-record
+``application/jsonlines`` or ``text/csv`` requests, keeps at most
+``max_in_flight`` requests outstanding on a thread pool, retries throttling
+and server errors with jittered exponential backoff, and streams the
+predictions back out in input order. Reading pauses whenever the in-flight
+window is full, so memory stays bounded by that window.
+
+    python -m ml_pipeline.scoring.batch_score --input data/processed --output scores.parquet
+    python -m ml_pipeline.scoring.batch_score --input data/processed --output scores.parquet \\
+        --local-model models/local_model.json
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from ml_pipeline.features.profiles import PROFILE_FEATURES
+from ml_pipeline.features.transaction_features import FEATURE_NAMES
+from ml_pipeline.features.velocity import VELOCITY_FEATURES
+from ml_pipeline.glue_jobs.local_etl import RAW_COLUMN_TYPES, clean_data
+from ml_pipeline.monitoring import tracing
+from ml_pipeline.scoring.endpoint_client import create_runtime
+from ml_pipeline.scoring.rules import RuleSet
+
+# Fields sent to the endpoint; also the column order of text/csv payloads.
+# Profile-enriched rows append the PROFILE_FEATURES, see payload_columns
+PAYLOAD_COLUMNS = [
+    "amount", "merchant_category", "transaction_type", "device_type",
+    "merchant_country", "timestamp", *FEATURE_NAMES, *VELOCITY_FEATURES
+]
+
+CONTENT_TYPES = {
+    "jsonlines": "application/jsonlines",
+    "csv": "text/csv",
+}
+
+# HTTP statuses worth retrying; other 4xx errors are the caller's fault
+RETRYABLE_STATUS = {408, 424, 429, 500, 502, 503, 504}
+# Connection failures and timeouts (connect, read, closed connection)
+RETRYABLE_ERRORS = (ConnectionError, HTTPClientError)
+
+
+def iter_input_batches(input_path, batch_size=50000):
+    """
+    Stream a CSV/Parquet file or directory as pandas DataFrames
+    """
+    if str(input_path).endswith(".csv"):
+        file_format = ds.CsvFileFormat(parse_options=pv.ParseOptions(newlines_in_values=True))
+    else:
+        file_format = "parquet"
+    dataset = ds.dataset(input_path, format=file_format, partitioning="hive")
+    for batch in dataset.to_batches(batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+@tracing.traced("io.read_upload")
+def read_uploaded_file(data, filename):
+    """
+    Parse the bytes of an uploaded CSV or Parquet file into a DataFrame
+    """
+    if filename.lower().endswith(".parquet"):
+        return pq.read_table(io.BytesIO(data)).to_pandas()
+    table = pv.read_csv(
+        io.BytesIO(data),
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(column_types=RAW_COLUMN_TYPES, strings_can_be_null=True)
+    )
+    return table.to_pandas()
+
+
+@tracing.traced("score.prepare")
+def prepare_transactions(df, profiles=None):
+    """
+    Derive the model features for a frame of raw transactions with the
+    vectorized ETL transform, enriched from ``profiles`` when given
+
+    Rows without a ``transaction_id`` are numbered so they are not collapsed
+    by deduplication.
+    """
+    if "transaction_id" not in df.columns:
+        df = df.assign(transaction_id=[f"ROW{i:09d}" for i in range(len(df))])
+    return clean_data(df, profiles=profiles)
+
+
+def payload_columns(profiles=False):
+    """
+    ``PAYLOAD_COLUMNS``, followed by the ``PROFILE_FEATURES`` when the rows
+    are enriched from profiles
+    """
+    return PAYLOAD_COLUMNS + PROFILE_FEATURES if profiles else list(PAYLOAD_COLUMNS)
+
+
+@tracing.traced("score.encode_payload")
+def encode_payload(df, payload_format):
+    """
+    Serialize rows into one multi-record request body
+
+    Profile features are sent only by rows that carry them, so text/csv
+    payloads of unenriched rows have no profile columns.
+    """
+    payload = payload_columns(profiles=PROFILE_FEATURES[0] in df.columns)
+    columns = [column for column in payload if column in df.columns]
+    df = df[columns].copy()
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.strftime("%Y-%m-%dT%H:%M:%S")
+    if payload_format == "jsonlines":
+        return df.to_json(orient="records", lines=True).encode()
+    if payload_format == "csv":
+        df = df.reindex(columns=payload)
+        return df.to_csv(header=False, index=False).encode()
+    raise ValueError(f"Unsupported payload format: {payload_format}")
+
+
+@tracing.traced("score.decode_predictions")
+def decode_predictions(body, payload_format):
+    """
+    Parse a multi-record response into an array of probabilities
+    """
+    lines = [line for line in body.decode().splitlines() if line.strip()]
+    if payload_format == "jsonlines":
+        return np.array([json.loads(line)["predicted_probability"] for line in lines], dtype="float64")
+    # CSV responses may be "label,probability"; the probability comes last
+    return np.array([float(line.rsplit(",", 1)[-1]) for line in lines], dtype="float64")
+
+
+def _status_code(error):
+    return getattr(error, "response", {}).get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+
+def is_retryable(error):
+    """
+    Whether an ``invoke_endpoint`` failure is transient: a connection error
+    or timeout, or an error response with a retryable HTTP status
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, ClientError) and _status_code(error) in RETRYABLE_STATUS
+
+
+def invoke_with_retry(runtime, endpoint_name, content_type, body, max_attempts=5,
+                      base_delay=0.1, max_delay=10.0, on_retry=None):
+    """
+    Call ``invoke_endpoint`` with full-jitter exponential backoff
+
+    Only errors ``is_retryable`` accepts are retried; ``on_retry`` is
+    called with the exception before each retry.
+    """
+    for attempt in range(max_attempts):
+        try:
+            with tracing.span("score.invoke_endpoint", attempt=attempt):
+                response = runtime.invoke_endpoint(
+                    EndpointName=endpoint_name, ContentType=content_type, Accept=content_type, Body=body)
+                return response["Body"].read()
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_attempts - 1:
+                raise
+            tracing.count("score.retries")
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+class PredictionWriter:
+    """
+    Stream prediction batches to a Parquet or CSV file
+
+    Small per-request frames are buffered up to ``row_group_size`` rows so
+    the Parquet output gets reasonably sized row groups.
+    """
+
+    def __init__(self, output_path, row_group_size=65536):
+        self.output_path = output_path
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def write(self, df):
+        self.buffer.append(df)
+        self.buffered_rows += len(df)
+        if self.buffered_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        table = pa.Table.from_pandas(pd.concat(self.buffer, ignore_index=True), preserve_index=False)
+        self.buffer = []
+        self.buffered_rows = 0
+        if self.writer is None:
+            if self.output_path.endswith(".csv"):
+                self.writer = pv.CSVWriter(self.output_path, table.schema)
+            else:
+                self.writer = pq.ParquetWriter(self.output_path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def score_batches(runtime, batches, endpoint_name="fraud-detection-endpoint", payload_format="jsonlines",
+                  records_per_request=500, max_in_flight=8, passthrough_columns=("transaction_id", "is_fraud"),
+                  max_attempts=5, stats=None, rules=None):
+    """
+    Score an iterable of DataFrames and yield one frame of
+    ``passthrough_columns`` plus ``predicted_probability`` per request, in
+    input order
+
+    At most ``max_in_flight`` requests are outstanding; the input is only
+    pulled further once the oldest request has been consumed. With a
+    ``RuleSet``, rows a rule decides are not sent and get the rule's score
+    and name (``rule`` column).
+    """
+    content_type = CONTENT_TYPES[payload_format]
+    stats = stats if stats is not None else {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("requests", 0)
+    stats.setdefault("retries", 0)
+    stats.setdefault("rule_decided", 0)
+    in_flight = deque()
+    retry_lock = threading.Lock()
+
+    def count_retry(error):
+        with retry_lock:
+            stats["retries"] += 1
+
+    def submit(executor, chunk):
+        keep = [column for column in passthrough_columns if column in chunk.columns]
+        passthrough = chunk[keep].reset_index(drop=True)
+        probabilities = None
+        if rules is not None:
+            decided, probabilities = rules.apply(chunk)
+            passthrough["rule"] = pd.Series(rules.rule_names(decided), dtype="str")
+            stats["rule_decided"] += int((decided >= 0).sum())
+            chunk = chunk[decided < 0]
+        future = None
+        if len(chunk):
+            body = encode_payload(chunk, payload_format)
+            future = executor.submit(
+                invoke_with_retry, runtime, endpoint_name, content_type, body,
+                max_attempts=max_attempts, on_retry=count_retry)
+            stats["requests"] += 1
+        in_flight.append((future, passthrough, probabilities))
+
+    def collect_oldest():
+        future, passthrough, probabilities = in_flight.popleft()
+        if future is not None:
+            predicted = decode_predictions(future.result(), payload_format)
+            if probabilities is None:
+                probabilities = predicted
+                expected = len(passthrough)
+            else:
+                expected = int(np.isnan(probabilities).sum())
+            if len(predicted) != expected:
+                raise ValueError(f"Endpoint returned {len(predicted)} predictions for {expected} records")
+            if probabilities is not predicted:
+                probabilities[np.isnan(probabilities)] = predicted
+        passthrough["predicted_probability"] = probabilities
+        stats["rows"] += len(passthrough)
+        return passthrough
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        try:
+            for batch in batches:
+                for start in range(0, len(batch), records_per_request):
+                    # Backpressure: wait for the oldest request before sending more
+                    while len(in_flight) >= max_in_flight:
+                        yield collect_oldest()
+                    submit(executor, batch.iloc[start:start + records_per_request])
+            while in_flight:
+                yield collect_oldest()
+        finally:
+            for future, _, _ in in_flight:
+                if future is not None:
+                    future.cancel()
+
+
+def score_file(runtime, input_path, output_path, endpoint_name="fraud-detection-endpoint",
+               payload_format="jsonlines", records_per_request=500, max_in_flight=8,
+               read_batch_size=50000, passthrough_columns=("transaction_id", "is_fraud", "amount"),
+               max_attempts=5, rules=None):
+    """
+    Score every row of ``input_path`` and write ``predicted_probability``
+    (plus ``passthrough_columns``) to ``output_path`` in input order
+    """
+    stats = {}
+    writer = PredictionWriter(output_path)
+    started = time.perf_counter()
+    try:
+        for scored in score_batches(
+                runtime, iter_input_batches(input_path, read_batch_size), endpoint_name, payload_format,
+                records_per_request, max_in_flight, passthrough_columns, max_attempts, stats, rules):
+            writer.write(scored)
+    finally:
+        writer.close()
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def score_frame(runtime, df, endpoint_name="fraud-detection-endpoint", payload_format="jsonlines",
+                records_per_request=500, max_in_flight=8, max_attempts=5, on_progress=None, rules=None,
+                return_rules=False):
+    """
+    Fraud probabilities for every row of an in-memory DataFrame
+
+    ``on_progress`` is called with (rows scored, total rows) after every
+    request completes. With ``return_rules`` the deciding rule of every row
+    (None where the model scored it) is returned as well.
+    """
+    probabilities = np.empty(len(df), dtype="float64")
+    rule_names = np.full(len(df), None, dtype=object)
+    done = 0
+    for scored in score_batches(
+            runtime, [df], endpoint_name, payload_format, records_per_request,
+            max_in_flight, passthrough_columns=(), max_attempts=max_attempts, rules=rules):
+        probabilities[done:done + len(scored)] = scored["predicted_probability"].to_numpy()
+        if "rule" in scored.columns:
+            rule_names[done:done + len(scored)] = scored["rule"].to_numpy(dtype=object, na_value=None)
+        done += len(scored)
+        if on_progress is not None:
+            on_progress(done, len(df))
+    return (probabilities, rule_names) if return_rules else probabilities
+
+
+def make_runtime(local_model=None, max_pool_connections=8):
+    """
+    Build the scoring runtime: a local stand-in or a pooled boto3 client
+    """
+    if local_model:
+        from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+        model = LocalModel.load(local_model)
+        return LocalEndpoint(model, csv_columns=payload_columns(model.encoder.uses_profiles))
+    # Retries are handled per request by invoke_with_retry
+    return create_runtime(max_pool_connections, max_attempts=1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file against the fraud endpoint")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True, help="output .parquet or .csv file")
+    parser.add_argument("--endpoint-name", default="fraud-detection-endpoint")
+    parser.add_argument("--format", choices=sorted(CONTENT_TYPES), default="jsonlines")
+    parser.add_argument("--records-per-request", type=int, default=500)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--local-model", help="score with a local model artifact instead of the endpoint")
+    parser.add_argument("--rules", help="rules JSON decided before the model (default: built-in rules)")
+    parser.add_argument("--no-rules", action="store_true", help="send every row to the model")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    runtime = make_runtime(args.local_model, max_pool_connections=args.max_in_flight)
+    rules = None
+    if not args.no_rules:
+        rules = RuleSet.load(args.rules) if args.rules else RuleSet()
+    stats = score_file(
+        runtime, args.input, args.output, endpoint_name=args.endpoint_name,
+        payload_format=args.format, records_per_request=args.records_per_request,
+        max_in_flight=args.max_in_flight, max_attempts=args.max_attempts, rules=rules
+    )
+    print(f"Scored {stats['rows']:,} rows in {stats['requests']:,} requests "
+          f"({stats['retries']} retries, {stats['rule_decided']:,} decided by rules) "
+          f"at {stats['rows_per_second']:,.0f} rows/s")
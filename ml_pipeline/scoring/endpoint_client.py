@@ -0,0 +1,253 @@
+"""
+Shared client for real-time fraud scoring.
+
+``ScoringClient`` wraps a ``sagemaker-runtime`` client (or any object with
+the same ``invoke_endpoint`` call, such as ``LocalEndpoint``) and adds:
+
+* a connection pool sized for concurrent callers, with bounded timeouts
+* ``predict`` / ``predict_many`` plus an asyncio ``apredict``
+* per-call latency timing, and ``tracing`` spans for serialization, the
+  endpoint call and deserialization
+* an LRU + TTL cache of predictions keyed by a canonical hash of the
+  feature vector, so re-rendered dashboards and retried requests do not
+  score the same transaction twice; concurrent identical requests share
+  one endpoint call
+* an optional ``RuleSet`` checked first: transactions a rule allows, denies
+  or scores are answered without calling the endpoint
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ml_pipeline.features.transaction_features import TIME_FEATURES
+from ml_pipeline.monitoring import tracing
+
+DEFAULT_ENDPOINT_NAME = "fraud-detection-endpoint"
+
+# Identifiers do not reach the model, so they are left out of the cache key
+CACHE_KEY_IGNORED_FIELDS = ("transaction_id", "card_number", "card_hash")
+
+
+def create_runtime(max_pool_connections=10, connect_timeout=2, read_timeout=10, max_attempts=3,
+                   endpoint_url=None):
+    """
+    Build a ``sagemaker-runtime`` client with a pool sized for concurrent
+    callers and bounded timeouts
+
+    ``max_attempts`` counts the first call, so ``max_attempts=1`` disables
+    botocore retries for callers that retry themselves. ``endpoint_url``
+    points the client at another host, such as the local stand-in in
+    ``stand_in_endpoint``.
+    """
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client("sagemaker-runtime", endpoint_url=endpoint_url, config=Config(
+        max_pool_connections=max_pool_connections,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={"total_max_attempts": max_attempts, "mode": "standard"},
+    ))
+
+
+def feature_key(record, ignored_fields=CACHE_KEY_IGNORED_FIELDS):
+    """
+    Canonical hash of a feature vector: independent of key order and of
+    int/float spelling of the same number
+
+    The raw timestamp is left out only when every time feature derived
+    from it is in the record; otherwise the model may still see it.
+    """
+    skip_timestamp = all(name in record for name in TIME_FEATURES)
+    canonical = {}
+    for name, value in record.items():
+        if name in ignored_fields or (skip_timestamp and name == "timestamp"):
+            continue
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and float(value).is_integer():
+            value = float(value)
+        canonical[name] = value
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ``ttl`` seconds
+
+    At most ``max_entries`` predictions are kept; the least recently used
+    one is evicted first.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self.entries[key] = (value, self.clock() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+class ScoringClient:
+    """
+    Cached, pooled and timed access to the fraud endpoint
+
+    Create one per process and share it; it is safe to call from several
+    threads and from asyncio code. ``coalesce=False`` sends every request
+    to the endpoint even while an identical one is in flight, as load tests
+    need.
+    """
+
+    def __init__(self, runtime=None, endpoint_name=DEFAULT_ENDPOINT_NAME, cache_size=10000,
+                 cache_ttl=300.0, max_pool_connections=10, latency_window=1000, clock=time.monotonic,
+                 rules=None, coalesce=True):
+        self.runtime = runtime if runtime is not None else create_runtime(max_pool_connections)
+        self.endpoint_name = endpoint_name
+        self.rules = rules
+        self.coalesce = coalesce
+        self.cache = PredictionCache(cache_size, cache_ttl, clock)
+        self.latencies = deque(maxlen=latency_window)
+        self.calls = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_pool_connections)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _invoke(self, body):
+        started = time.perf_counter()
+        with tracing.span("score.invoke"):
+            response = self.runtime.invoke_endpoint(
+                EndpointName=self.endpoint_name,
+                ContentType="application/json",
+                Accept="application/json",
+                Body=body
+            )
+            payload = response["Body"].read()
+        with tracing.span("score.deserialize"):
+            result = json.loads(payload.decode())
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(elapsed)
+        return result
+
+    def _score(self, key, record):
+        try:
+            with tracing.span("score.serialize"):
+                body = json.dumps(record, default=str)
+            probability = float(self._invoke(body)["predicted_probability"])
+            self.cache.put(key, probability)
+            return probability
+        finally:
+            if self.coalesce:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+    def _submit(self, record):
+        """
+        Return a rule-decided or cached probability or a future for it,
+        joining an identical request that is already in flight, and the
+        name of the deciding rule
+        """
+        if self.rules is not None:
+            decision = self.rules.match(record)
+            if decision is not None:
+                return decision[1], None, decision[0]
+        key = feature_key(record)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, None, None
+        if not self.coalesce:
+            return None, self._executor.submit(self._score, key, record), None
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._executor.submit(self._score, key, record)
+                self._in_flight[key] = future
+        return None, future, None
+
+    def predict(self, record):
+        """
+        Fraud probability for one transaction
+        """
+        return self.decide(record)[0]
+
+    def decide(self, record):
+        """
+        Fraud probability for one transaction and the rule that decided it
+        (None when the model scored it)
+        """
+        cached, future, rule = self._submit(record)
+        return (cached if future is None else future.result()), rule
+
+    async def apredict(self, record):
+        """
+        Fraud probability for one transaction, awaitable without blocking
+        the event loop
+        """
+        cached, future, _ = self._submit(record)
+        return cached if future is None else await asyncio.wrap_future(future)
+
+    def predict_many(self, records):
+        """
+        Fraud probabilities for a list of transactions; uncached ones are
+        scored concurrently over the connection pool
+        """
+        submitted = [self._submit(record) for record in records]
+        return [cached if future is None else future.result() for cached, future, _ in submitted]
+
+    def latency_summary(self):
+        """
+        Count, p50, p95 and max of recent endpoint call latencies in ms
+        """
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000.0
+        summary = {"calls": self.calls, "cache_hits": self.cache.hits, "cache_misses": self.cache.misses}
+        if self.rules is not None:
+            summary["rule_decided"] = self.rules.stats()["decided"]
+        if len(latencies):
+            summary.update({
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "max_ms": float(latencies.max()),
+            })
+        return summary
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,309 @@
+"""
+Model evaluation and cost-based threshold selection.
+
+Every threshold metric is a cumulative sum over the scores in descending
+order, so one sort yields the whole ROC and PR curves, the confusion matrix
+at every distinct threshold, precision@k and the expected cost of every
+threshold. A transaction is flagged when its score is at least the
+threshold.
+
+Files larger than memory are streamed into a ``ScoreHistogram``: weighted
+counts per fine score bin (1e-5 wide by default), which are already in
+order, so the same metrics follow without a sort and agree with the exact
+ones up to the bin width. Histograms of separate chunks or workers merge by
+adding counts.
+
+The cost of a threshold is a review cost for every flagged transaction, an
+optional friction cost for every flagged legitimate one and the chargeback
+loss (a fee plus the amount, when known) of every missed fraud. The
+threshold with the lowest expected cost is published for the scoring path:
+
+    python -m ml_pipeline.scoring.evaluation --input scores.parquet --output models/threshold.json
+    python -m ml_pipeline.scoring.evaluation --input data/raw/test_data.csv \\
+        --local-model models/local_model.json --output models/threshold.json
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ml_pipeline.glue_jobs.historical_stats import read_stats, write_stats
+
+# np.trapezoid replaced np.trapz in NumPy 2.0; requirements allow 1.x
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+SCORE_COLUMN = "predicted_probability"
+LABEL_COLUMN = "is_fraud"
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_REVIEW_COST = 5.0
+DEFAULT_CHARGEBACK_FEE = 25.0
+
+
+def chargeback_losses(labels, amounts=None, chargeback_fee=DEFAULT_CHARGEBACK_FEE):
+    """
+    Loss of missing each transaction: the fee plus the amount for fraud,
+    nothing for legitimate ones
+    """
+    labels = np.asarray(labels)
+    losses = np.full(len(labels), float(chargeback_fee))
+    if amounts is not None:
+        losses += np.nan_to_num(np.asarray(amounts, dtype=np.float64))
+    return np.where(labels == 1, losses, 0.0)
+
+
+class Evaluation:
+    """
+    Cumulative counts at every threshold, highest threshold first
+
+    The first point flags nothing (threshold infinity); ``tp``, ``fp`` and
+    ``caught_loss`` are the weighted positives, negatives and chargeback
+    losses with a score at or above each threshold.
+    """
+
+    def __init__(self, thresholds, tp, fp, caught_loss):
+        self.thresholds = np.concatenate([[np.inf], thresholds])
+        self.tp = np.concatenate([[0.0], tp])
+        self.fp = np.concatenate([[0.0], fp])
+        self.caught_loss = np.concatenate([[0.0], caught_loss])
+        self.positives = float(self.tp[-1])
+        self.negatives = float(self.fp[-1])
+        self.total_loss = float(self.caught_loss[-1])
+
+    @classmethod
+    def from_ordered(cls, thresholds, positives, negatives, losses):
+        """
+        From per-threshold totals already in descending threshold order
+        """
+        return cls(np.asarray(thresholds, dtype=np.float64), np.cumsum(positives),
+                   np.cumsum(negatives), np.cumsum(losses))
+
+    @property
+    def fn(self):
+        return self.positives - self.tp
+
+    @property
+    def tn(self):
+        return self.negatives - self.fp
+
+    @property
+    def tpr(self):
+        return self.tp / self.positives if self.positives else np.zeros_like(self.tp)
+
+    @property
+    def fpr(self):
+        return self.fp / self.negatives if self.negatives else np.zeros_like(self.fp)
+
+    @property
+    def precision(self):
+        flagged = self.tp + self.fp
+        # Flagging nothing makes no mistakes
+        return np.divide(self.tp, flagged, out=np.ones_like(self.tp), where=flagged > 0)
+
+    @property
+    def recall(self):
+        return self.tpr
+
+    def roc_auc(self):
+        return float(_trapezoid(self.tpr, self.fpr))
+
+    def average_precision(self):
+        return float(np.sum(np.diff(self.recall) * self.precision[1:]))
+
+    def precision_at_k(self, k):
+        """
+        Precision of the ``k`` highest scores; ties at the cut count in
+        proportion (weights count as rows)
+        """
+        flagged = self.tp + self.fp
+        return float(np.interp(k, flagged, self.tp) / k) if k else 1.0
+
+    def expected_cost(self, review_cost=DEFAULT_REVIEW_COST, false_positive_cost=0.0):
+        """
+        Expected cost of every threshold
+        """
+        return (review_cost * (self.tp + self.fp) + false_positive_cost * self.fp
+                + (self.total_loss - self.caught_loss))
+
+    def _index(self, threshold):
+        # Last point whose threshold is still >= ``threshold``
+        return max(int(np.searchsorted(-self.thresholds, -threshold, side="right")) - 1, 0)
+
+    def confusion(self, threshold):
+        """
+        Confusion matrix when flagging scores >= ``threshold``
+        """
+        i = self._index(threshold)
+        return {"tp": float(self.tp[i]), "fp": float(self.fp[i]),
+                "fn": float(self.fn[i]), "tn": float(self.tn[i])}
+
+    def best_threshold(self, review_cost=DEFAULT_REVIEW_COST, false_positive_cost=0.0):
+        """
+        The expected-cost-minimizing threshold and its metrics
+        """
+        cost = self.expected_cost(review_cost, false_positive_cost)
+        i = int(np.argmin(cost))
+        # Flagging nothing is published as a threshold no score reaches
+        threshold = float(self.thresholds[i]) if i else float(np.nextafter(1.0, 2.0))
+        flagged = self.tp[i] + self.fp[i]
+        return {
+            "threshold": threshold,
+            "expected_cost": float(cost[i]),
+            "cost_at_default": float(cost[self._index(DEFAULT_THRESHOLD)]),
+            "cost_flag_nothing": float(cost[0]),
+            "precision": float(self.precision[i]),
+            "recall": float(self.recall[i]),
+            "flag_rate": float(flagged / (self.positives + self.negatives)) if flagged else 0.0,
+            **self.confusion(threshold),
+        }
+
+    def summary(self, ks=(100, 1000)):
+        return {
+            "positives": self.positives,
+            "negatives": self.negatives,
+            "roc_auc": self.roc_auc(),
+            "average_precision": self.average_precision(),
+            **{f"precision_at_{k}": self.precision_at_k(k) for k in ks},
+        }
+
+
+def evaluate(labels, scores, weights=None, losses=None):
+    """
+    Exact evaluation of in-memory scores with a single sort
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels) == 1
+    weights = np.ones(len(scores)) if weights is None else np.asarray(weights, dtype=np.float64)
+    losses = np.zeros(len(scores)) if losses is None else np.asarray(losses, dtype=np.float64)
+    order = np.argsort(scores, kind="stable")[::-1]
+    scores, labels, weights, losses = scores[order], labels[order], weights[order], losses[order]
+    # One point per distinct score: the last row of each run of ties
+    last = np.flatnonzero(np.append(scores[1:] != scores[:-1], True))
+    tp = np.cumsum(np.where(labels, weights, 0.0))[last]
+    fp = np.cumsum(np.where(labels, 0.0, weights))[last]
+    caught = np.cumsum(losses * weights)[last]
+    return Evaluation(scores[last], tp, fp, caught)
+
+
+class ScoreHistogram:
+    """
+    Streaming, mergeable score histogram over ``bins`` equal bins of [0, 1]
+    """
+
+    def __init__(self, bins=100000):
+        self.bins = bins
+        self.positives = np.zeros(bins)
+        self.negatives = np.zeros(bins)
+        self.losses = np.zeros(bins)
+
+    def add(self, labels, scores, weights=None, losses=None):
+        scores = np.asarray(scores, dtype=np.float64)
+        index = np.clip((scores * self.bins).astype(np.intp), 0, self.bins - 1)
+        weights = np.ones(len(scores)) if weights is None else np.asarray(weights, dtype=np.float64)
+        positive = np.asarray(labels) == 1
+        self.positives += np.bincount(index, weights=np.where(positive, weights, 0.0), minlength=self.bins)
+        self.negatives += np.bincount(index, weights=np.where(positive, 0.0, weights), minlength=self.bins)
+        if losses is not None:
+            self.losses += np.bincount(index, weights=np.asarray(losses) * weights, minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        self.positives += other.positives
+        self.negatives += other.negatives
+        self.losses += other.losses
+        return self
+
+    def evaluation(self):
+        """
+        Metrics with the bin lower edges as thresholds
+        """
+        occupied = np.flatnonzero(self.positives + self.negatives)[::-1]
+        return Evaluation.from_ordered(occupied / self.bins, self.positives[occupied],
+                                       self.negatives[occupied], self.losses[occupied])
+
+
+def evaluate_file(input_path, local_model=None, bins=100000, chargeback_fee=DEFAULT_CHARGEBACK_FEE,
+                  batch_size=262144):
+    """
+    Stream a labelled CSV/Parquet file or directory into a score histogram
+
+    Without ``local_model`` the input must hold ``predicted_probability``
+    (e.g. the output of ``batch_score``); with it, raw transactions are
+    featurized and scored on the way. Rows decided by a business rule
+    (``rule`` set) are left out, as their scores are not the model's.
+    Amounts, when present, add to the chargeback loss of missed fraud.
+    Sample weights, when present, are used.
+    """
+    from ml_pipeline.scoring.batch_score import iter_input_batches, prepare_transactions
+
+    model = None
+    if local_model:
+        from ml_pipeline.scoring.local_model import LocalModel
+        model = LocalModel.load(local_model)
+    histogram = ScoreHistogram(bins)
+    for batch in iter_input_batches(input_path, batch_size):
+        if model is not None:
+            batch = prepare_transactions(batch)
+            scores = model.predict_proba(batch)
+        else:
+            if "rule" in batch.columns:
+                batch = batch[batch["rule"].isna()]
+            scores = batch[SCORE_COLUMN].to_numpy()
+        labels = batch[LABEL_COLUMN].to_numpy()
+        amounts = batch["amount"].to_numpy() if "amount" in batch.columns else None
+        weights = batch["sample_weight"].to_numpy() if "sample_weight" in batch.columns else None
+        histogram.add(labels, scores, weights, chargeback_losses(labels, amounts, chargeback_fee))
+    return histogram
+
+
+def publish_threshold(decision, path, summary=None, costs=None, s3_client=None):
+    """
+    Write the chosen threshold where the scoring path reads it
+    """
+    body = {
+        **decision,
+        "costs": costs or {},
+        "metrics": summary or {},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    write_stats(body, path, s3_client)
+    return body
+
+
+def load_threshold(path, default=DEFAULT_THRESHOLD, s3_client=None):
+    """
+    Published decision threshold, or ``default`` when none is available
+    """
+    try:
+        return float(read_stats(path, s3_client)["threshold"])
+    except Exception:
+        return default
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate scores and choose the cost-minimizing threshold")
+    parser.add_argument("--input", required=True, help="scored or raw labelled CSV/Parquet")
+    parser.add_argument("--local-model", help="score raw transactions with a local model artifact")
+    parser.add_argument("--output", default="models/threshold.json", help="published threshold (local or s3://)")
+    parser.add_argument("--review-cost", type=float, default=DEFAULT_REVIEW_COST,
+                        help="cost of reviewing one flagged transaction")
+    parser.add_argument("--false-positive-cost", type=float, default=0.0,
+                        help="extra cost of flagging a legitimate transaction")
+    parser.add_argument("--chargeback-fee", type=float, default=DEFAULT_CHARGEBACK_FEE,
+                        help="fee per missed fraud, on top of its amount")
+    parser.add_argument("--bins", type=int, default=100000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = evaluate_file(args.input, args.local_model, args.bins, args.chargeback_fee).evaluation()
+    decision = result.best_threshold(args.review_cost, args.false_positive_cost)
+    costs = {"review_cost": args.review_cost, "false_positive_cost": args.false_positive_cost,
+             "chargeback_fee": args.chargeback_fee}
+    summary = result.summary()
+    publish_threshold(decision, args.output, summary, costs)
+    print(f"ROC AUC {summary['roc_auc']:.4f}, average precision {summary['average_precision']:.4f}")
+    print(f"Threshold {decision['threshold']:.5f}: expected cost {decision['expected_cost']:,.2f} "
+          f"vs {decision['cost_at_default']:,.2f} at {DEFAULT_THRESHOLD} "
+          f"(precision {decision['precision']:.2%}, recall {decision['recall']:.2%})")
@@ -0,0 +1,338 @@
+"""
+In-process scoring engine.
+
+``LocalModel`` is a logistic regression over the ETL feature set, trained
+with NumPy on processed (or freshly generated) transactions and exported as
+a small JSON artifact. It scores a whole DataFrame, Arrow table, list of
+records or pre-encoded matrix in one vectorized call.
+
+``LocalEndpoint`` wraps a model behind the same ``invoke_endpoint`` call as
+the ``sagemaker-runtime`` client, so the frontend, tests and batch jobs can
+swap it in for the real endpoint to run and benchmark offline:
+
+    python -m ml_pipeline.scoring.local_model --train data/raw/train_data.csv --output models/local_model.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.features.profiles import PROFILE_FEATURES
+from ml_pipeline.features.transaction_features import FEATURE_NAMES, add_features_pandas, transaction_features
+from ml_pipeline.features.velocity import VELOCITY_FEATURES
+
+NUMERIC_FEATURES = [
+    "amount_log", "hour", "is_weekend", "is_night", "is_high_risk_country",
+    "is_online_transaction", "is_mobile_device", *VELOCITY_FEATURES
+]
+
+CATEGORICAL_FEATURES = ["merchant_category", "transaction_type", "device_type"]
+
+# Heavy-tailed features are modelled on a log scale
+LOG_FEATURES = {"card_amount_1h", "card_amount_24h"}
+
+TARGET_COLUMN = "is_fraud"
+
+
+class FeatureEncoder:
+    """
+    Turns transactions into a dense float32 design matrix
+
+    Numeric features are standardized with the training mean/std and
+    categoricals are one-hot encoded against the training vocabulary; values
+    outside it encode as all zeros. ``numeric_features`` defaults to
+    ``NUMERIC_FEATURES``; encoders fitted on profile-enriched frames add the
+    ``PROFILE_FEATURES``.
+    """
+
+    def __init__(self, vocabulary, means=None, scales=None, numeric_features=None):
+        self.vocabulary = vocabulary
+        self.numeric_features = list(NUMERIC_FEATURES if numeric_features is None else numeric_features)
+        self.columns = list(self.numeric_features)
+        for feature in CATEGORICAL_FEATURES:
+            self.columns += [f"{feature}={value}" for value in vocabulary[feature]]
+        n_numeric = len(self.numeric_features)
+        self.means = np.zeros(n_numeric) if means is None else np.asarray(means, dtype="float64")
+        self.scales = np.ones(n_numeric) if scales is None else np.asarray(scales, dtype="float64")
+        self._offsets = {}
+        offset = n_numeric
+        for feature in CATEGORICAL_FEATURES:
+            self._offsets[feature] = offset
+            offset += len(vocabulary[feature])
+        self._lookup = {
+            feature: {value: self._offsets[feature] + i for i, value in enumerate(values)}
+            for feature, values in vocabulary.items()
+        }
+
+    @classmethod
+    def fit(cls, df):
+        df = _with_features(df)
+        vocabulary = {
+            feature: sorted(df[feature].dropna().astype(str).unique().tolist())
+            for feature in CATEGORICAL_FEATURES
+        }
+        # Profile features only when the training rows were enriched
+        numeric_features = NUMERIC_FEATURES + [name for name in PROFILE_FEATURES if name in df.columns]
+        numeric = _numeric_matrix(df, numeric_features)
+        scales = numeric.std(axis=0)
+        return cls(vocabulary, numeric.mean(axis=0), np.where(scales > 0, scales, 1.0), numeric_features)
+
+    @property
+    def uses_profiles(self):
+        return any(name in PROFILE_FEATURES for name in self.numeric_features)
+
+    def transform(self, df):
+        """
+        Encode a DataFrame into a float32 matrix without per-row Python
+        """
+        df = _with_features(df)
+        X = np.zeros((len(df), len(self.columns)), dtype=np.float32)
+        X[:, :len(self.numeric_features)] = (_numeric_matrix(df, self.numeric_features) - self.means) / self.scales
+        rows = np.arange(len(df))
+        for feature in CATEGORICAL_FEATURES:
+            codes = pd.Categorical(df[feature].astype(object), categories=self.vocabulary[feature]).codes
+            known = codes >= 0
+            X[rows[known], self._offsets[feature] + codes[known]] = 1.0
+        return X
+
+    def transform_record(self, record):
+        """
+        Encode one transaction dict as a sparse list of (column, value)
+        """
+        if any(name not in record for name in FEATURE_NAMES):
+            record = {**record, **transaction_features(record)}
+        encoded = []
+        for i, name in enumerate(self.numeric_features):
+            value = float(record.get(name) or 0.0)
+            if name in LOG_FEATURES:
+                value = math.log1p(max(value, 0.0))
+            encoded.append((i, (value - self.means[i]) / self.scales[i]))
+        for feature in CATEGORICAL_FEATURES:
+            column = self._lookup[feature].get(str(record.get(feature)))
+            if column is not None:
+                encoded.append((column, 1.0))
+        return encoded
+
+    def to_dict(self):
+        return {
+            "vocabulary": self.vocabulary,
+            "means": self.means.tolist(),
+            "scales": self.scales.tolist(),
+        }
+
+
+def _with_features(df):
+    """
+    Accept raw or processed transactions in any tabular form
+    """
+    if isinstance(df, list):
+        df = pd.DataFrame(df)
+    elif not isinstance(df, pd.DataFrame):
+        # pyarrow Table / RecordBatch
+        df = df.to_pandas()
+    missing = [name for name in FEATURE_NAMES if name not in df.columns]
+    if missing:
+        df = add_features_pandas(df.copy(), missing)
+    for feature in CATEGORICAL_FEATURES:
+        if feature not in df.columns:
+            df[feature] = None
+    return df
+
+
+def _numeric_matrix(df, names):
+    columns = []
+    for name in names:
+        if name in df.columns:
+            values = pd.to_numeric(df[name], errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+        else:
+            values = np.zeros(len(df))
+        if name in LOG_FEATURES:
+            values = np.log1p(np.maximum(values, 0.0))
+        columns.append(values)
+    return np.column_stack(columns) if columns else np.zeros((len(df), 0))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35.0, 35.0)))
+
+
+class LocalModel:
+    """
+    Logistic regression fraud model scored in-process
+    """
+
+    def __init__(self, encoder, weights, intercept, metadata=None):
+        self.encoder = encoder
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.intercept = float(intercept)
+        self.metadata = metadata or {}
+        self._weights_list = self.weights.tolist()
+
+    @classmethod
+    def train(cls, df, l2=1.0, max_iter=25, sample_weight=None):
+        """
+        Fit with Newton-Raphson (IRLS); a couple of dozen iterations over a
+        design matrix of a few dozen columns, so training on millions of rows
+        takes seconds
+        """
+        df = _with_features(df)
+        encoder = FeatureEncoder.fit(df)
+        X = encoder.transform(df).astype("float64")
+        y = pd.to_numeric(df[TARGET_COLUMN]).to_numpy(dtype="float64")
+        weight = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype="float64")
+        X = np.column_stack([X, np.ones(len(X))])
+        beta = np.zeros(X.shape[1])
+        penalty = np.full(X.shape[1], l2)
+        penalty[-1] = 0.0
+        for _ in range(max_iter):
+            p = _sigmoid(X @ beta)
+            gradient = X.T @ (weight * (p - y)) + penalty * beta
+            hessian = (X * (weight * p * (1 - p))[:, None]).T @ X + np.diag(penalty)
+            step = np.linalg.solve(hessian, gradient)
+            beta -= step
+            if np.abs(step).max() < 1e-6:
+                break
+        return cls(encoder, beta[:-1], beta[-1], {"n_train": int(len(y)), "positive_rate": float(y.mean())})
+
+    def predict_proba(self, data):
+        """
+        Fraud probability for every row of ``data`` in one vectorized call
+
+        ``data`` may be a DataFrame, pyarrow Table, list of records or an
+        already encoded float matrix.
+        """
+        if isinstance(data, np.ndarray):
+            X = data
+        else:
+            X = self.encoder.transform(data)
+        return _sigmoid(X @ self.weights + self.intercept)
+
+    def predict_record(self, record):
+        """
+        Fraud probability for a single transaction dict, without NumPy
+        overhead
+        """
+        weights = self._weights_list
+        z = self.intercept
+        for column, value in self.encoder.transform_record(record):
+            z += weights[column] * value
+        return 1.0 / (1.0 + math.exp(-max(min(z, 35.0), -35.0)))
+
+    def save(self, path):
+        artifact = {
+            "format": "fraudsage-logreg-v1",
+            "numeric_features": self.encoder.numeric_features,
+            "categorical_features": CATEGORICAL_FEATURES,
+            "encoder": self.encoder.to_dict(),
+            "weights": self.weights.tolist(),
+            "intercept": self.intercept,
+            "metadata": self.metadata,
+        }
+        with open(path, "w") as f:
+            json.dump(artifact, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an artifact written by ``save``, checking its feature names
+        against the features this code can compute
+        """
+        with open(path) as f:
+            artifact = json.load(f)
+        if artifact.get("format") != "fraudsage-logreg-v1":
+            raise ValueError(f"Unsupported model artifact format: {artifact.get('format')}")
+        numeric_features = artifact["numeric_features"]
+        unknown = [name for name in numeric_features if name not in NUMERIC_FEATURES + PROFILE_FEATURES]
+        if unknown:
+            raise ValueError(f"Model artifact uses unknown numeric features: {unknown}")
+        if artifact["categorical_features"] != CATEGORICAL_FEATURES:
+            raise ValueError(f"Model artifact was trained on categorical features "
+                             f"{artifact['categorical_features']}, expected {CATEGORICAL_FEATURES}")
+        encoder = FeatureEncoder(
+            artifact["encoder"]["vocabulary"], artifact["encoder"]["means"], artifact["encoder"]["scales"],
+            numeric_features)
+        if len(artifact["weights"]) != len(encoder.columns) or len(encoder.means) != len(numeric_features):
+            raise ValueError(f"Model artifact does not match its feature names: {len(artifact['weights'])} "
+                             f"weights and {len(encoder.means)} means for {len(encoder.columns)} encoded columns")
+        return cls(encoder, artifact["weights"], artifact["intercept"], artifact.get("metadata"))
+
+
+class LocalEndpoint:
+    """
+    Drop-in stand-in for a ``sagemaker-runtime`` client backed by a
+    ``LocalModel``
+
+    Supports the payloads the endpoint accepts: a JSON object (or list of
+    objects), JSON lines, and header-less CSV in ``csv_columns`` order.
+    """
+
+    def __init__(self, model, csv_columns=None):
+        self.model = model
+        self.csv_columns = csv_columns
+
+    def invoke_endpoint(self, EndpointName=None, ContentType="application/json", Body=b"", Accept=None, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        predictions, content_type = self._score(ContentType, Body)
+        return {
+            "Body": io.BytesIO(predictions.encode()),
+            "ContentType": content_type,
+            "InvokedProductionVariant": "Local",
+        }
+
+    def _score(self, content_type, body):
+        if content_type == "application/json":
+            payload = json.loads(body)
+            if isinstance(payload, dict):
+                return json.dumps({"predicted_probability": self.model.predict_record(payload)}), content_type
+            probabilities = self.model.predict_proba(payload)
+            return json.dumps({"predictions": [
+                {"predicted_probability": float(p)} for p in probabilities]}), content_type
+        if content_type in ("application/jsonlines", "application/x-jsonlines"):
+            records = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+            probabilities = self.model.predict_proba(records)
+            lines = [json.dumps({"predicted_probability": float(p)}) for p in probabilities]
+            return "\n".join(lines) + "\n", content_type
+        if content_type == "text/csv":
+            if self.csv_columns is None:
+                raise ValueError("LocalEndpoint needs csv_columns to score text/csv payloads")
+            df = pd.read_csv(io.BytesIO(body), header=None, dtype=str)
+            if df.shape[1] != len(self.csv_columns):
+                raise ValueError(f"text/csv rows have {df.shape[1]} fields, expected {len(self.csv_columns)}")
+            df.columns = self.csv_columns
+            for name in df.columns:
+                if name in self.model.encoder.numeric_features or name == "amount":
+                    df[name] = pd.to_numeric(df[name], errors="coerce")
+            probabilities = self.model.predict_proba(df)
+            return "\n".join(f"{p:.6f}" for p in probabilities) + "\n", content_type
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train a local fraud model")
+    parser.add_argument("--train", required=True, help="raw CSV or processed Parquet directory")
+    parser.add_argument("--output", default="models/local_model.json")
+    parser.add_argument("--l2", type=float, default=1.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import pyarrow.dataset as ds
+
+    args = parse_args()
+    if os.path.isdir(args.train):
+        train_df = ds.dataset(args.train, format="parquet", partitioning="hive").to_table().to_pandas()
+    else:
+        train_df = pd.read_csv(args.train)
+    # Downsampled training splits carry importance weights
+    weights = train_df["sample_weight"] if "sample_weight" in train_df.columns else None
+    model = LocalModel.train(train_df, l2=args.l2, sample_weight=weights)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    model.save(args.output)
+    print(f"Trained on {model.metadata['n_train']:,} rows, saved to {args.output}")
@@ -0,0 +1,210 @@
+"""
+Declarative business rules evaluated before the model.
+
+Each rule is a list of conditions on raw fields or derived features, all of
+which must hold, and an outcome:
+
+* ``allow`` - clearly legitimate; scored 0.0
+* ``deny``  - clearly fraudulent; scored 1.0
+* ``score`` - a fixed score set by the rule (``"score": 0.9``)
+
+Rules are checked in list order and the first match decides; transactions
+no rule matches go to the model. Decided transactions never reach the
+endpoint, which takes load and tail latency off it.
+
+A ``RuleSet`` compiles the rules once into both forms the scoring paths
+need: vectorized NumPy masks for frames (``apply``) and a closure of plain
+comparisons for single records (``match``). Both count hits per rule.
+Rules can be loaded from JSON (local or ``s3://``) in the same format as
+``DEFAULT_RULES``.
+"""
+import operator
+import threading
+
+import numpy as np
+import pandas as pd
+
+OUTCOMES = {"allow": 0.0, "deny": 1.0, "score": None}
+
+_NUMERIC_OPS = {"lt": operator.lt, "le": operator.le, "gt": operator.gt, "ge": operator.ge}
+OPS = {*_NUMERIC_OPS, "eq", "ne", "in", "not_in", "is_null"}
+
+DEFAULT_RULES = [
+    # Card testing: a burst of attempts on one card within the hour
+    {"name": "card_testing_burst", "outcome": "deny",
+     "when": [{"field": "card_txn_count_1h", "op": "ge", "value": 10}]},
+    {"name": "large_online_high_risk_country", "outcome": "deny",
+     "when": [{"field": "is_high_risk_country", "op": "eq", "value": 1},
+              {"field": "is_online_transaction", "op": "eq", "value": 1},
+              {"field": "amount", "op": "ge", "value": 5000}]},
+    {"name": "country_hopping", "outcome": "score", "score": 0.9,
+     "when": [{"field": "card_distinct_countries", "op": "ge", "value": 5},
+              {"field": "card_txn_count_24h", "op": "ge", "value": 5}]},
+    # Small in-person purchases on a quiet card in a low-risk country
+    {"name": "small_in_store", "outcome": "allow",
+     "when": [{"field": "transaction_type", "op": "eq", "value": "in_store"},
+              {"field": "amount", "op": "lt", "value": 20},
+              {"field": "is_high_risk_country", "op": "eq", "value": 0},
+              {"field": "card_txn_count_1h", "op": "le", "value": 2}]},
+]
+
+
+def validate_rules(rules):
+    """
+    Raise ValueError for malformed rules
+    """
+    names = set()
+    for rule in rules:
+        name = rule.get("name")
+        if not name or name in names:
+            raise ValueError(f"Rules need unique names: {name!r}")
+        names.add(name)
+        if rule.get("outcome") not in OUTCOMES:
+            raise ValueError(f"Rule {name}: unknown outcome {rule.get('outcome')!r}")
+        if rule["outcome"] == "score" and not 0.0 <= float(rule.get("score", -1)) <= 1.0:
+            raise ValueError(f"Rule {name}: score outcomes need a score in [0, 1]")
+        if not rule.get("when"):
+            raise ValueError(f"Rule {name}: no conditions")
+        for condition in rule["when"]:
+            if condition.get("op") not in OPS:
+                raise ValueError(f"Rule {name}: unknown op {condition.get('op')!r}")
+
+
+def _record_condition(condition):
+    field = condition["field"]
+    op = condition["op"]
+    value = condition.get("value")
+    if op == "is_null":
+        def is_null(record):
+            x = record.get(field)
+            return x is None or (isinstance(x, float) and x != x)
+        return is_null
+    if op in _NUMERIC_OPS:
+        compare = _NUMERIC_OPS[op]
+        threshold = float(value)
+
+        def numeric(record):
+            x = record.get(field)
+            if x is None:
+                return False
+            try:
+                return compare(float(x), threshold)
+            except (TypeError, ValueError):
+                return False
+        return numeric
+    members = frozenset(value if op in ("in", "not_in") else [value])
+    if op in ("eq", "in"):
+        return lambda record: record.get(field) in members
+    return lambda record: record.get(field) not in members
+
+
+def _frame_condition(condition, df, numeric_columns):
+    field = condition["field"]
+    op = condition["op"]
+    value = condition.get("value")
+    if field not in df.columns:
+        # A missing column is all null
+        return np.full(len(df), op in ("is_null", "ne", "not_in"))
+    if op == "is_null":
+        return df[field].isna().to_numpy()
+    if op in _NUMERIC_OPS:
+        if field not in numeric_columns:
+            numeric_columns[field] = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64)
+        # NaN compares false, like a missing value in the record path
+        return _NUMERIC_OPS[op](numeric_columns[field], float(value))
+    members = list(value) if op in ("in", "not_in") else [value]
+    mask = df[field].isin(members).to_numpy()
+    return mask if op in ("eq", "in") else ~mask
+
+
+class RuleSet:
+    """
+    Compiled rules with thread-safe hit counters
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        validate_rules(rules)
+        self.rules = list(rules)
+        self.names = [rule["name"] for rule in self.rules]
+        self.probabilities = [
+            float(rule["score"]) if rule["outcome"] == "score" else OUTCOMES[rule["outcome"]]
+            for rule in self.rules
+        ]
+        self._compiled = [
+            (i, [_record_condition(condition) for condition in rule["when"]])
+            for i, rule in enumerate(self.rules)
+        ]
+        self.hits = [0] * len(self.rules)
+        self.evaluated = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, s3_client=None):
+        from ml_pipeline.glue_jobs.historical_stats import read_stats
+
+        body = read_stats(path, s3_client)
+        return cls(body["rules"] if isinstance(body, dict) else body)
+
+    def match(self, record):
+        """
+        ``(rule name, probability)`` of the first matching rule, or None
+        when the record should go to the model
+        """
+        matched = None
+        for i, conditions in self._compiled:
+            for condition in conditions:
+                if not condition(record):
+                    break
+            else:
+                matched = i
+                break
+        with self._lock:
+            self.evaluated += 1
+            if matched is not None:
+                self.hits[matched] += 1
+        if matched is None:
+            return None
+        return self.names[matched], self.probabilities[matched]
+
+    def apply(self, df):
+        """
+        Rule index (-1 for none) and probability (NaN for none) per row
+        """
+        decided = np.full(len(df), -1, dtype=np.int32)
+        numeric_columns = {}
+        for i, rule in enumerate(self.rules):
+            open_rows = decided < 0
+            if not open_rows.any():
+                break
+            mask = open_rows
+            for condition in rule["when"]:
+                mask = mask & _frame_condition(condition, df, numeric_columns)
+                if not mask.any():
+                    break
+            decided[mask] = i
+        probabilities = np.full(len(df), np.nan)
+        hit = decided >= 0
+        probabilities[hit] = np.asarray(self.probabilities, dtype=np.float64)[decided[hit]]
+        counts = np.bincount(decided[hit], minlength=len(self.rules))
+        with self._lock:
+            self.evaluated += len(df)
+            for i, count in enumerate(counts):
+                self.hits[i] += int(count)
+        return decided, probabilities
+
+    def rule_names(self, decided):
+        """
+        Rule name per row of ``apply``'s output (None for model-scored rows)
+        """
+        names = np.array(self.names + [None], dtype=object)
+        return names[np.where(decided < 0, len(self.names), decided)]
+
+    def stats(self):
+        with self._lock:
+            decided = sum(self.hits)
+            return {
+                "evaluated": self.evaluated,
+                "decided": decided,
+                "decided_rate": decided / self.evaluated if self.evaluated else 0.0,
+                "hits": dict(zip(self.names, self.hits)),
+            }
@@ -0,0 +1,151 @@
+"""
+Local HTTP stand-in for the SageMaker runtime.
+
+Serves ``POST /endpoints/<name>/invocations`` the way the real
+``sagemaker-runtime`` service does, so an unmodified boto3 client (created
+with ``endpoint_url``) can be pointed at it. Predictions come from a
+``LocalEndpoint``; latency and failures can be injected to see how callers
+behave when the endpoint slows down or throttles:
+
+    python -m ml_pipeline.scoring.stand_in_endpoint --port 8080 --latency-ms 20 --jitter-ms 10 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+
+INVOCATIONS_PATH = "/endpoints/{}/invocations"
+
+
+class StandInEndpoint:
+    """
+    Scoring behaviour of the stand-in: a local model plus injected faults
+
+    Each request sleeps ``latency_ms`` plus an exponentially distributed
+    ``jitter_ms`` (so the latency has a realistic long tail), then fails
+    with HTTP 429 with probability ``throttle_rate`` or HTTP 500 with
+    probability ``error_rate``.
+    """
+
+    def __init__(self, endpoint, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.endpoint = endpoint
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def fault(self):
+        """
+        Sleep for the injected latency and return an injected error, if any,
+        as (status, error type)
+        """
+        with self._lock:
+            self.requests += 1
+            jitter = self.random.expovariate(1.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0
+            draw = self.random.random()
+        time.sleep((self.latency_ms + jitter) / 1000.0)
+        if draw < self.throttle_rate:
+            return 429, "ThrottlingException"
+        if draw < self.throttle_rate + self.error_rate:
+            return 500, "InternalFailure"
+        return None
+
+
+def _handler(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="application/json", error_type=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if error_type:
+                self.send_header("x-amzn-ErrorType", error_type)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, error_type, message):
+            self._send(status, json.dumps({"message": message}).encode(), error_type=error_type)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "endpoints" or parts[2] != "invocations":
+                self._error(404, "ValidationError", f"Unknown path {self.path}")
+                return
+            fault = stand_in.fault()
+            if fault is not None:
+                self._error(fault[0], fault[1], "Injected failure")
+                return
+            try:
+                response = stand_in.endpoint.invoke_endpoint(
+                    EndpointName=parts[1], ContentType=self.headers.get("Content-Type", "application/json"),
+                    Body=body)
+            except Exception as e:
+                self._error(400, "ModelError", str(e))
+                return
+            self._send(200, response["Body"].read(), response["ContentType"])
+
+        def log_message(self, format, *args):
+            # One line per request would dominate the cost under load
+            pass
+
+    return Handler
+
+
+def start_stand_in(stand_in, host="127.0.0.1", port=0):
+    """
+    Serve ``stand_in`` on a background thread and return the server; its
+    URL is ``f"http://{host}:{server.server_address[1]}"``
+    """
+    server = ThreadingHTTPServer((host, port), _handler(stand_in))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def default_endpoint(model_path=None, csv_columns=None):
+    """
+    LocalEndpoint over a saved model, or over a small model trained on
+    synthetic data when no artifact is given
+    """
+    if model_path:
+        model = LocalModel.load(model_path)
+    else:
+        from data.generate_synthetic_data import generate_transaction_data
+        from ml_pipeline.glue_jobs.local_etl import clean_data
+        model = LocalModel.train(clean_data(
+            generate_transaction_data(n_samples=20000, fraud_ratio=0.02, fast=True, seed=0)))
+    return LocalEndpoint(model, csv_columns)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the SageMaker runtime")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", help="local model artifact; a small synthetic model is trained if omitted")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from ml_pipeline.scoring.batch_score import payload_columns
+
+    args = parse_args()
+    endpoint = default_endpoint(args.model)
+    # text/csv payloads carry profile columns only for profile-trained models
+    endpoint.csv_columns = payload_columns(endpoint.model.encoder.uses_profiles)
+    stand_in = StandInEndpoint(endpoint, args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate)
+    server = ThreadingHTTPServer((args.host, args.port), _handler(stand_in))
+    print(f"Serving {INVOCATIONS_PATH.format('<name>')} on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -20,11 +20,62 @@ def test_data_generation():
     
     # Check data types
     assert df['amount'].dtype in ['float64', 'int64']
-    assert df['is_fraud'].dtype in ['int64']
+    assert df['is_fraud'].dtype == 'uint8'
+    assert df['merchant_category'].dtype == 'category'
     
     # Check fraud ratio
     assert abs(df['is_fraud'].mean() - 0.01) < 0.01
 
+def test_fast_data_generation():
+    """Test vectorized synthetic data generation"""
+    from data.generate_synthetic_data import generate_transaction_data
+    
+    reference = generate_transaction_data(n_samples=50, fraud_ratio=0.1)
+    df = generate_transaction_data(n_samples=5000, fraud_ratio=0.02, fast=True, seed=7)
+    
+    # Same schema as the Faker-per-row implementation
+    assert list(df.columns) == list(reference.columns)
+    assert (df.dtypes.astype(str) == reference.dtypes.astype(str)).all()
+    assert df['transaction_id'].is_unique
+    
+    # Exact fraud count and fraud patterns
+    fraud = df[df['is_fraud'] == 1]
+    assert len(fraud) == 100
+    assert fraud['merchant_country'].isin(['Russia', 'China', 'Nigeria', 'Brazil']).all()
+    assert (fraud['transaction_type'] == 'online').all()
+    assert (fraud['device_type'] == 'mobile').all()
+    
+    # Seeded runs are reproducible, timestamps included
+    again = generate_transaction_data(n_samples=5000, fraud_ratio=0.02, fast=True, seed=7)
+    assert df.equals(again)
+
+def test_sharded_dataset_writer(tmp_path):
+    """Test sharded, chunked dataset generation"""
+    import pyarrow.dataset as ds
+    from data.generate_synthetic_data import write_sharded_dataset
+    
+    summary = write_sharded_dataset(
+        2500, str(tmp_path / 'run1'), fraud_ratio=0.01, seed=3,
+        shard_size=1000, chunk_size=400, n_workers=2, partition_cols=['merchant_category']
+    )
+    assert summary == {'rows': 2500, 'fraud': 25, 'shards': 3}
+    
+    table = ds.dataset(str(tmp_path / 'run1'), format='parquet', partitioning='hive').to_table()
+    df = table.to_pandas()
+    assert len(df) == 2500
+    assert df['transaction_id'].is_unique
+    assert df['is_fraud'].sum() == 25
+    
+    # Per-shard seeds make reruns reproducible
+    write_sharded_dataset(
+        2500, str(tmp_path / 'run2'), fraud_ratio=0.01, seed=3,
+        shard_size=1000, chunk_size=400, n_workers=1, partition_cols=['merchant_category']
+    )
+    rerun = ds.dataset(str(tmp_path / 'run2'), format='parquet', partitioning='hive').to_table().to_pandas()
+    columns = ['transaction_id', 'amount', 'card_number', 'is_fraud']
+    assert (df.sort_values('transaction_id')[columns].values
+            == rerun.sort_values('transaction_id')[columns].values).all()
+
 def test_data_cleaning():
     """Test data cleaning functions"""
     # Create sample data
@@ -46,10 +97,141 @@ def test_data_cleaning():
     assert cleaned_df['merchant_category'].isna().sum() == 0
     assert len(cleaned_df) == 3
 
+def test_local_etl_engine(tmp_path):
+    """Test the streaming pyarrow ETL engine end to end"""
+    import pyarrow.dataset as ds
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import OUTPUT_COLUMNS, run_local_etl
+    
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    df = generate_transaction_data(n_samples=3000, fraud_ratio=0.01, fast=True, seed=1)
+    df.to_csv(raw_dir / 'day1.csv', index=False)
+    # Duplicates spread across files and record batches
+    df.iloc[::10].to_csv(raw_dir / 'day2.csv', index=False)
+    
+    stats = run_local_etl(str(raw_dir), str(tmp_path / 'processed'), block_size=64 << 10)
+    assert stats == {'files': 2, 'rows_in': 3300, 'rows_out': 3000}
+    
+    processed = ds.dataset(str(tmp_path / 'processed'), format='parquet', partitioning='hive').to_table().to_pandas()
+    assert sorted(processed.columns) == sorted(OUTPUT_COLUMNS + ['event_date'])
+    assert processed['transaction_id'].is_unique
+    assert len(processed) == 3000
+    assert processed['is_fraud'].sum() == 30
+    assert (processed['is_high_risk_country'] >= processed['is_fraud']).all()
+
+def test_incremental_etl(tmp_path):
+    """Test bookmarked, deduplicated incremental ETL runs"""
+    import pyarrow.dataset as ds
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.incremental import DedupIndex, run_incremental_etl
+    
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    output = str(tmp_path / 'processed')
+    state = str(tmp_path / 'state')
+    df = generate_transaction_data(n_samples=2000, fraud_ratio=0.01, fast=True, seed=5)
+    df.iloc[:1500].to_csv(raw_dir / 'day1.csv', index=False)
+    
+    first = run_incremental_etl(str(raw_dir), output, state, index_capacity=10000)
+    assert (first['files'], first['rows_out'], first['files_skipped']) == (1, 1500, 0)
+    
+    # The second day re-delivers part of the first day
+    df.iloc[1000:].to_csv(raw_dir / 'day2.csv', index=False)
+    second = run_incremental_etl(str(raw_dir), output, state, index_capacity=10000)
+    assert (second['files'], second['rows_in'], second['rows_out'], second['files_skipped']) == (1, 1000, 500, 1)
+    
+    # Nothing new to do
+    third = run_incremental_etl(str(raw_dir), output, state, index_capacity=10000)
+    assert (third['files'], third['rows_out']) == (0, 0)
+    
+    processed = ds.dataset(output, format='parquet', partitioning='hive').to_table().to_pandas()
+    assert len(processed) == 2000
+    assert processed['transaction_id'].is_unique
+    
+    index = DedupIndex(str(tmp_path / 'state' / 'dedup_index'))
+    assert len(index) == 2000
+    assert index.filter_new(df['transaction_id'].iloc[1990:].tolist() + ['TXN99999999']).tolist() == [False] * 10 + [True]
+    
+    # A commit interrupted after its segment landed: the filter and meta are
+    # stale, so the index rebuilds the filter from the segments
+    crashed = tmp_path / 'crashed'
+    index = DedupIndex(str(crashed), capacity=10000)
+    index.filter_new(df['transaction_id'].iloc[:100].tolist())
+    index.commit()
+    stale = {name: (crashed / name).read_bytes() for name in ('bloom.bin', 'meta.json')}
+    index.filter_new(df['transaction_id'].iloc[100:200].tolist())
+    index.commit()
+    for name, data in stale.items():
+        (crashed / name).write_bytes(data)
+    index = DedupIndex(str(crashed), capacity=10000)
+    assert len(index) == 200
+    assert not index.filter_new(df['transaction_id'].iloc[:200].tolist()).any()
+    assert not list(crashed.glob('**/*.tmp'))
+
+    # Velocity windows span runs: two daily runs match one run over both days
+    from ml_pipeline.features.velocity import VELOCITY_FEATURES
+    from ml_pipeline.glue_jobs.local_etl import run_local_etl
+    ordered = df.sort_values('timestamp')
+    for name, part in [('a', ordered.iloc[:1000]), ('b', ordered.iloc[1000:])]:
+        (tmp_path / f'raw_{name}').mkdir()
+        part.to_csv(tmp_path / f'raw_{name}' / 'part.csv', index=False)
+        run_incremental_etl(str(tmp_path / f'raw_{name}'), str(tmp_path / 'split'), str(tmp_path / 'split_state'))
+    run_local_etl(str(tmp_path / 'raw_*' / 'part.csv'), str(tmp_path / 'whole'))
+    split, whole = [
+        ds.dataset(str(tmp_path / name), format='parquet', partitioning='hive').to_table().to_pandas()
+        .sort_values('transaction_id').reset_index(drop=True)
+        for name in ('split', 'whole')
+    ]
+    assert np.allclose(split[VELOCITY_FEATURES], whole[VELOCITY_FEATURES])
+
+def test_velocity_features():
+    """Test batch, streamed and online velocity features agree"""
+    from ml_pipeline.features.schema import hash_card_numbers
+    from ml_pipeline.features.velocity import (
+        VELOCITY_FEATURES, BatchVelocity, VelocityStore, add_velocity_features_pandas
+    )
+    
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({
+        'card_number': rng.integers(0, 40, n).astype(str),
+        'timestamp': pd.Timestamp('2024-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3 * 86400, n)), unit='s'),
+        'amount': rng.uniform(1, 100, n).round(2),
+        'merchant_country': rng.choice(['USA', 'France', 'Brazil', None], n)
+    })
+    # Batch features group by the card hash, the online store by the card
+    df['card_hash'] = hash_card_numbers(df['card_number'])
+    batch = add_velocity_features_pandas(df)
+    
+    velocity = BatchVelocity()
+    streamed = pd.concat([velocity.apply(df.iloc[i:i + 700]) for i in range(0, n, 700)])
+    
+    store = VelocityStore(max_cards=100, max_events_per_card=1000)
+    online = pd.DataFrame([store.update(record) for record in df.to_dict('records')])
+    
+    for name in VELOCITY_FEATURES:
+        assert np.allclose(streamed[name], batch[name])
+        assert np.allclose(online[name], batch[name])
+    
+    # Past the last day only the most recently seen max_cards cards keep context
+    one_off = df.assign(card_hash=hash_card_numbers(pd.Series(np.arange(n).astype(str))))
+    last_day = (one_off['timestamp'] >= one_off['timestamp'].max() - pd.Timedelta(days=1)).sum()
+    capped_batches = BatchVelocity(max_cards=last_day + 5)
+    for i in range(0, n, 700):
+        capped_batches.apply(one_off.iloc[i:i + 700])
+    assert len(capped_batches.history) == last_day + 5
+    
+    # Hard caps on cards and per-card events
+    capped = VelocityStore(max_cards=5, max_events_per_card=3)
+    for record in df.to_dict('records'):
+        features = capped.update(record)
+        assert features['card_txn_count_24h'] <= 3
+    assert len(capped) == 5
+
 def test_model_prediction():
     """Test model prediction endpoint"""
-    # Initialize SageMaker runtime client
-    runtime = boto3.client('sagemaker-runtime')
+    from ml_pipeline.scoring.endpoint_client import ScoringClient
     
     # Prepare test data
     test_data = {
@@ -70,19 +252,13 @@ def test_model_prediction():
     }
     
     try:
-        # Call endpoint
-        response = runtime.invoke_endpoint(
-            EndpointName='fraud-detection-endpoint',
-            ContentType='application/json',
-            Body=json.dumps(test_data)
-        )
-        
-        result = json.loads(response['Body'].read().decode())
+        # Call endpoint through the shared scoring client
+        client = ScoringClient()
+        probability = client.predict(test_data)
         
         # Check response structure
-        assert 'predicted_probability' in result
-        assert isinstance(result['predicted_probability'], float)
-        assert 0 <= result['predicted_probability'] <= 1
+        assert isinstance(probability, float)
+        assert 0 <= probability <= 1
         
     except Exception as e:
         pytest.skip(f"Skipping endpoint test: {str(e)}")
@@ -113,4 +289,1037 @@ def test_feature_engineering():
     # Check feature values
     assert processed_df['is_high_risk_country'].sum() == 1
     assert processed_df['is_online_transaction'].sum() == 1
-    assert processed_df['is_mobile_device'].sum() == 1 
\ No newline at end of file
+    assert processed_df['is_mobile_device'].sum() == 1 
+
+def test_feature_backends_agree():
+    """Test the vectorized and single-record feature backends match"""
+    from ml_pipeline.features.transaction_features import (
+        FEATURE_NAMES, add_features_pandas, transaction_features
+    )
+    
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-06 20:00', periods=48, freq='70min'),
+        'amount': np.linspace(0, 500, 48),
+        'merchant_country': ['USA', 'Russia', 'Nigeria', 'France'] * 12,
+        'transaction_type': ['online', 'in_store', 'atm'] * 16,
+        'device_type': ['mobile', 'desktop', 'pos_terminal', 'atm'] * 12
+    })
+    batch = add_features_pandas(df.copy())
+    
+    for row, expected in zip(df.to_dict('records'), batch[FEATURE_NAMES].to_dict('records')):
+        features = transaction_features(row)
+        assert features.keys() == expected.keys()
+        for name, value in expected.items():
+            assert features[name] == pytest.approx(value)
+    
+    # Spark dayofweek convention: 2024-01-06 is a Saturday, 2024-01-07 a Sunday
+    saturday = transaction_features({'timestamp': '2024-01-06T12:00:00', 'amount': 1.0})
+    sunday = transaction_features({'timestamp': '2024-01-07T03:00:00', 'amount': 1.0})
+    assert (saturday['day_of_week'], saturday['is_weekend'], saturday['is_night']) == (7, 1, 0)
+    assert (sunday['day_of_week'], sunday['is_weekend'], sunday['is_night']) == (1, 1, 1)
+
+def test_local_model_scoring(tmp_path):
+    """Test the in-process scoring engine and its endpoint stand-in"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    
+    train = clean_data(generate_transaction_data(n_samples=20000, fraud_ratio=0.02, fast=True, seed=11))
+    test = clean_data(generate_transaction_data(n_samples=2000, fraud_ratio=0.02, fast=True, seed=12))
+    model = LocalModel.train(train)
+    
+    # Vectorized batch scoring separates the synthetic fraud pattern
+    probabilities = model.predict_proba(test)
+    assert probabilities.shape == (2000,)
+    assert ((probabilities >= 0) & (probabilities <= 1)).all()
+    fraud = test['is_fraud'].to_numpy() == 1
+    assert probabilities[fraud].mean() > 0.5 > probabilities[~fraud].mean()
+    
+    # Single-record path and artifact round trip agree with the batch path
+    records = test.head(20).to_dict('records')
+    assert [model.predict_record(r) for r in records] == pytest.approx(probabilities[:20].tolist(), abs=1e-5)
+    model.save(str(tmp_path / 'model.json'))
+    loaded = LocalModel.load(str(tmp_path / 'model.json'))
+    assert loaded.predict_proba(test.head(20)) == pytest.approx(probabilities[:20], abs=1e-6)
+    
+    # Unenriched rows give a model, and CSV payloads, without profile columns
+    from ml_pipeline.features.profiles import PROFILE_FEATURES
+    from ml_pipeline.scoring.batch_score import PAYLOAD_COLUMNS, encode_payload
+    assert not set(PROFILE_FEATURES) & set(loaded.encoder.numeric_features)
+    rows = encode_payload(test.head(3), 'csv').decode().splitlines()
+    assert [row.count(',') for row in rows] == [len(PAYLOAD_COLUMNS) - 1] * 3
+    
+    # Artifacts whose feature names do not match the code or the weights are rejected
+    with open(tmp_path / 'model.json') as f:
+        artifact = json.load(f)
+    for numeric_features, message in [(['no_such_feature'], 'unknown numeric features'),
+                                      (artifact['numeric_features'][:-1], 'does not match')]:
+        with open(tmp_path / 'bad.json', 'w') as f:
+            json.dump({**artifact, 'numeric_features': numeric_features}, f)
+        with pytest.raises(ValueError, match=message):
+            LocalModel.load(str(tmp_path / 'bad.json'))
+    
+    # Same call shape as the sagemaker-runtime client
+    endpoint = LocalEndpoint(loaded)
+    response = endpoint.invoke_endpoint(
+        EndpointName='fraud-detection-endpoint',
+        ContentType='application/json',
+        Body=json.dumps({
+            "amount": 100.0, "merchant_category": "retail", "transaction_type": "online",
+            "device_type": "mobile", "merchant_country": "USA",
+            "timestamp": datetime.now().isoformat()
+        })
+    )
+    result = json.loads(response['Body'].read().decode())
+    assert isinstance(result['predicted_probability'], float)
+    assert 0 <= result['predicted_probability'] <= 1
+
+def test_batch_scoring(tmp_path):
+    """Test micro-batched, concurrent batch scoring with retries"""
+    from botocore.exceptions import ClientError
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data, run_local_etl
+    from ml_pipeline.scoring.batch_score import PAYLOAD_COLUMNS, score_file
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    
+    model = LocalModel.train(clean_data(generate_transaction_data(n_samples=5000, fraud_ratio=0.02, fast=True, seed=1)))
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    generate_transaction_data(n_samples=3000, fraud_ratio=0.02, fast=True, seed=2).to_csv(raw_dir / 'day.csv', index=False)
+    run_local_etl(str(raw_dir), str(tmp_path / 'processed'))
+    
+    class FlakyEndpoint(LocalEndpoint):
+        """Throttles every third request"""
+        calls = 0
+        
+        def invoke_endpoint(self, **kwargs):
+            FlakyEndpoint.calls += 1
+            if FlakyEndpoint.calls % 3 == 0:
+                raise ClientError({'Error': {'Code': 'ThrottlingException'},
+                                   'ResponseMetadata': {'HTTPStatusCode': 429}}, 'InvokeEndpoint')
+            return super().invoke_endpoint(**kwargs)
+    
+    for payload_format in ['jsonlines', 'csv']:
+        output = str(tmp_path / f'scores-{payload_format}.parquet')
+        stats = score_file(
+            FlakyEndpoint(model, csv_columns=PAYLOAD_COLUMNS), str(tmp_path / 'processed'), output,
+            payload_format=payload_format, records_per_request=128, max_in_flight=4
+        )
+        assert stats['rows'] == 3000
+        assert stats['requests'] >= 3000 // 128
+        assert stats['retries'] > 0
+        
+        scores = pd.read_parquet(output)
+        assert len(scores) == 3000
+        assert scores['transaction_id'].is_unique
+        fraud = scores['is_fraud'] == 1
+        assert scores.loc[fraud, 'predicted_probability'].mean() > scores.loc[~fraud, 'predicted_probability'].mean()
+    
+    # Only connection errors, timeouts and retryable statuses are retried
+    from botocore.exceptions import EndpointConnectionError, ReadTimeoutError
+    from ml_pipeline.scoring.batch_score import is_retryable
+    assert is_retryable(EndpointConnectionError(endpoint_url='https://runtime'))
+    assert is_retryable(ReadTimeoutError(endpoint_url='https://runtime'))
+    assert not is_retryable(ClientError({'Error': {'Code': 'ValidationError'},
+                                         'ResponseMetadata': {'HTTPStatusCode': 400}}, 'InvokeEndpoint'))
+    assert not is_retryable(ValueError('bad payload'))
+
+def test_scoring_client_cache(tmp_path):
+    """Test the pooled scoring client's LRU+TTL cache and async interface"""
+    import asyncio
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.scoring.endpoint_client import ScoringClient, feature_key
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    
+    class CountingEndpoint(LocalEndpoint):
+        calls = 0
+        def invoke_endpoint(self, **kwargs):
+            CountingEndpoint.calls += 1
+            return super().invoke_endpoint(**kwargs)
+    
+    model = LocalModel.train(clean_data(generate_transaction_data(n_samples=5000, fraud_ratio=0.05, fast=True, seed=3)))
+    now = [0.0]
+    client = ScoringClient(CountingEndpoint(model), cache_size=2, cache_ttl=60, clock=lambda: now[0])
+    record = {"amount": 100.0, "merchant_category": "retail", "transaction_type": "online",
+              "device_type": "mobile", "merchant_country": "USA", "hour": 12, "day_of_week": 2, "month": 1,
+              "is_weekend": 0, "is_night": 0, "timestamp": "2024-01-01T12:00:00"}
+    
+    # Key order, int/float spelling and, next to its time features, the raw timestamp do not change the key
+    reordered = {**dict(reversed(list(record.items()))), "amount": 100, "timestamp": "2024-01-01T12:00:05"}
+    assert feature_key(record) == feature_key(reordered)
+    # Without the derived time features the timestamp is the model's only view of time
+    raw = {name: value for name, value in record.items() if name != "hour"}
+    assert feature_key(raw) != feature_key({**raw, "timestamp": "2024-01-06T23:00:00"})
+    
+    first = client.predict(record)
+    assert client.predict(reordered) == first
+    assert CountingEndpoint.calls == 1
+    
+    # Async callers share the cache and coalesce identical requests
+    async def score_concurrently():
+        return await asyncio.gather(*[client.apredict({**record, "amount": 250.0}) for _ in range(5)])
+    assert len(set(asyncio.run(score_concurrently()))) == 1
+    assert CountingEndpoint.calls == 2
+    
+    # Without cache and coalescing every request reaches the endpoint, as load tests need
+    uncoalesced = ScoringClient(CountingEndpoint(model), cache_size=0, coalesce=False)
+    uncoalesced.predict_many([record] * 4)
+    uncoalesced.close()
+    assert CountingEndpoint.calls == 6
+    CountingEndpoint.calls = 2
+    
+    # TTL expiry and size-based eviction
+    now[0] = 61.0
+    client.predict(record)
+    assert CountingEndpoint.calls == 3
+    client.predict_many([{**record, "amount": 1.0}, {**record, "amount": 2.0}])
+    assert len(client.cache) == 2
+    client.predict(record)
+    assert CountingEndpoint.calls == 6
+    
+    summary = client.latency_summary()
+    assert summary["calls"] == 6 and summary["cache_hits"] >= 1 and summary["p95_ms"] >= 0
+    client.close()
+
+def test_historical_stats(tmp_path):
+    """Test incremental, mergeable historical stats rollups"""
+    import glob
+    import os
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.historical_stats import read_stats, update_historical_stats
+    from ml_pipeline.glue_jobs.local_etl import run_local_etl
+    
+    processed = str(tmp_path / 'processed')
+    stats_path = str(tmp_path / 'historical_stats.json')
+    batches = [generate_transaction_data(n_samples=3000, fraud_ratio=0.05, fast=True, seed=seed) for seed in (1, 2)]
+    for i, batch in enumerate(batches):
+        batch.to_csv(tmp_path / f'raw_{i}.csv', index=False)
+    
+    run_local_etl(str(tmp_path / 'raw_0.csv'), processed)
+    first = update_historical_stats(processed, str(tmp_path / 'state'), stats_path)
+    run_local_etl(str(tmp_path / 'raw_1.csv'), processed)
+    second = update_historical_stats(processed, str(tmp_path / 'state'), stats_path)
+    
+    # The second run only reads the files the second ETL run wrote
+    n_files = len(glob.glob(os.path.join(processed, '**', '*.parquet'), recursive=True))
+    assert first['files_read'] + second['files_read'] == n_files
+    assert not second['rebuilt']
+    
+    stats = read_stats(stats_path)
+    combined = pd.concat(batches)
+    assert stats['total_transactions'] == len(combined)
+    assert stats['detected_fraud'] == combined['is_fraud'].sum()
+    assert stats['avg_fraud_rate'] == pytest.approx(combined['is_fraud'].mean())
+    assert sum(stats['transactions']) == len(combined)
+    assert len(stats['date']) == len(stats['fraud_rate'])
+    daily = combined.groupby(pd.to_datetime(combined['timestamp']).dt.strftime('%Y-%m-%d'))['is_fraud'].mean()
+    assert stats['fraud_rate'] == pytest.approx(daily.loc[stats['date']].tolist())
+    
+    # Removing a processed file forces a rebuild rather than stale counts
+    os.remove(glob.glob(os.path.join(processed, '**', '*.parquet'), recursive=True)[0])
+    assert update_historical_stats(processed, str(tmp_path / 'state'), stats_path)['rebuilt']
+    assert read_stats(stats_path)['total_transactions'] < len(combined)
+
+def test_historical_stats_keep_processed_readable(tmp_path):
+    """Test that publishing stats leaves the processed dataset readable"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.historical_stats import update_historical_stats
+    from ml_pipeline.glue_jobs.local_etl import read_processed, run_local_etl
+    
+    processed = str(tmp_path / 'data' / 'processed')
+    generate_transaction_data(n_samples=2000, fraud_ratio=0.05, fast=True, seed=3).to_csv(tmp_path / 'raw.csv', index=False)
+    rows = run_local_etl(str(tmp_path / 'raw.csv'), processed)['rows_out']
+    update_historical_stats(processed, str(tmp_path / 'data' / 'state' / 'stats'),
+                            str(tmp_path / 'data' / 'stats' / 'historical_stats.json'))
+    assert read_processed(processed).count_rows() == rows
+    
+    # Stats written into the dataset would break every Parquet reader of it
+    with pytest.raises(ValueError):
+        update_historical_stats(processed, str(tmp_path / 'data' / 'state' / 'stats'),
+                                str(tmp_path / 'data' / 'processed' / 'historical_stats.json'))
+
+def test_bulk_upload_scoring():
+    """Test vectorized feature derivation and chunked scoring of an upload"""
+    import io
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.scoring.batch_score import prepare_transactions, read_uploaded_file, score_frame
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    
+    model = LocalModel.train(clean_data(generate_transaction_data(n_samples=5000, fraud_ratio=0.05, fast=True, seed=5)))
+    upload = generate_transaction_data(n_samples=3000, fraud_ratio=0.05, fast=True, seed=6)
+    
+    # CSV and Parquet uploads, with or without transaction ids, prepare alike
+    parquet = io.BytesIO()
+    upload.to_parquet(parquet, index=False)
+    from_parquet = prepare_transactions(read_uploaded_file(parquet.getvalue(), 'upload.parquet'))
+    from_csv = prepare_transactions(read_uploaded_file(
+        upload.drop(columns=['transaction_id']).to_csv(index=False).encode(), 'upload.csv'))
+    assert len(from_parquet) == len(from_csv) == 3000
+    assert from_parquet['card_txn_count_24h'].tolist() == from_csv['card_txn_count_24h'].tolist()
+    
+    progress = []
+    probabilities = score_frame(
+        LocalEndpoint(model), from_csv, records_per_request=400, max_in_flight=3,
+        on_progress=lambda done, total: progress.append((done, total)))
+    assert probabilities == pytest.approx(model.predict_proba(from_parquet), abs=1e-5)
+    assert progress[-1] == (3000, 3000) and len(progress) == 8
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+def test_benchmark_runner():
+    """Test the benchmark runner and baseline comparison"""
+    from benchmarks.run_benchmarks import DEFAULT_SIZES, QUICK_SIZES, compare_to_baseline, run_benchmarks
+    
+    # CI runs every case once, at its smallest size
+    assert QUICK_SIZES == {name: [min(sizes)] for name, sizes in DEFAULT_SIZES.items()}
+    report = run_benchmarks(['generate_fast', 'encode_features'], sizes=[2000], repeats=1, log=None)
+    results = {result['case']: result for result in report['results']}
+    assert all(result['status'] == 'ok' for result in results.values())
+    assert all(result['rows_per_second'] > 0 and result['peak_rss_mb'] > 0 for result in results.values())
+    
+    # A baseline twice as fast flags a throughput regression; the report itself does not
+    assert compare_to_baseline(report, report) == []
+    faster = {'results': [{**result, 'rows_per_second': result['rows_per_second'] * 2} for result in report['results']]}
+    regressions = compare_to_baseline(report, faster)
+    assert {r['case'] for r in regressions} == {'generate_fast', 'encode_features'}
+    assert all(r['metric'] == 'rows_per_second' for r in regressions)
+    
+    # A case that failed is a regression; a skipped one is not
+    broken = {'results': [
+        {**report['results'][0], 'status': 'failed', 'reason': 'exit code -9'},
+        {**report['results'][1], 'status': 'skipped', 'reason': 'pyspark not installed'},
+    ]}
+    assert [(r['case'], r['metric']) for r in compare_to_baseline(broken, report)] == [(report['results'][0]['case'], 'status')]
+
+def test_load_generator_with_stand_in(monkeypatch):
+    """Test the open-loop load generator against the local HTTP stand-in"""
+    from benchmarks.load_test import poisson_schedule, replay_records, run_load
+    from ml_pipeline.scoring.endpoint_client import ScoringClient, create_runtime
+    from ml_pipeline.scoring.stand_in_endpoint import StandInEndpoint, default_endpoint, start_stand_in
+    
+    # Poisson arrivals at the target rate
+    schedule = poisson_schedule(rate=500, duration=20, seed=1)
+    assert len(schedule) == pytest.approx(10000, rel=0.05)
+    assert (np.diff(schedule) > 0).all() and schedule.max() < 20
+    
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'stand-in')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'stand-in')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    stand_in = StandInEndpoint(default_endpoint(), latency_ms=20, error_rate=0.2, seed=0)
+    server = start_stand_in(stand_in)
+    try:
+        runtime = create_runtime(8, max_attempts=1, endpoint_url=f"http://127.0.0.1:{server.server_address[1]}")
+        client = ScoringClient(runtime, cache_size=0, max_pool_connections=8, coalesce=False)
+        report = run_load(client, replay_records(200), rate=50, duration=2, interval=1, seed=0)
+        client.close()
+    finally:
+        server.shutdown()
+    
+    summary = report['summary']
+    assert summary['requests'] == stand_in.requests == len(poisson_schedule(50, 2, seed=0))
+    assert 0 < summary['errors'] < summary['requests']
+    assert set(summary['error_types']) == {'InternalFailure'}
+    # Latency includes the injected delay and is measured from the scheduled send time
+    assert 20 <= summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms'] <= summary['max_ms']
+    assert [row['start_s'] for row in report['timeline']] == [0, 1]
+    assert sum(row['requests'] for row in report['timeline']) == summary['requests']
+
+def test_autopilot_orchestrator(tmp_path):
+    """Test the resumable retrain DAG against a stubbed SageMaker client"""
+    import threading
+    from ml_pipeline.autopilot.autopilot_config import WaiterError, bucket_paths, wait_for
+    from ml_pipeline.autopilot.orchestrator import StepFailed, run_retrain
+    
+    class StubSageMaker:
+        def __init__(self, fail_endpoint=False, crash_in=()):
+            self.calls = []
+            self.polls = {}
+            self.endpoints = {}
+            self.created = set()
+            self.fail_endpoint = fail_endpoint
+            self.crash_in = set(crash_in)
+            self.lock = threading.Lock()
+        def _call(self, name, **kwargs):
+            with self.lock:
+                self.calls.append((name, kwargs))
+        def _create(self, name, resource, **kwargs):
+            if resource in self.created:
+                raise Exception(f'ResourceInUse: {resource} already exists')
+            self.created.add(resource)
+            self._call(name, **kwargs)
+            if name in self.crash_in:
+                # The process dies after SageMaker created the resource
+                self.crash_in.discard(name)
+                raise SystemExit(1)
+        def _poll(self, key, statuses):
+            self.polls[key] = self.polls.get(key, 0) + 1
+            return statuses[min(self.polls[key], len(statuses)) - 1]
+        def create_auto_ml_job(self, **kwargs):
+            self._create('create_auto_ml_job', kwargs['AutoMLJobName'], **kwargs)
+        def describe_auto_ml_job(self, AutoMLJobName):
+            return {
+                'AutoMLJobStatus': self._poll(AutoMLJobName, ['InProgress', 'InProgress', 'Completed']),
+                'BestCandidate': {
+                    'CandidateName': 'candidate-7',
+                    'FinalAutoMLJobObjectiveMetric': {'MetricName': 'AUC', 'Value': 0.97},
+                    'InferenceContainers': [
+                        {'Image': 'data-processing', 'ModelDataUrl': 's3://bucket/dpp.tar.gz', 'Environment': {}},
+                        {'Image': 'xgboost', 'ModelDataUrl': 's3://bucket/model.tar.gz'},
+                    ]
+                }
+            }
+        def list_candidates_for_auto_ml_job(self, **kwargs):
+            self._call('list_candidates_for_auto_ml_job', **kwargs)
+            return {'Candidates': [{'CandidateName': 'candidate-7', 'FinalAutoMLJobObjectiveMetric': {'Value': 0.97}}]}
+        def create_model(self, **kwargs):
+            self._create('create_model', kwargs['ModelName'], **kwargs)
+        def create_endpoint_config(self, **kwargs):
+            self._create('create_endpoint_config', kwargs['EndpointConfigName'], **kwargs)
+        def describe_endpoint(self, EndpointName):
+            if EndpointName not in self.endpoints:
+                raise Exception(f'Could not find endpoint "{EndpointName}"')
+            if self.fail_endpoint:
+                return {'EndpointStatus': 'Failed', 'FailureReason': 'capacity'}
+            return {'EndpointStatus': self._poll(EndpointName, ['Creating', 'InService']), 'EndpointArn': 'arn:endpoint'}
+        def create_endpoint(self, **kwargs):
+            self._call('create_endpoint', **kwargs)
+            self.endpoints[kwargs['EndpointName']] = kwargs
+        def update_endpoint(self, **kwargs):
+            self._call('update_endpoint', **kwargs)
+    
+    sleeps = []
+    wait_options = {'initial_delay': 1, 'max_delay': 4, 'sleep': sleeps.append}
+    checkpoint = str(tmp_path / 'retrain.json')
+    
+    # Endpoint deployment fails: training and model steps are checkpointed
+    stub = StubSageMaker(fail_endpoint=True)
+    with pytest.raises(StepFailed):
+        run_retrain(checkpoint, stub, wait_options=wait_options, log=None)
+    with open(checkpoint) as f:
+        state = json.load(f)
+    assert state['steps']['endpoint']['status'] == 'failed'
+    assert state['steps']['train']['output']['name'] == 'candidate-7'
+    
+    # The rerun resumes: no second AutoML job or model, only the failed step
+    stub.fail_endpoint = False
+    stub.calls.clear()
+    outputs = run_retrain(checkpoint, stub, wait_options=wait_options, log=None)
+    assert [name for name, _ in stub.calls] == ['update_endpoint']
+    assert outputs['endpoint']['endpoint_arn'] == 'arn:endpoint'
+    assert outputs['candidate_report'][0]['name'] == 'candidate-7'
+    
+    # The model serves the best candidate's containers, not a fixed S3 path
+    fresh = StubSageMaker()
+    train_data_uri, output_path = bucket_paths('prod-bucket')
+    run_retrain(checkpoint, fresh, fresh=True, wait_options=wait_options, log=None, role_arn='arn:role/prod',
+                train_data_uri=train_data_uri, output_path=output_path)
+    job = dict(fresh.calls)['create_auto_ml_job']
+    assert job['RoleArn'] == 'arn:role/prod' and job['OutputDataConfig']['S3OutputPath'] == 's3://prod-bucket/models/autopilot/'
+    assert job['InputDataConfig'][0]['DataSource']['S3DataSource']['S3Uri'] == 's3://prod-bucket/data/train/'
+    model = dict(fresh.calls)['create_model']
+    assert model['ExecutionRoleArn'] == 'arn:role/prod'
+    assert [c['ModelDataUrl'] for c in model['Containers']] == ['s3://bucket/dpp.tar.gz', 's3://bucket/model.tar.gz']
+    assert dict(fresh.calls)['create_endpoint_config']['ProductionVariants'][0]['ModelName'] == model['ModelName']
+    
+    # Crashes after a resource was created but before its step was
+    # checkpointed: the run id is already saved, so reruns reuse the resources
+    crashing = StubSageMaker(crash_in=['create_auto_ml_job', 'create_model', 'create_endpoint_config'])
+    crash_checkpoint = str(tmp_path / 'crash.json')
+    for _ in range(3):
+        with pytest.raises(SystemExit):
+            run_retrain(crash_checkpoint, crashing, wait_options=wait_options, log=None)
+        with open(crash_checkpoint) as f:
+            assert json.load(f)['run_id']
+    outputs = run_retrain(crash_checkpoint, crashing, wait_options=wait_options, log=None)
+    assert outputs['endpoint']['endpoint_arn'] == 'arn:endpoint'
+    created = [name for name, _ in crashing.calls if name.startswith('create_')]
+    assert created == ['create_auto_ml_job', 'create_model', 'create_endpoint_config', 'create_endpoint']
+    
+    # Polling backs off exponentially up to the cap
+    sleeps.clear()
+    statuses = iter(['InProgress'] * 5 + ['Completed'])
+    wait_for(lambda: {'Status': next(statuses)}, 'Status', {'Completed'}, {'Failed'}, **wait_options)
+    assert sleeps == [1, 2, 4, 4, 4]
+    with pytest.raises(WaiterError):
+        wait_for(lambda: {'Status': 'Failed'}, 'Status', {'Completed'}, {'Failed'}, **wait_options)
+
+def test_negative_downsampling(tmp_path):
+    """Test label-stratified negative downsampling with weights and calibration"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.downsample import ID_COLUMNS, calibrate, write_training_split
+    from ml_pipeline.glue_jobs.local_etl import clean_data, write_partitioned
+    
+    processed = clean_data(generate_transaction_data(n_samples=40000, fraud_ratio=0.01, fast=True, seed=21))
+    write_partitioned(processed, str(tmp_path / 'processed'), 'part-test')
+    metadata = write_training_split(str(tmp_path / 'processed'), str(tmp_path / 'train'), negative_ratio=10)
+    train = pd.read_parquet(tmp_path / 'train')
+    
+    # Every positive kept, negatives sampled down to about the requested ratio
+    n_positive = int(processed['is_fraud'].sum())
+    rate = metadata['negative_rate']
+    assert rate == pytest.approx(10 * n_positive / (len(processed) - n_positive))
+    assert train['is_fraud'].sum() == n_positive
+    assert (train['is_fraud'] == 0).sum() == pytest.approx(10 * n_positive, rel=0.1)
+    assert not set(ID_COLUMNS) & set(train.columns)
+    
+    # Importance weights restore the original row count
+    assert train['sample_weight'].sum() == pytest.approx(len(processed), rel=0.05)
+    
+    # Sampling is deterministic across reruns
+    assert write_training_split(str(tmp_path / 'processed'), str(tmp_path / 'train'), negative_ratio=10) == metadata
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'train'), train)
+    
+    # Keeping a fraction r of negatives shifts the odds by 1/r; calibration undoes it
+    p = np.linspace(0.001, 0.999, 50)
+    shifted = (p / rate) / (p / rate + 1 - p)
+    assert (shifted > p).all()
+    assert calibrate(shifted, rate) == pytest.approx(p)
+
+def test_schema_registry(tmp_path):
+    """Test the shared typed schema across generator, ETL and Parquet output"""
+    import pyarrow.dataset as ds
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.features.schema import FIELDS, apply_pandas_schema, arrow_schema, fill_unknown
+    from ml_pipeline.glue_jobs.local_etl import OUTPUT_COLUMNS, clean_data, iter_csv_batches, run_local_etl
+    
+    raw = generate_transaction_data(n_samples=5000, fraud_ratio=0.02, fast=True, seed=5)
+    raw.to_csv(tmp_path / 'raw.csv', index=False)
+    
+    # Raw CSV is read at schema types, categoricals dictionary encoded
+    batch = next(iter_csv_batches(str(tmp_path / 'raw.csv')))
+    assert batch['merchant_country'].dtype == 'category'
+    assert batch['is_fraud'].dtype == 'uint8'
+    
+    # Cleaned output is compact and several times smaller than wide dtypes
+    cleaned = clean_data(batch)
+    expected = {'category': 'category', 'uint8': 'uint8', 'int32': 'int32', 'float32': 'float32'}
+    for column in OUTPUT_COLUMNS:
+        if FIELDS[column] in expected:
+            assert str(cleaned[column].dtype) == expected[FIELDS[column]], column
+    wide = cleaned.astype({column: 'object' if str(dtype) == 'category' else 'int64'
+                           for column, dtype in cleaned.dtypes.items()
+                           if str(dtype) in ('category', 'uint8', 'int32')})
+    assert cleaned.memory_usage(deep=True).sum() * 2 < wide.memory_usage(deep=True).sum()
+    
+    # Missing categoricals are filled, unlabeled rows keep a nullable flag
+    filled = fill_unknown(pd.Series(['a', None], dtype='category'))
+    assert filled.tolist() == ['a', 'unknown']
+    unlabeled = apply_pandas_schema(pd.DataFrame({'is_fraud': [1, None]}))
+    assert str(unlabeled['is_fraud'].dtype) == 'UInt8'
+    names = apply_pandas_schema(pd.DataFrame({'merchant_name': ['a', None, float('nan')]}))['merchant_name']
+    assert names.isna().tolist() == [False, True, True]
+    
+    # Every written batch has the schema's Arrow types
+    run_local_etl(str(tmp_path / 'raw.csv'), str(tmp_path / 'processed'), block_size=1 << 18)
+    schema = ds.dataset(str(tmp_path / 'processed'), format='parquet').schema
+    expected_schema = arrow_schema(OUTPUT_COLUMNS)
+    assert all(schema.field(field.name).type == field.type for field in expected_schema)
+
+def test_layout_and_compaction(tmp_path, monkeypatch):
+    """Test date-partitioned, sorted output and journaled small-file compaction"""
+    import glob
+    import os
+    import pyarrow.parquet as pq
+    from data.generate_synthetic_data import generate_transaction_data
+    import threading
+    from ml_pipeline.glue_jobs import compaction
+    from ml_pipeline.glue_jobs.compaction import (
+        JOURNAL_NAME, compact, compact_partition, finish_compaction, plan_compaction, recover
+    )
+    from ml_pipeline.glue_jobs.downsample import date_filter
+    from ml_pipeline.glue_jobs.historical_stats import read_stats, update_historical_stats
+    from ml_pipeline.glue_jobs.local_etl import Layout, dataset_lock, read_processed, run_local_etl
+    
+    processed = str(tmp_path / 'processed')
+    stats_path = str(tmp_path / 'stats.json')
+    df = generate_transaction_data(n_samples=6000, fraud_ratio=0.02, fast=True, seed=9)
+    for i in range(3):
+        df.iloc[i::3].to_csv(tmp_path / f'raw_{i}.csv', index=False)
+        run_local_etl(str(tmp_path / f'raw_{i}.csv'), processed, block_size=1 << 17)
+    update_historical_stats(processed, str(tmp_path / 'state'), stats_path)
+    
+    # One directory per day, rows sorted by card inside every file
+    dates = sorted(os.listdir(processed))
+    assert len(dates) >= 30 and all(name.startswith('event_date=') for name in dates)
+    files = glob.glob(os.path.join(processed, '**', '*.parquet'), recursive=True)
+    cards = pq.read_table(files[0], columns=['card_hash'])['card_hash'].to_pylist()
+    assert cards == sorted(cards)
+    assert 'card_number' not in pq.read_schema(files[0]).names
+    
+    # Partition pruning by date
+    dataset = read_processed(processed)
+    assert dataset.count_rows(filter=date_filter('2000-01-01')) == 6000
+    first_day = dates[1].split('=')[1]
+    pruned = dataset.to_table(filter=date_filter(first_day, first_day), columns=['timestamp'])
+    assert 0 < pruned.num_rows < 6000
+    assert pruned['timestamp'].to_pandas().dt.strftime('%Y-%m-%d').eq(first_day).all()
+    
+    # Interrupted compactions roll forward; leftover hidden files are removed
+    partition = os.path.join(processed, dates[0])
+    open(os.path.join(partition, '.compacting-part-x.parquet'), 'w').close()
+    finish_compaction(partition)
+    assert not glob.glob(os.path.join(partition, '.compacting-*'))
+    
+    # A crash after the merged file is in place but before the inputs are
+    # deleted is rolled forward from the journal: no row is counted twice
+    def crash_before_deleting_inputs(partition):
+        for hidden in glob.glob(os.path.join(partition, '.compacting-*')):
+            os.replace(hidden, os.path.join(partition, os.path.basename(hidden)[len('.compacting-'):]))
+    inputs = sorted(glob.glob(os.path.join(partition, '*.parquet')))
+    monkeypatch.setattr(compaction, 'finish_compaction', crash_before_deleting_inputs)
+    compact_partition(partition, inputs)
+    monkeypatch.undo()
+    assert len(glob.glob(os.path.join(partition, '*.parquet'))) == len(inputs) + 1
+    assert recover(processed) == 1
+    rolled_forward = glob.glob(os.path.join(partition, '*.parquet'))
+    assert len(rolled_forward) == 1 and os.path.basename(rolled_forward[0]).startswith('part-compacted-')
+    assert read_processed(processed).count_rows() == 6000
+    
+    # Small files are merged per partition without losing or duplicating rows
+    layout = Layout(target_file_bytes=1 << 20)
+    assert plan_compaction(processed, layout)
+    stats = compact(processed, layout)
+    assert stats['files_out'] < stats['files_in']
+    assert stats['rows'] + pq.read_metadata(rolled_forward[0]).num_rows == 6000
+    assert not plan_compaction(processed, layout)
+    assert not glob.glob(os.path.join(processed, '**', JOURNAL_NAME), recursive=True)
+    compacted = read_processed(processed).to_table().to_pandas()
+    assert len(compacted) == 6000 and compacted['transaction_id'].is_unique
+    
+    # The stats rollup carries compacted files over instead of rebuilding
+    update = update_historical_stats(processed, str(tmp_path / 'state'), stats_path)
+    assert (update['files_read'], update['rebuilt']) == (0, False)
+    assert read_stats(stats_path)['total_transactions'] == 6000
+    
+    # Compaction waits for ETL appends holding the dataset lock
+    compacted_while_locked = threading.Event()
+    with dataset_lock(processed):
+        worker = threading.Thread(target=lambda: (compact(processed, Layout(target_file_bytes=1 << 20)),
+                                                  compacted_while_locked.set()))
+        worker.start()
+        assert not compacted_while_locked.wait(0.3)
+    worker.join()
+    assert compacted_while_locked.is_set()
+
+
+def test_data_validation(tmp_path, monkeypatch):
+    """Test mergeable profiling sketches and rule-based batch quarantine"""
+    import os
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import run_local_etl
+    from ml_pipeline.glue_jobs.validation import (
+        BatchValidator, HyperLogLog, Profile, TDigest, ValidationError
+    )
+    
+    # Sketches are accurate and merge like a single pass
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(4, 1, 200000)
+    digest = TDigest().add(values[:100000]).merge(TDigest().add(values[100000:]))
+    for q in (0.01, 0.5, 0.99):
+        assert digest.quantile(q) == pytest.approx(np.quantile(values, q), rel=0.02)
+    hashes = pd.util.hash_array(np.arange(50000))
+    hll = HyperLogLog().add_hashes(hashes[:30000]).merge(HyperLogLog().add_hashes(hashes[20000:]))
+    assert hll.count() == pytest.approx(50000, rel=0.05)
+    # NumPy 1.x has no bitwise_count; the fallback yields the same registers
+    monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    assert np.array_equal(HyperLogLog().add_hashes(hashes).registers, hll.registers)
+    monkeypatch.undo()
+    
+    df = generate_transaction_data(n_samples=20000, fraud_ratio=0.02, fast=True, seed=4)
+    profile = Profile.from_frame(df)
+    assert Profile.from_dict(profile.to_dict()).summary() == profile.summary()
+    summary = profile.summary()
+    assert summary['merchant_category']['distinct'] == 5
+    assert summary['is_fraud']['frequencies']['1'] == pytest.approx(0.02)
+    
+    # A reference built from accepted batches
+    reference = str(tmp_path / 'reference.json')
+    df.to_csv(tmp_path / 'good.csv', index=False)
+    validator = BatchValidator(reference, quarantine_path=str(tmp_path / 'quarantine'), log=None)
+    run_local_etl(str(tmp_path / 'good.csv'), str(tmp_path / 'processed'), validator=validator)
+    assert validator.stats['accepted'] == validator.stats['batches'] == 1
+    validator.update_reference()
+    
+    # Unknown categories and missing amounts are quarantined, not loaded
+    bad = generate_transaction_data(n_samples=2000, fraud_ratio=0.02, fast=True, seed=5)
+    bad['merchant_category'] = bad['merchant_category'].astype(object)
+    bad.loc[:300, 'merchant_category'] = 'crypto'
+    bad.loc[:100, 'amount'] = None
+    bad.to_csv(tmp_path / 'bad.csv', index=False)
+    validator = BatchValidator(reference, quarantine_path=str(tmp_path / 'quarantine'), log=None)
+    stats = run_local_etl(str(tmp_path / 'bad.csv'), str(tmp_path / 'processed'), validator=validator)
+    assert (stats['rows_out'], validator.stats['rows_quarantined']) == (0, 2000)
+    reports = [name for name in os.listdir(tmp_path / 'quarantine') if name.endswith('.json')]
+    with open(tmp_path / 'quarantine' / reports[0]) as f:
+        failed = {(violation['column'], violation['check']) for violation in json.load(f)['violations']}
+    assert failed == {('merchant_category', 'max_new_category_share'), ('amount', 'max_null_rate')}
+    
+    # Rows without ids stop the run
+    bad = bad.drop(columns=['amount']).assign(transaction_id=None)
+    bad.to_csv(tmp_path / 'no_ids.csv', index=False)
+    with pytest.raises(ValidationError):
+        run_local_etl(str(tmp_path / 'no_ids.csv'), str(tmp_path / 'processed'), validator=validator)
+
+def test_drift_monitor(tmp_path):
+    """Test O(1) drift histograms, snapshot merging and PSI/KS reports"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.monitoring.drift import (
+        DriftMonitor, drift_report, load_snapshots, merge_snapshots, snapshot_from_frame
+    )
+    from ml_pipeline.scoring.batch_score import prepare_transactions
+    
+    # Equal sizes: velocity features of synthetic data depend on the sample size
+    train = prepare_transactions(generate_transaction_data(n_samples=8000, fast=True, seed=6))
+    live = prepare_transactions(generate_transaction_data(n_samples=8000, fast=True, seed=7))
+    rng = np.random.default_rng(0)
+    reference = snapshot_from_frame(train, rng.beta(1, 20, len(train)))
+    
+    # Per-record updates land in the same bins as the vectorized path
+    probabilities = rng.beta(1, 20, len(live))
+    first, second = DriftMonitor(), DriftMonitor()
+    for record, probability in zip(live.iloc[:3000].to_dict('records'), probabilities[:3000]):
+        first.observe(record, probability)
+    second.observe_frame(live.iloc[3000:], probabilities[3000:])
+    merged = merge_snapshots(first.snapshot(), second.snapshot())
+    assert merged['counts'] == snapshot_from_frame(live, probabilities)['counts']
+    assert merged['events'] == 8000
+    
+    # Snapshots published by workers are merged back
+    first.maybe_publish(str(tmp_path / 'snapshots'))
+    second.maybe_publish(str(tmp_path / 'snapshots'))
+    assert len(load_snapshots(str(tmp_path / 'snapshots'), exclude=first.worker_id)) == 1
+    
+    # Same distribution: stable; shifted amounts and scores: alert
+    report = {row['feature']: row for row in drift_report(merged, reference)['features']}
+    assert all(row['status'] == 'ok' for row in report.values())
+    shifted = live.assign(amount=live['amount'] * 20)
+    report = drift_report(snapshot_from_frame(shifted, rng.beta(5, 5, len(live))), reference)
+    report = {row['feature']: row for row in report['features']}
+    assert report['amount']['status'] == report['predicted_probability']['status'] == 'alert'
+    assert report['amount']['ks'] > 0.5 and report['merchant_category']['ks'] is None
+    assert report['merchant_category']['status'] == 'ok'
+
+def test_threshold_evaluation(tmp_path):
+    """Test single-sort evaluation, streaming histograms and threshold publishing"""
+    from ml_pipeline.scoring.evaluation import (
+        ScoreHistogram, chargeback_losses, evaluate, evaluate_file, load_threshold, publish_threshold
+    )
+    
+    rng = np.random.default_rng(0)
+    labels = (rng.random(50000) < 0.02).astype(int)
+    scores = np.clip(rng.normal(0.2 + 0.4 * labels, 0.15), 0, 1).round(4)
+    amounts = rng.lognormal(4, 1, len(labels))
+    losses = chargeback_losses(labels, amounts)
+    result = evaluate(labels, scores, losses=losses)
+    
+    # Curves agree with a brute-force count at a few thresholds
+    for threshold in (0.1, 0.35, 0.6):
+        flagged = scores >= threshold
+        assert result.confusion(threshold) == {
+            'tp': (flagged & (labels == 1)).sum(), 'fp': (flagged & (labels == 0)).sum(),
+            'fn': (~flagged & (labels == 1)).sum(), 'tn': (~flagged & (labels == 0)).sum()}
+    pos, neg = scores[labels == 1], scores[labels == 0]
+    pairwise = ((pos[:, None] > neg[None, :]).mean() + 0.5 * (pos[:, None] == neg[None, :]).mean())
+    assert result.roc_auc() == pytest.approx(pairwise)
+    top = np.sort(scores)[::-1][200]
+    assert result.precision_at_k((scores > top).sum()) == pytest.approx(labels[scores > top].mean())
+    
+    # The chosen threshold minimizes cost and beats the hard-coded 0.5
+    decision = result.best_threshold(review_cost=5.0)
+    costs = [5.0 * (scores >= t).sum() + losses[scores < t].sum() for t in np.unique(scores)]
+    assert decision['expected_cost'] == pytest.approx(min(costs))
+    assert decision['expected_cost'] < decision['cost_at_default']
+    
+    # Streaming over chunked prediction files matches the exact evaluation
+    for i, chunk in enumerate(np.array_split(np.arange(len(labels)), 4)):
+        pd.DataFrame({'is_fraud': labels[chunk], 'amount': amounts[chunk],
+                      'predicted_probability': scores[chunk]}).to_parquet(tmp_path / f'part-{i}.parquet')
+    streamed = evaluate_file(str(tmp_path), bins=10000).evaluation()
+    assert streamed.roc_auc() == pytest.approx(result.roc_auc(), abs=1e-6)
+    assert streamed.best_threshold()['expected_cost'] == pytest.approx(decision['expected_cost'])
+    halves = ScoreHistogram(1000).add(labels[:100], scores[:100])
+    halves.merge(ScoreHistogram(1000).add(labels[100:], scores[100:]))
+    whole = ScoreHistogram(1000).add(labels, scores)
+    assert halves.evaluation().roc_auc() == pytest.approx(whole.evaluation().roc_auc())
+    
+    # Published thresholds reach the scoring path; a missing file falls back
+    path = str(tmp_path / 'threshold.json')
+    publish_threshold(decision, path, result.summary())
+    assert load_threshold(path) == decision['threshold']
+    assert load_threshold(str(tmp_path / 'missing.json')) == 0.5
+
+def test_spark_etl_plan(tmp_path):
+    """Test the explicit-schema, single-projection Spark plan against the local engine"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.features.schema import RAW_COLUMNS
+    from ml_pipeline.glue_jobs import etl_job, local_etl
+    
+    # DynamicFrames are only needed when Glue job bookmarks are on
+    assert etl_job.use_job_bookmarks(['etl_job.py', '--job-bookmark-option', 'job-bookmark-enable'])
+    assert not etl_job.use_job_bookmarks(['etl_job.py', '--job-bookmark-option', 'job-bookmark-disable'])
+    raw = generate_transaction_data(n_samples=2000, fraud_ratio=0.02, fast=True, seed=8)
+    assert list(raw.columns[:len(RAW_COLUMNS)]) == RAW_COLUMNS
+    raw.to_csv(tmp_path / 'raw.csv', index=False)
+    
+    pytest.importorskip('pyspark')
+    from pyspark.sql import SparkSession
+    
+    spark = etl_job.configure_spark(SparkSession.builder.master('local[2]').getOrCreate())
+    assert spark.conf.get('spark.sql.adaptive.enabled') == 'true'
+    df = etl_job.clean_data(etl_job.read_raw(spark, str(tmp_path / 'raw.csv')))
+    
+    # Dedup and velocity windows share one shuffle; casts, fills and features
+    # are one projection between them
+    plan = df._jdf.queryExecution().optimizedPlan().toString()
+    assert plan.count('Project ') <= 5
+    assert df._jdf.queryExecution().executedPlan().toString().count('Exchange ') == 1
+    
+    expected = local_etl.clean_data(raw).sort_values('transaction_id').reset_index(drop=True)
+    actual = df.toPandas().sort_values('transaction_id').reset_index(drop=True)
+    assert list(actual.columns) == list(expected.columns)
+    for column in ['amount_log', 'hour', 'is_weekend', 'is_high_risk_country', 'card_txn_count_24h']:
+        np.testing.assert_allclose(actual[column].astype(float), expected[column].astype(float), rtol=1e-6)
+
+def test_rules_prefilter(tmp_path):
+    """Test vectorized and per-record rule evaluation and model-call short-circuits"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.scoring.batch_score import score_frame
+    from ml_pipeline.scoring.endpoint_client import ScoringClient
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    from ml_pipeline.scoring.rules import DEFAULT_RULES, RuleSet
+    
+    df = clean_data(generate_transaction_data(n_samples=5000, fraud_ratio=0.02, fast=True, seed=9))
+    df.loc[df.index[:50], ['amount', 'merchant_country', 'transaction_type']] = [9000.0, 'Nigeria', 'online']
+    df['is_high_risk_country'] = df['merchant_country'].isin(['Nigeria']).astype('uint8')
+    df['is_online_transaction'] = (df['transaction_type'] == 'online').astype('uint8')
+    
+    # Both compiled forms agree row by row
+    rules = RuleSet()
+    decided, probabilities = rules.apply(df)
+    names = rules.rule_names(decided)
+    records = RuleSet()
+    for name, record in zip(names, df.to_dict('records')):
+        match = records.match(record)
+        assert (match[0] if match else None) == name
+    assert rules.stats()['hits'] == records.stats()['hits']
+    assert rules.stats()['hits']['large_online_high_risk_country'] >= 50
+    assert rules.stats()['hits']['small_in_store'] > 0
+    assert set(probabilities[decided >= 0]) <= {0.0, 0.9, 1.0}
+    with pytest.raises(ValueError):
+        RuleSet([{'name': 'bad', 'outcome': 'block', 'when': DEFAULT_RULES[0]['when']}])
+    
+    # Decided rows never reach the model; the rest are scored by it
+    class CountingEndpoint(LocalEndpoint):
+        records = 0
+        
+        def invoke_endpoint(self, **kwargs):
+            CountingEndpoint.records += kwargs['Body'].count(b'\n') or 1
+            return super().invoke_endpoint(**kwargs)
+    
+    model = LocalModel.train(df)
+    scored = score_frame(CountingEndpoint(model), df, records_per_request=256, rules=RuleSet())
+    assert CountingEndpoint.records == (decided < 0).sum()
+    np.testing.assert_allclose(scored[decided >= 0], probabilities[decided >= 0])
+    np.testing.assert_allclose(scored[decided < 0], model.predict_proba(df[decided < 0]), rtol=1e-5)
+    
+    client = ScoringClient(CountingEndpoint(model), rules=RuleSet())
+    CountingEndpoint.records = 0
+    record = df.iloc[0].to_dict()
+    assert client.decide(record) == (1.0, 'large_online_high_risk_country')
+    assert CountingEndpoint.records == 0 and client.latency_summary()['rule_decided'] == 1
+    client.close()
+    
+    # Rule scores stay out of the drift prediction histogram and are counted apart
+    from ml_pipeline.monitoring.drift import PREDICTION, DriftMonitor
+    scored, rule_names = score_frame(LocalEndpoint(model), df, rules=RuleSet(), return_rules=True)
+    assert list(rule_names) == list(names)
+    bulk, single = DriftMonitor(), DriftMonitor()
+    bulk.observe_frame(df, scored, scored=pd.isna(rule_names))
+    for record, probability, rule in zip(df.to_dict('records'), scored, rule_names):
+        single.observe(record, probability, rule)
+    for monitor in (bulk, single):
+        snapshot = monitor.snapshot()
+        assert snapshot['events'] == len(df) and snapshot['rule_decided'] == (decided >= 0).sum()
+        assert sum(snapshot['counts'][PREDICTION]) == (decided < 0).sum()
+        assert sum(snapshot['counts']['amount']) == len(df)
+    assert bulk.snapshot()['counts'] == single.snapshot()['counts']
+    
+    # The training profile leaves rule-decided rows out of its score histogram too
+    from ml_pipeline.monitoring.drift import build_reference
+    df.to_parquet(tmp_path / 'train.parquet')
+    model.save(str(tmp_path / 'model.json'))
+    reference = build_reference(str(tmp_path / 'train.parquet'), str(tmp_path / 'model.json'), batch_size=500,
+                                rules=RuleSet())
+    assert reference['rule_decided'] == (decided >= 0).sum()
+    assert sum(reference['counts'][PREDICTION]) == (decided < 0).sum()
+    
+    # ... and out of threshold evaluation
+    from ml_pipeline.scoring.evaluation import evaluate_file
+    df.assign(predicted_probability=scored, rule=pd.Series(rule_names, dtype='string')).to_parquet(tmp_path / 'scores.parquet')
+    histogram = evaluate_file(str(tmp_path / 'scores.parquet'))
+    assert histogram.positives.sum() + histogram.negatives.sum() == (decided < 0).sum()
+
+def test_profile_store(tmp_path):
+    """Test building memory-mapped profiles and enriching records and frames"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.features.profiles import PROFILE_FEATURES, ProfileTable, Profiles, build_profiles, key_hash
+    from ml_pipeline.features.schema import hash_card_number
+    from ml_pipeline.glue_jobs.local_etl import run_local_etl
+    from ml_pipeline.scoring.local_model import LocalModel
+    
+    df = generate_transaction_data(n_samples=20000, fraud_ratio=0.02, fast=True, seed=11)
+    df.to_csv(tmp_path / 'raw.csv', index=False)
+    run_local_etl(str(tmp_path / 'raw.csv'), str(tmp_path / 'processed'))
+    stats = build_profiles(str(tmp_path / 'processed'), str(tmp_path / 'profiles'))
+    assert stats['rows'] == 20000
+    assert stats['cards'] == df['card_number'].astype(str).nunique()
+    
+    # Point lookups by card hash match the aggregates
+    cards = ProfileTable(str(tmp_path / 'profiles' / 'cards.prof'))
+    card = df['card_number'].astype(str).value_counts().index[0]
+    assert cards.get(card) is None
+    assert cards.get(hash_card_number(card))['count'] == df['card_number'].astype(str).value_counts().iloc[0]
+    assert cards.get('no-such-card') is None
+    
+    # Key hashes are part of the file format and must not change between processes
+    assert key_hash('Acme Corp') == 1085370995650013692 and key_hash(12) == key_hash('12')
+    
+    # Record and frame enrichment agree; unknown keys have no history
+    profiles = Profiles(str(tmp_path / 'profiles'))
+    sample = df.head(500).assign(card_number=lambda d: d['card_number'].astype(str))
+    sample.loc[sample.index[:10], 'card_number'] = 'unknown-card'
+    enriched = profiles.enrich_frame(sample.copy())
+    for i, record in enumerate(sample.to_dict('records')):
+        features = profiles.enrich_record(record)
+        for name in PROFILE_FEATURES:
+            assert features[name] == pytest.approx(enriched[name].iloc[i], rel=1e-5, abs=1e-6)
+    assert (enriched[['card_history_count', 'card_amount_zscore']].iloc[:10] == 0).all().all()
+    assert (enriched['card_history_count'].iloc[10:] > 0).all()
+    
+    # A model trained on enriched rows keeps the profile features through save and load
+    model = LocalModel.train(enriched)
+    model.save(str(tmp_path / 'model.json'))
+    loaded = LocalModel.load(str(tmp_path / 'model.json'))
+    assert loaded.encoder.numeric_features[-len(PROFILE_FEATURES):] == PROFILE_FEATURES
+    assert loaded.predict_proba(enriched) == pytest.approx(model.predict_proba(enriched), abs=1e-6)
+    
+    # A rebuild over less history is picked up without a restart
+    assert not profiles.reload_if_changed()
+    build_profiles(str(tmp_path / 'processed'), str(tmp_path / 'profiles'), end_date='1900-01-01')
+    assert profiles.reload_if_changed()
+    assert profiles.enrich_record(sample.iloc[20].to_dict())['card_history_count'] == 0
+
+def test_scenario_simulation(tmp_path):
+    """Test entity-based, time-ordered simulation with fraud bursts"""
+    import os
+    from data.simulate_scenarios import simulate_transactions, write_scenario_dataset
+    from ml_pipeline.glue_jobs.local_etl import clean_data, run_local_etl
+    
+    options = dict(days=10, seed=3, shard_cards=1000, now='2024-03-01', card_testing_rate=0.02,
+                   takeover_rate=0.02, scenario_column=True)
+    df = simulate_transactions(3000, **options)
+    assert df['timestamp'].is_monotonic_increasing
+    assert df['transaction_id'].is_unique
+    assert df['timestamp'].min() >= pd.Timestamp('2024-02-20') and df['timestamp'].max() < pd.Timestamp('2024-03-01')
+    pd.testing.assert_frame_equal(df, simulate_transactions(3000, **options))
+    
+    # A fixed card population with repeat spending and valid card numbers
+    cards = df['card_number'].astype(str)
+    assert cards.nunique() <= 3000 and len(df) > 5 * cards.nunique()
+    digits = np.array([[int(c) for c in number] for number in cards.unique()[:200]])
+    doubled = digits[:, -2::-2] * 2
+    checksum = np.where(doubled > 9, doubled - 9, doubled).sum(axis=1) + digits[:, ::-2].sum(axis=1)
+    assert (checksum % 10 == 0).all()
+    
+    # Fraud comes from the scenarios, as bursts the velocity features see
+    assert (df['is_fraud'] == (df['scenario'] != 'legitimate')).all()
+    assert set(df['scenario'].unique()) == {'legitimate', 'card_testing', 'account_takeover'}
+    cleaned = clean_data(df.drop(columns=['scenario']))
+    scenario = df.set_index('transaction_id')['scenario'].reindex(cleaned['transaction_id'].astype(str)).to_numpy()
+    burst = cleaned['card_txn_count_1h'].to_numpy()
+    assert np.median(burst[scenario == 'card_testing']) >= 5
+    assert np.median(burst[scenario == 'legitimate']) <= 2
+    
+    # Sharded output is one time-ordered file per shard and day
+    summary = write_scenario_dataset(2000, str(tmp_path / 'raw'), days=3, seed=1, shard_cards=1000,
+                                     n_workers=2, file_format='csv')
+    files = sorted(os.listdir(tmp_path / 'raw'))
+    assert summary['shards'] == 2 and len(files) in (6, 8)
+    assert files[0].startswith('part-') and files[0].endswith('-00000-0.csv')
+    stats = run_local_etl(str(tmp_path / 'raw'), str(tmp_path / 'processed'))
+    assert stats['rows_in'] == stats['rows_out'] == summary['rows']
+    
+    # Ids differ between seeds and runs, so a second batch is not deduplicated away
+    other = simulate_transactions(1000, **dict(options, seed=4))
+    later = simulate_transactions(1000, **dict(options, now='2024-03-02'))
+    assert not set(df['transaction_id']) & (set(other['transaction_id']) | set(later['transaction_id']))
+
+def test_tracing(tmp_path):
+    """Test spans, histograms, exporters and pipeline instrumentation"""
+    from data.generate_synthetic_data import generate_transaction_data
+    from ml_pipeline.glue_jobs.local_etl import clean_data
+    from ml_pipeline.monitoring import tracing
+    from ml_pipeline.scoring.endpoint_client import ScoringClient
+    from ml_pipeline.scoring.local_model import LocalEndpoint, LocalModel
+    
+    # Disabled tracers hand out the shared no-op span and record nothing
+    tracer = tracing.Tracer()
+    assert tracer.span('stage') is tracing.NOOP_SPAN
+    tracer.count('rows', 5)
+    assert tracer.summary() == [] and tracer.counters == {}
+    
+    # Spans nest, record errors and feed per-stage histograms
+    tracer.enabled = True
+    with tracer.span('outer', rows=3) as outer:
+        with tracer.span('inner'):
+            pass
+        with pytest.raises(ValueError):
+            with tracer.span('inner'):
+                raise ValueError('boom')
+    for seconds in (0.001, 0.002, 0.004, 0.2):
+        tracer.observe('manual', seconds)
+    tracer.count('rows', 5)
+    tracer.count('bytes', 123456789)
+    with tracer.span('clash', type='custom', duration_ms=-1):
+        pass
+    clash = tracer.spans.pop()
+    assert clash['type'] == 'span' and clash['duration_ms'] >= 0
+    spans = {(span['name'], span.get('error')): span for span in tracer.spans}
+    assert spans[('inner', None)]['parent_id'] == outer.span_id == spans[('outer', None)]['trace_id']
+    assert spans[('inner', 'ValueError')]['trace_id'] == outer.span_id
+    stages = {row['stage']: row for row in tracer.summary()}
+    assert stages['inner']['count'] == 2 and stages['outer']['count'] == 1
+    assert 1.0 <= stages['manual']['p50_ms'] <= 2.5 and stages['manual']['max_ms'] == pytest.approx(200)
+    
+    # Exporters: JSON lines drain the span buffer; Prometheus buckets are cumulative
+    assert tracer.write_jsonl(tmp_path / 'trace.jsonl') == 3
+    assert tracer.write_jsonl(tmp_path / 'trace.jsonl') == 0
+    records = [json.loads(line) for line in open(tmp_path / 'trace.jsonl')]
+    assert [record['type'] for record in records] == ['span'] * 3 + ['metrics'] * 2
+    assert records[-1]['counters'] == {'rows': 5, 'bytes': 123456789}
+    text = tracer.prometheus_text()
+    buckets = [int(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('fraudsage_stage_seconds_bucket{stage="manual"')]
+    assert buckets == sorted(buckets) and buckets[-1] == 4
+    assert 'fraudsage_stage_seconds_count{stage="manual"} 4' in text
+    assert 'fraudsage_rows_total 5' in text
+    assert 'fraudsage_bytes_total 123456789' in text
+    
+    # The pipeline's own stages show up once the global tracer is on
+    tracing.enable()
+    tracing.TRACER.reset()
+    try:
+        df = clean_data(generate_transaction_data(n_samples=2000, fraud_ratio=0.02, fast=True, seed=2))
+        client = ScoringClient(LocalEndpoint(LocalModel.train(df)), cache_size=0)
+        client.predict_many(df.head(20).to_dict('records'))
+        client.close()
+        stages = {row['stage']: row['count'] for row in tracing.TRACER.summary()}
+    finally:
+        tracing.enable(False)
+        tracing.TRACER.reset()
+    for stage in ('generate.fast', 'etl.clean_data', 'etl.clean_data.dedup', 'etl.clean_data.velocity'):
+        assert stages[stage] == 1
+    for stage in ('score.serialize', 'score.invoke', 'score.deserialize'):
+        assert stages[stage] == 20